@@ -1,9 +1,25 @@
-from flask import Flask, render_template
-import subprocess
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
+import json
 import os
+import threading
+
+import chrome_pool
+from jobs import GerenciadorJobs, FilaCheia, PERFIS_CHROME
 
 app = Flask(__name__)
 CAMINHO_CODIGOS = os.path.join(os.path.dirname(__file__), "codigos")
+pool = chrome_pool.PoolChrome() if chrome_pool.ATIVO else None
+jobs = GerenciadorJobs(CAMINHO_CODIGOS, pool=pool)
+if pool is not None and chrome_pool.AQUECER:
+    threading.Thread(target=pool.aquecer, args=(chrome_pool.AQUECER,), daemon=True).start()
+
+def _enfileirar(script):
+    try:
+        job, novo = jobs.enfileirar(script)
+    except FilaCheia as e:
+        return jsonify({"erro": str(e)}), 503
+    msg = f"Script {script} enfileirado!" if novo else f"Script {script} já está na fila."
+    return jsonify({"job_id": job.id, "status": job.status, "mensagem": msg}), 202
 
 @app.route("/")
 def index():
@@ -11,24 +27,88 @@ def index():
 
 @app.route("/automacao_fsist_recebidas")
 def automacao_fsist_recebidas():
-    subprocess.Popen(["python", os.path.join(CAMINHO_CODIGOS, "automacao_fsist_recebidas.py")])
-    return "Script automacao_fsist_recebidas.py iniciado!"
+    return _enfileirar("automacao_fsist_recebidas.py")
 
 @app.route("/nfse_bot")
 def nfse_bot():
-    subprocess.Popen(["python", os.path.join(CAMINHO_CODIGOS, "nfse_bot.py")])
-    return "Script nfse_bot.py iniciado!"
+    return _enfileirar("nfse_bot.py")
 
 @app.route("/nfsenacional_emitidasrecebidas")
 def nfsenacional_emitidasrecebidas():
-    subprocess.Popen(["python", os.path.join(CAMINHO_CODIGOS, "nfsenacional_emitidasrecebidas.py")])
-    return "Script nfsenacional_emitidasrecebidas.py iniciado!"
+    return _enfileirar("nfsenacional_emitidasrecebidas.py")
 
 @app.route("/osasco_fluxo")
 def osasco_fluxo():
-    subprocess.Popen(["python", os.path.join(CAMINHO_CODIGOS, "osasco_fluxo.py")])
-    return "Script osasco_fluxo.py iniciado!"
+    return _enfileirar("osasco_fluxo.py")
+
+@app.route("/jobs")
+def listar_jobs():
+    return jsonify(jobs.listar())
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.obter(job_id)
+    if job is None:
+        return jsonify({"erro": "Job não encontrado."}), 404
+    dados = job.to_dict()
+    dados["ultimas_linhas"] = [t for _, t in job.linhas_desde(max(0, dados["linhas"] - 20))]
+    return jsonify(dados)
+
+@app.route("/jobs/<job_id>/stream")
+def job_stream(job_id):
+    """Server-Sent Events com a saída do script; retoma a partir do Last-Event-ID."""
+    job = jobs.obter(job_id)
+    if job is None:
+        return jsonify({"erro": "Job não encontrado."}), 404
+    try:
+        inicio = max(0, int(request.headers.get("Last-Event-ID") or request.args.get("desde") or 0))
+    except ValueError:
+        inicio = 0   # cursor inválido do cliente: manda desde o começo
+
+    def gerar(ultimo):
+        while True:
+            linhas, fim = job.aguardar_linhas(ultimo, timeout=15)
+            for seq, texto in linhas:
+                ultimo = seq
+                yield f"id: {seq}\ndata: {texto}\n\n"
+            if fim and not linhas:
+                yield f"event: fim\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            if not linhas:
+                yield ": keepalive\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(gerar(inicio)), mimetype="text/event-stream", headers=headers)
+
+@app.route("/backfill", methods=["GET", "POST"])
+def criar_backfill():
+    """Reprocessa um intervalo de competências: ?script=nfse_bot&inicio=2024-01&fim=2024-12[&paralelo=2]"""
+    script = request.values.get("script", "")
+    script = script if script.endswith(".py") else f"{script}.py"
+    if script not in PERFIS_CHROME:
+        return jsonify({"erro": f"Script desconhecido: {script}"}), 400
+    try:
+        paralelo = int(request.values["paralelo"]) if request.values.get("paralelo") else None
+        bf = jobs.backfill(script, request.values.get("inicio", ""), request.values.get("fim", ""), paralelo)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    return jsonify(bf.to_dict()), 202
+
+@app.route("/backfill/<bf_id>")
+def backfill_status(bf_id):
+    bf = jobs.obter_backfill(bf_id)
+    if bf is None:
+        return jsonify({"erro": "Backfill não encontrado."}), 404
+    return jsonify(bf.to_dict())
+
+@app.route("/backfills")
+def listar_backfills():
+    return jsonify(jobs.listar_backfills())
+
+@app.route("/pool")
+def pool_status():
+    return jsonify({"ativo": pool is not None, "sessoes": pool.listar() if pool else []})
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # pega a porta correta do Render
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=port)
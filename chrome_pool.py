@@ -0,0 +1,234 @@
+# chrome_pool.py — pool de Chromes "quentes" compartilhados entre as execuções.
+# Cada sessão é um Chrome já aberto com --remote-debugging-port e um perfil
+# persistente (cookies/login sobrevivem entre os meses). O jobs.py empresta uma
+# sessão ao job e passa o endereço em CHROME_DEBUGGER_ADDRESS; os scripts se
+# conectam a ela (codigos/navegador.py) em vez de abrir um Chrome novo.
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+# ========= CONFIG =========
+ATIVO = os.environ.get("POOL_CHROME", "0") == "1"
+MAX_SESSOES = int(os.environ.get("POOL_MAX_SESSOES", 4))
+OCIOSO_SEG = int(os.environ.get("POOL_OCIOSO_SEG", 3600))         # fecha sessões paradas há mais tempo
+PERFIS_DIR = Path(os.environ.get("POOL_PERFIS_DIR", Path.home() / ".automacao" / "chrome"))
+AQUECER = [p.strip() for p in os.environ.get("POOL_AQUECER", "").split(",") if p.strip()]
+
+CHROME_CANDIDATOS = [
+    os.environ.get("CHROME_BIN", ""),
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+    "/usr/bin/google-chrome",
+    "/usr/bin/google-chrome-stable",
+    "/usr/bin/chromium",
+    "/usr/bin/chromium-browser",
+    "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+]
+
+
+class PoolEsgotado(Exception):
+    pass
+
+
+def localizar_chrome() -> str:
+    for c in CHROME_CANDIDATOS:
+        if c and Path(c).exists():
+            return c
+    for nome in ("google-chrome", "chrome", "chromium"):
+        achado = shutil.which(nome)
+        if achado:
+            return achado
+    raise FileNotFoundError("Chrome não encontrado (defina CHROME_BIN).")
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class SessaoChrome:
+    def __init__(self, perfil: str, indice: int):
+        self.perfil = perfil
+        self.nome = f"{perfil}-{indice}"
+        self.porta = _porta_livre()
+        self.user_data_dir = PERFIS_DIR / self.nome
+        self.processo = None
+        self.em_uso = False
+        self.ultimo_uso = time.time()
+
+    @property
+    def endereco(self) -> str:
+        return f"127.0.0.1:{self.porta}"
+
+    def iniciar(self, timeout=30):
+        self.user_data_dir.mkdir(parents=True, exist_ok=True)
+        self.processo = subprocess.Popen([
+            localizar_chrome(),
+            f"--remote-debugging-port={self.porta}",
+            f"--user-data-dir={self.user_data_dir}",
+            "--no-first-run",
+            "--no-default-browser-check",
+            "--start-maximized",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        end = time.time() + timeout
+        while time.time() < end:
+            if self.saudavel():
+                return self
+            time.sleep(0.2)
+        self.encerrar()
+        raise TimeoutError(f"Chrome do perfil {self.nome} não respondeu na porta {self.porta}.")
+
+    def saudavel(self) -> bool:
+        if self.processo is None or self.processo.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f"http://{self.endereco}/json/version", timeout=1) as r:
+                return "webSocketDebuggerUrl" in json.load(r)
+        except Exception:
+            return False
+
+    def encerrar(self):
+        if self.processo and self.processo.poll() is None:
+            self.processo.terminate()
+            try:
+                self.processo.wait(10)
+            except subprocess.TimeoutExpired:
+                self.processo.kill()
+
+    def to_dict(self) -> dict:
+        return {
+            "nome": self.nome,
+            "endereco": self.endereco,
+            "em_uso": self.em_uso,
+            "ocioso_seg": 0 if self.em_uso else round(time.time() - self.ultimo_uso),
+        }
+
+
+class PoolChrome:
+    def __init__(self, max_sessoes: int = MAX_SESSOES, ocioso_seg: int = OCIOSO_SEG):
+        self.max_sessoes = max_sessoes
+        self.ocioso_seg = ocioso_seg
+        self._cond = threading.Condition()
+        self._sessoes = []
+        self._faxina = None
+
+    def emprestar(self, perfil: str, timeout: float = 600) -> SessaoChrome:
+        """Devolve uma sessão saudável do perfil (reaproveita uma ociosa ou abre outra)."""
+        self._iniciar_faxina()
+        end = time.time() + timeout
+        # o lock só escolhe/reserva; teste de saúde (HTTP) e encerramento (até 10 s) rodam fora dele
+        while True:
+            livre = nova = vitima = None
+            with self._cond:
+                livre = next((s for s in self._sessoes if s.perfil == perfil and not s.em_uso), None)
+                if livre is not None:
+                    livre.em_uso = True
+                elif len(self._sessoes) < self.max_sessoes:
+                    nova = SessaoChrome(perfil, self._proximo_indice(perfil))
+                    nova.em_uso = True
+                    self._sessoes.append(nova)
+                else:
+                    vitima = self._despejar_um_ocioso()
+                    if vitima is None:
+                        restante = end - time.time()
+                        if restante <= 0:
+                            raise PoolEsgotado(f"Nenhuma sessão de Chrome livre para '{perfil}'.")
+                        self._cond.wait(restante)
+            if livre is not None:
+                if livre.saudavel():
+                    return livre
+                self._descartar(livre)
+            elif vitima is not None:
+                vitima.encerrar()
+            elif nova is not None:
+                try:
+                    return nova.iniciar()
+                except Exception:
+                    self._descartar(nova)
+                    raise
+
+    def devolver(self, sessao: SessaoChrome):
+        with self._cond:
+            sessao.em_uso = False
+            sessao.ultimo_uso = time.time()
+            self._cond.notify_all()
+
+    def aquecer(self, perfis):
+        for perfil in perfis:
+            try:
+                self.devolver(self.emprestar(perfil, timeout=5))
+            except Exception as e:
+                print(f"[POOL] Não consegui aquecer '{perfil}': {e}", flush=True)
+
+    def listar(self) -> list:
+        with self._cond:
+            return [s.to_dict() for s in self._sessoes]
+
+    def encerrar_tudo(self):
+        with self._cond:
+            sessoes, self._sessoes = self._sessoes, []
+        for s in sessoes:
+            s.encerrar()
+
+    # ---------- internos ----------
+    def _proximo_indice(self, perfil: str) -> int:
+        usados = {s.nome for s in self._sessoes}
+        i = 0
+        while f"{perfil}-{i}" in usados:
+            i += 1
+        return i
+
+    def _despejar_um_ocioso(self):
+        """Tira da lista a sessão ociosa mais antiga (chamar com o lock; quem chama encerra fora dele)."""
+        ociosos = [s for s in self._sessoes if not s.em_uso]
+        if not ociosos:
+            return None
+        s = min(ociosos, key=lambda x: x.ultimo_uso)
+        self._sessoes.remove(s)
+        return s
+
+    def _descartar(self, s: SessaoChrome):
+        """Encerra (fora do lock) e tira da lista uma sessão reservada que não serve."""
+        s.encerrar()
+        with self._cond:
+            if s in self._sessoes:
+                self._sessoes.remove(s)
+            self._cond.notify_all()
+
+    def _iniciar_faxina(self):
+        with self._cond:
+            if self._faxina:
+                return
+            self._faxina = threading.Thread(target=self._loop_faxina, name="chrome-pool-faxina", daemon=True)
+            self._faxina.start()
+
+    def _loop_faxina(self):
+        while True:
+            time.sleep(30)
+            with self._cond:
+                agora = time.time()
+                livres = [s for s in self._sessoes if not s.em_uso]
+                vencidas = [s for s in livres if agora - s.ultimo_uso > self.ocioso_seg]
+                checar = [s for s in livres if s not in vencidas]
+                for s in vencidas:
+                    self._sessoes.remove(s)
+                for s in checar:
+                    s.em_uso = True        # reservadas enquanto o teste roda fora do lock
+            mortas = [s for s in checar if not s.saudavel()]
+            for s in vencidas + mortas:
+                s.encerrar()
+            with self._cond:
+                for s in checar:
+                    if s in mortas:
+                        self._sessoes.remove(s)
+                    else:
+                        s.em_uso = False
+                self._cond.notify_all()
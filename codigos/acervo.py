@@ -0,0 +1,222 @@
+# acervo.py — base local (SQLite) dos XMLs fiscais baixados.
+# Cada XML (solto, numa pasta ou dentro de um ZIP) é lido uma única vez: o
+# arquivo fica registrado por caminho/tamanho/mtime e sha256, e cada nota vira
+# uma linha em `documentos`, pela chave de acesso. Consultas por CNPJ do
+# prestador/tomador, competência ou valor usam índices, sem varrer pastas.
+#
+# Uso nos bots:
+#     ingerir_no_acervo(FINAL_DIR, "FSist")
+# Linha de comando:
+#     python acervo.py ingerir <pasta|arquivo> [origem]
+#     python acervo.py totais 2025-09 [cnpj]
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from downloads import SAIDA_DIR
+from xml_fiscal import CAMPOS, ler_documentos
+
+ACERVO_DB = Path(os.environ.get("ACERVO_DB") or SAIDA_DIR / "acervo_fiscal.sqlite")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    chave           TEXT PRIMARY KEY,
+    modelo          TEXT,
+    numero          TEXT,
+    emissao         TEXT,
+    competencia     TEXT,
+    cnpj_prestador  TEXT,
+    nome_prestador  TEXT,
+    cnpj_tomador    TEXT,
+    nome_tomador    TEXT,
+    valor           REAL,
+    iss             REAL,
+    sha256          TEXT,
+    arquivo         TEXT,
+    origem          TEXT,
+    ingerido_em     TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_doc_prestador   ON documentos (cnpj_prestador, competencia);
+CREATE INDEX IF NOT EXISTS ix_doc_tomador     ON documentos (cnpj_tomador, competencia);
+CREATE INDEX IF NOT EXISTS ix_doc_competencia ON documentos (competencia);
+CREATE INDEX IF NOT EXISTS ix_doc_valor       ON documentos (valor);
+CREATE INDEX IF NOT EXISTS ix_doc_sha         ON documentos (sha256);
+CREATE TABLE IF NOT EXISTS arquivos (
+    caminho   TEXT PRIMARY KEY,
+    tamanho   INTEGER,
+    mtime     REAL,
+    sha256    TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_arq_sha ON arquivos (sha256);
+"""
+
+
+class Acervo:
+    def __init__(self, caminho=ACERVO_DB):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        # vários jobs (processos) podem gravar ao mesmo tempo: WAL + espera no lock
+        self._db = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(ESQUEMA)
+        self._lock = threading.Lock()
+
+    # ---------- ingestão ----------
+    def ingerir(self, caminho, origem: str = "") -> int:
+        """Ingere um .xml, um .zip ou uma pasta (recursivo). Retorna quantas notas novas entraram."""
+        caminho = Path(caminho)
+        if caminho.is_dir():
+            arquivos = [p for p in caminho.rglob("*") if p.suffix.lower() in (".xml", ".zip")]
+        else:
+            arquivos = [caminho]
+        novas = 0
+        with self._lock:
+            for p in arquivos:
+                # uma transação por arquivo: outros jobs não ficam presos no lock do SQLite
+                try:
+                    with self._db:
+                        if p.suffix.lower() == ".zip":
+                            novas += self._ingerir_zip(p, origem)
+                        else:
+                            novas += self._ingerir_arquivo(str(p), p.stat(), lambda p=p: p.read_bytes(), origem)
+                except Exception as e:
+                    print(f"[ACERVO] Não consegui ler {p}: {e}", flush=True)
+        return novas
+
+    def _ingerir_zip(self, zip_path: Path, origem: str) -> int:
+        st = zip_path.stat()
+        if self._inalterado(str(zip_path), st.st_size, st.st_mtime):
+            return 0
+        novas = 0
+        with zipfile.ZipFile(zip_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".xml"):
+                    continue
+                nome = f"{zip_path}!{info.filename}"
+                novas += self._ingerir_arquivo(nome, st, lambda i=info: zf.read(i), origem)
+        self._registrar_arquivo(str(zip_path), st.st_size, st.st_mtime, "")
+        return novas
+
+    def _ingerir_arquivo(self, nome: str, st, ler, origem: str) -> int:
+        if self._inalterado(nome, st.st_size, st.st_mtime):
+            return 0
+        dados = ler()
+        sha = hashlib.sha256(dados).hexdigest()
+        if self._sha_conhecido(sha):   # mesmo conteúdo em outro caminho (cópia/renomeado): não relê
+            docs = []
+        else:
+            try:
+                docs = ler_documentos(dados, sha)
+            except Exception as e:   # XML inválido: registra o arquivo para não tentar de novo
+                print(f"[ACERVO] XML ilegível {nome}: {e}", flush=True)
+                docs = []
+        return self._inserir(nome, st, sha, docs, origem)
+
+    def registrar(self, itens, origem: str = "") -> int:
+        """Grava notas já lidas por quem extraiu os arquivos: itens = (caminho, stat, sha256, docs)."""
+        novas = 0
+        with self._lock, self._db:
+            for nome, st, sha, docs in itens:
+                if not self._inalterado(str(nome), st.st_size, st.st_mtime):
+                    novas += self._inserir(str(nome), st, sha, docs, origem)
+        return novas
+
+    def _sha_conhecido(self, sha: str) -> bool:
+        return self._db.execute("SELECT 1 FROM arquivos WHERE sha256 = ? LIMIT 1", (sha,)).fetchone() is not None
+
+    def _inserir(self, nome: str, st, sha: str, docs, origem: str) -> int:
+        agora = time.strftime("%Y-%m-%d %H:%M:%S")
+        novas = 0
+        for d in docs:
+            cur = self._db.execute(
+                f"INSERT OR IGNORE INTO documentos ({', '.join(CAMPOS)}, sha256, arquivo, origem, ingerido_em) "
+                f"VALUES ({', '.join('?' * (len(CAMPOS) + 4))})",
+                [d.get(c) for c in CAMPOS] + [sha, nome, origem, agora],
+            )
+            novas += cur.rowcount
+        # conteúdo já conhecido (não relido) ou nota repetida: aponta para o caminho atual,
+        # senão um arquivo movido/republicado (publicar_dedup) deixa o caminho antigo na consulta
+        self._db.execute("UPDATE documentos SET arquivo = ? WHERE sha256 = ? AND arquivo <> ?", (nome, sha, nome))
+        self._registrar_arquivo(nome, st.st_size, st.st_mtime, sha)
+        return novas
+
+    def _inalterado(self, nome: str, tamanho: int, mtime: float) -> bool:
+        r = self._db.execute("SELECT tamanho, mtime FROM arquivos WHERE caminho = ?", (nome,)).fetchone()
+        return r is not None and r[0] == tamanho and r[1] == mtime
+
+    def _registrar_arquivo(self, nome: str, tamanho: int, mtime: float, sha: str):
+        self._db.execute("INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?)", (nome, tamanho, mtime, sha))
+
+    # ---------- consultas ----------
+    def chaves_arquivadas(self, chaves) -> set:
+        """Quais destas chaves já estão no acervo com o arquivo ainda no disco."""
+        chaves, achadas = list(chaves), set()
+        for i in range(0, len(chaves), 500):
+            lote = chaves[i:i + 500]
+            for chave, arquivo in self._db.execute(
+                f"SELECT chave, arquivo FROM documentos WHERE chave IN ({', '.join('?' * len(lote))})", lote
+            ):
+                if arquivo and Path(arquivo.split("!", 1)[0]).exists():   # "zip!membro" → o próprio ZIP
+                    achadas.add(chave)
+        return achadas
+
+    def por_cnpj(self, cnpj: str, competencia: str | None = None) -> list:
+        """Notas em que o CNPJ é prestador ou tomador (opcionalmente só da competência AAAA-MM)."""
+        sql = "SELECT * FROM documentos WHERE {} = ?" + (" AND competencia = ?" if competencia else "")
+        args = (cnpj, competencia) if competencia else (cnpj,)
+        cur = self._db.execute(
+            f"{sql.format('cnpj_prestador')} UNION {sql.format('cnpj_tomador')} ORDER BY emissao", args * 2
+        )
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+    def totais_mes(self, competencia: str, cnpj: str | None = None) -> list:
+        """Quantidade, valor e ISS por prestador na competência AAAA-MM."""
+        sql = ("SELECT cnpj_prestador, MAX(nome_prestador), COUNT(*), SUM(valor), SUM(iss) "
+               "FROM documentos WHERE competencia = ?")
+        args = [competencia]
+        if cnpj:
+            sql += " AND (cnpj_prestador = ? OR cnpj_tomador = ?)"
+            args += [cnpj, cnpj]
+        sql += " GROUP BY cnpj_prestador ORDER BY SUM(valor) DESC"
+        return [
+            {"cnpj_prestador": r[0], "nome_prestador": r[1], "notas": r[2], "valor": r[3] or 0.0, "iss": r[4] or 0.0}
+            for r in self._db.execute(sql, args)
+        ]
+
+    def fechar(self):
+        self._db.close()
+
+
+def ingerir_no_acervo(caminho, origem: str = "") -> int:
+    """Atalho para os bots: ingere e loga; uma falha aqui nunca derruba a automação."""
+    try:
+        acervo = Acervo()
+        try:
+            novas = acervo.ingerir(caminho, origem)
+        finally:
+            acervo.fechar()
+        print(f"[ACERVO] {novas} nota(s) nova(s) de {Path(caminho).name} ({origem or 'sem origem'}).", flush=True)
+        return novas
+    except Exception as e:
+        print(f"[ACERVO] Falha ao ingerir {caminho}: {e}", flush=True)
+        return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "ingerir":
+        ingerir_no_acervo(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "totais":
+        acervo = Acervo()
+        for t in acervo.totais_mes(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None):
+            print(f"{t['cnpj_prestador']:>14}  {t['notas']:>5}  {t['valor']:>14,.2f}  {t['iss']:>12,.2f}  {t['nome_prestador']}")
+        acervo.fechar()
+    else:
+        print("uso: python acervo.py ingerir <caminho> [origem] | totais AAAA-MM [cnpj]")
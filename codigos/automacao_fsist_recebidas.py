@@ -1,31 +1,46 @@
 # fsist_end2end_todas.py
 # -*- coding: utf-8 -*-
 
-import time
-import zipfile
+import os
+import re
+import sys
 import shutil
 from pathlib import Path
 
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from navegador import criar_chrome
+from downloads import obter_rastreador, pasta_rascunho, pasta_saida, publicar, limpar_rascunho
+from pacotes import extrair_zip
+from competencia import competencia_alvo, eh_mes_passado
+from acervo import Acervo
+from instrumentacao import cronometrado, etapa
+from esperas import aguardar, aguardar_estado, aguardar_rede_ociosa
+
 # =========================
 # CONFIG
 # =========================
 URL = "https://www.fsist.com.br/usuario/monitor-de-notas"
 WAIT = 50
 
-DOWNLOAD_DIR = Path.home() / "Downloads"
+# A FSist só oferece o atalho "Mês passado" (DataMesPassado); outra competência
+# (--competencia AAAA-MM do backfill) é recusada em main().
+_ANO, _MES   = competencia_alvo()
+COMPETENCIA  = f"{_ANO:04d}-{_MES:02d}"
+DOWNLOAD_DIR = pasta_rascunho()                     # downloads deste job (isolados)
+SAIDA_DIR    = pasta_saida("FSist", COMPETENCIA)    # <saída>/FSist/AAAA-MM
 
 # Saídas pedidas
-FINAL_DIR   = DOWNLOAD_DIR / "FSist-NFe entradas-Todas"        # extração do ZIP
-FINAL_PRINT = DOWNLOAD_DIR / "FSist-NFe entradas-Todas.png"    # print ANTES dos downloads
-EXCEL_FIXED = DOWNLOAD_DIR / "FSist-NFe entradas-Todas.xlsx"   # planilha renomeada (fixo)
+FINAL_DIR   = SAIDA_DIR / "FSist-NFe entradas-Todas"        # extração do ZIP
+FINAL_PRINT = SAIDA_DIR / "FSist-NFe entradas-Todas.png"    # print ANTES dos downloads
+EXCEL_FIXED = SAIDA_DIR / "FSist-NFe entradas-Todas.xlsx"   # planilha renomeada (fixo)
+
+# Incremental: compara as chaves do relatório com o acervo local e baixa só as
+# notas que faltam, mesclando na pasta (FSIST_INCREMENTAL=0 volta ao ZIP completo)
+INCREMENTAL = os.environ.get("FSIST_INCREMENTAL", "1") == "1"
 
 # Padrões de arquivos gerados pela FSist
 ZIP_PREFIX  = "FSist XMLs N"
@@ -74,7 +89,14 @@ def build_driver():
         "safebrowsing.enabled": True,
     }
     opts.add_experimental_option("prefs", prefs)
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=opts)
+    return criar_chrome(opts, download_dir=DOWNLOAD_DIR, portal="fsist")
+
+def aguardar_enter(msg):
+    # rodando como job (stdin = /dev/null) não há quem aperte ENTER: segue direto
+    try:
+        input(msg)
+    except EOFError:
+        pass
 
 def js_click(driver, el):
     driver.execute_script("arguments[0].click();", el)
@@ -98,68 +120,129 @@ def try_click_any(driver, locators, label, timeout_each=5):
             continue
     return False
 
-def wait_download_complete(dirpath: Path, timeout=420):
-    start = time.time()
-    while time.time() - start < timeout:
-        if not list(dirpath.glob("*.crdownload")):
-            return True
-        time.sleep(1)
-    return False
-
-def newest_file_in(dirpath: Path, startswith=None, endswith=None, timeout=240):
-    start = time.time()
-    while time.time() - start < timeout:
-        files = []
-        for p in dirpath.glob("*"):
-            if not p.is_file():
-                continue
-            if startswith and not p.name.startswith(startswith):
-                continue
-            if endswith and not p.name.endswith(endswith):
-                continue
-            if Path(str(p) + ".crdownload").exists():
-                continue
-            files.append(p)
-        if files:
-            return max(files, key=lambda f: f.stat().st_mtime)
-        time.sleep(1)
-    return None
-
-def extract_zip_to_named_folder(zip_path: Path, final_dir: Path):
-    work_dir = zip_path.parent / "_fsist_extract_tmp"
-    if work_dir.exists():
-        shutil.rmtree(work_dir, ignore_errors=True)
-    work_dir.mkdir(parents=True, exist_ok=True)
-
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        # proteção contra path traversal
-        for info in zf.infolist():
-            target = (work_dir / info.filename).resolve()
-            if not str(target).startswith(str(work_dir.resolve())):
-                continue
-        zf.extractall(work_dir)
+def menu_download_aberto(d):
+    """Botão da ciência, se a FSist pedir; True quando 'XMLs e PDFs' já está visível."""
+    ciencia = d.find_elements(*BTN_CIENCIA)
+    if ciencia:
+        return ciencia[0]
+    xmls = d.find_elements(*BTN_XMLS_PDFS)
+    return bool(xmls and xmls[0].is_displayed())
+
+@cronometrado("espera_download")
+def wait_download(downloads, marca, startswith, endswith, timeout=660):
+    arq = downloads.aguardar(marca, (endswith,), timeout=timeout, prefixo=startswith)
+    return Path(arq) if arq else None
+
+@cronometrado("extracao_zip")
+def extract_zip_to_named_folder(zip_path: Path, final_dir: Path, mesclar: bool = False):
+    # extração direta na pasta final, em paralelo; XMLs já entram no acervo
+    if final_dir.exists() and not mesclar:
+        shutil.rmtree(final_dir, ignore_errors=True)
+    r = extrair_zip(zip_path, final_dir, origem="FSist", mesclar=mesclar)
+    print(f"✓ {r['arquivos']} arquivo(s) extraído(s), {r['xmls']} XML(s) indexado(s), "
+          f"{r['notas_novas']} nota(s) nova(s) no acervo"
+          + (f", {r['mantidos']} já existente(s)" if r["mantidos"] else "")
+          + (f", {r['recusados']} recusado(s)" if r["recusados"] else ""))
 
-    # Se houver uma pasta única, usa; senão, usa o work_dir
-    tops = [p for p in work_dir.iterdir()]
-    source = tops[0] if len(tops) == 1 and tops[0].is_dir() else work_dir
+# =========================
+# SINCRONIZAÇÃO INCREMENTAL
+# =========================
+def chaves_do_relatorio(xlsx: Path) -> set:
+    """Chaves de acesso (44 dígitos) listadas no relatório Excel da FSist."""
+    from openpyxl import load_workbook
+    chaves = set()
+    wb = load_workbook(xlsx, read_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            for v in row:
+                d = re.sub(r"\D", "", str(v)) if v is not None else ""
+                if len(d) == 44:
+                    chaves.add(d)
+    finally:
+        wb.close()
+    return chaves
 
-    if final_dir.exists():
-        shutil.rmtree(final_dir, ignore_errors=True)
-    shutil.move(str(source), str(final_dir))
-    shutil.rmtree(work_dir, ignore_errors=True)
+def chaves_faltantes(xlsx: Path):
+    """Chaves do relatório que ainda não estão arquivadas, ou None se não der para comparar."""
+    try:
+        chaves = chaves_do_relatorio(xlsx)
+        if not chaves:
+            return None
+        acervo = Acervo()
+        try:
+            arquivadas = acervo.chaves_arquivadas(chaves)
+        finally:
+            acervo.fechar()
+    except Exception as e:
+        print(f"⚠ Não consegui comparar com o acervo ({e}); baixando tudo.")
+        return None
+    print(f"• Relatório: {len(chaves)} nota(s); já arquivadas: {len(arquivadas)}; faltam: {len(chaves) - len(arquivadas)}")
+    return chaves - arquivadas
+
+# marca só as linhas da grade cujo texto contém uma das chaves e desmarca as demais
+JS_SELECIONAR_CHAVES = r"""
+var faltam = arguments[0], marcadas = 0;
+document.querySelectorAll('tr, [role="row"]').forEach(function(tr){
+  var cb = tr.querySelector('input[type=checkbox]');
+  if (!cb) return;
+  var digitos = (tr.innerText || '').replace(/\D/g, '');
+  var quer = faltam.some(function(k){ return digitos.indexOf(k) >= 0; });
+  if (cb.checked !== quer) cb.click();
+  if (quer) marcadas++;
+});
+return marcadas;
+"""
+
+# volta a marcar todas as linhas sem usar 'Selecionar todas' (o botão pode alternar e desmarcar)
+JS_MARCAR_TODAS = r"""
+var total = 0;
+document.querySelectorAll('tr, [role="row"]').forEach(function(tr){
+  var cb = tr.querySelector('input[type=checkbox]');
+  if (!cb) return;
+  if (!cb.checked) cb.click();
+  total++;
+});
+return total;
+"""
+
+def selecionar_somente(driver, chaves: set) -> bool:
+    """Tenta deixar selecionadas só as notas `chaves`; se a grade não permitir
+    (chave não exibida, paginação), remarca todas as linhas e devolve False."""
+    try:
+        marcadas = driver.execute_script(JS_SELECIONAR_CHAVES, sorted(chaves))
+    except Exception:
+        marcadas = -1
+    if marcadas == len(chaves):
+        print(f"✓ Selecionadas só as {marcadas} nota(s) que faltam")
+        return True
+    print(f"⚠ Não consegui selecionar só as faltantes ({marcadas}/{len(chaves)}); baixando todas e mesclando.")
+    try:
+        total = driver.execute_script(JS_MARCAR_TODAS)
+    except Exception:
+        total = 0
+    if total:
+        print(f"✓ Todas as {total} linha(s) marcadas de novo")
+    else:   # grade ilegível pelo JS: o JS acima também não mexeu nela, a seleção inicial segue valendo
+        print("ℹ Grade não legível por script; mantendo a seleção de 'Selecionar todas'.")
+    return False
 
 # =========================
 # FLUXO PRINCIPAL
 # =========================
 def main():
+    if not eh_mes_passado(_ANO, _MES):
+        print(f"✗ A FSist só permite o período 'Mês passado'; competência {COMPETENCIA} não suportada.")
+        sys.exit(2)
     driver = build_driver()
+    downloads = obter_rastreador(driver, DOWNLOAD_DIR)
     try:
         # 1) Acesso e (se precisar) login manual
         driver.get(URL)
         print("• Página aberta. Faça o login manualmente se necessário.")
-        WebDriverWait(driver, 300).until(
-            lambda d: d.find_elements(*ABA_RECEBIDAS) or d.find_elements(By.ID, "Periodo")
-        )
+        with etapa("espera_login"):
+            WebDriverWait(driver, 300).until(
+                lambda d: d.find_elements(*ABA_RECEBIDAS) or d.find_elements(By.ID, "Periodo")
+            )
 
         # 2) Ajustar período: Mês passado
         opened = False
@@ -172,7 +255,7 @@ def main():
                 continue
         if opened:
             wait_and_click(driver, MES_PASSADO, "Aplicando 'Mês passado'", scroll=False)
-            time.sleep(0.4)
+            aguardar_rede_ociosa(driver, quieto=0.2, timeout=10, motivo="periodo")
             try:
                 periodo_txt = WebDriverWait(driver, 5).until(
                     EC.presence_of_element_located(PERIODO_SPAN)
@@ -187,22 +270,22 @@ def main():
         wait_and_click(driver, BTN_SELECIONAR_TODAS, "Clique em 'Selecionar todas'")
 
         # 3.1) PRINT IMEDIATO (antes de abrir modais)
-        driver.save_screenshot(str(FINAL_PRINT))
+        shot = DOWNLOAD_DIR / FINAL_PRINT.name
+        driver.save_screenshot(str(shot))
+        publicar(shot, FINAL_PRINT)
         print(f"✓ Print salvo em: {FINAL_PRINT}")
 
         # 4) RELATÓRIO → GERAR RELATÓRIO (Excel) + renomear fixo
         if try_click_any(driver, BTN_RELATORIO, "Abrindo 'Relatório'"):
+            marca = downloads.marca()
             if try_click_any(driver, BTN_GERAR_RELATORIO, "Gerando relatório (Excel)", timeout_each=10):
                 print("⏳ Aguardando download do Excel…")
-                wait_download_complete(DOWNLOAD_DIR, timeout=420)
-                xlsx = newest_file_in(DOWNLOAD_DIR, startswith=XLSX_PREFIX, endswith=XLSX_EXT, timeout=240)
+                xlsx = wait_download(downloads, marca, XLSX_PREFIX, XLSX_EXT)
                 if xlsx:
                     print(f"✓ Excel baixado: {xlsx.name}")
                     try:
-                        # apaga o destino se já existir e renomeia (sem data)
-                        if EXCEL_FIXED.exists():
-                            EXCEL_FIXED.unlink()
-                        xlsx.replace(EXCEL_FIXED)
+                        # publica com nome fixo (sem data), substituindo o anterior
+                        publicar(xlsx, EXCEL_FIXED)
                         print(f"✓ Planilha renomeada para: {EXCEL_FIXED.name}")
                     except Exception as e:
                         print(f"⚠ Não consegui renomear a planilha: {e}")
@@ -213,29 +296,43 @@ def main():
         else:
             print("⚠ Não localizei o botão 'Relatório'. Pulando a planilha.")
 
+        # 4.1) Incremental: só o que ainda não está no acervo
+        mesclar = False
+        if INCREMENTAL and EXCEL_FIXED.exists() and FINAL_DIR.exists():
+            faltam = chaves_faltantes(EXCEL_FIXED)
+            if faltam is not None:
+                mesclar = True
+                if not faltam:
+                    print("✓ Todas as notas do período já estão arquivadas; nada a baixar.")
+                    print(f"\nPasta XML/PDF: {FINAL_DIR}\nPlanilha: {EXCEL_FIXED}\nPrint: {FINAL_PRINT}\n")
+                    aguardar_enter(f"Revise os arquivos em {SAIDA_DIR}. Pressione ENTER para fechar o navegador...")
+                    return
+                selecionar_somente(driver, faltam)
+
         # 5) DOWNLOAD → XMLs e PDFs (trata ciência)
         wait_and_click(driver, BTN_DOWNLOAD, "Abrindo 'Download' da barra")
-        time.sleep(1)
+        # o menu abre direto em 'XMLs e PDFs' ou, antes, pede a ciência da operação
         try:
-            btn = WebDriverWait(driver, 3).until(EC.presence_of_element_located(BTN_CIENCIA))
-            js_click(driver, btn)
-            print("✓ Confirmei: 'Sim, efetuar ciência da operação'")
-            time.sleep(2)
-            wait_and_click(driver, BTN_DOWNLOAD, "Abrindo 'Download' novamente")
-            time.sleep(1)
+            achado = aguardar(driver, menu_download_aberto, timeout=5, motivo="menu_download")
+            if achado is not None and not isinstance(achado, bool):
+                js_click(driver, achado)
+                print("✓ Confirmei: 'Sim, efetuar ciência da operação'")
+                aguardar_estado(driver, BTN_CIENCIA, "ausente", timeout=15, motivo="ciencia")
+                aguardar_rede_ociosa(driver, quieto=0.3, timeout=15, motivo="ciencia")
+                wait_and_click(driver, BTN_DOWNLOAD, "Abrindo 'Download' novamente")
         except Exception:
             pass
 
+        marca = downloads.marca()
         wait_and_click(driver, BTN_XMLS_PDFS, "Clicando em 'XMLs e PDFs'")
         print("⏳ Aguardando download do ZIP…")
-        wait_download_complete(DOWNLOAD_DIR, timeout=420)
-        zipf = newest_file_in(DOWNLOAD_DIR, startswith=ZIP_PREFIX, endswith=ZIP_EXT, timeout=240)
+        zipf = wait_download(downloads, marca, ZIP_PREFIX, ZIP_EXT)
         if not zipf:
-            raise RuntimeError("Não encontrei o ZIP (verifique a pasta Downloads).")
+            raise RuntimeError(f"Não encontrei o ZIP (verifique a pasta {DOWNLOAD_DIR}).")
         print(f"✓ ZIP baixado: {zipf.name}")
 
-        # 6) Extrair ZIP para Downloads com nome final
-        extract_zip_to_named_folder(zipf, FINAL_DIR)
+        # 6) Extrair ZIP para a pasta de saída com nome final
+        extract_zip_to_named_folder(zipf, FINAL_DIR, mesclar=mesclar)
         print(f"✓ Arquivos extraídos em: {FINAL_DIR}")
 
         print("\n========== CONCLUÍDO ==========")
@@ -244,16 +341,17 @@ def main():
         print(f"Print: {FINAL_PRINT}")
         print("================================\n")
 
-        input("Revise os arquivos em Downloads. Pressione ENTER para fechar o navegador...")
+        aguardar_enter(f"Revise os arquivos em {SAIDA_DIR}. Pressione ENTER para fechar o navegador...")
 
     except Exception as e:
         print(f"\n✗ Erro: {e}\n")
-        input("Pressione ENTER para fechar o navegador...")
+        aguardar_enter("Pressione ENTER para fechar o navegador...")
     finally:
         try:
             driver.quit()
         except Exception:
             pass
+        limpar_rascunho()
 
 if __name__ == "__main__":
     main()
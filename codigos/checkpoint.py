@@ -0,0 +1,77 @@
+# checkpoint.py — retomada de execuções longas (várias empresas).
+# Cada unidade concluída (empresa × tipo × artefato, ex.: "ACME" × EMITIDAS × pdf)
+# vira uma linha num diário append-only (.checkpoint.jsonl, com fsync) na pasta
+# da competência. Rodando de novo no mesmo mês, o bot pula o que já foi feito
+# e continua exatamente de onde parou.
+# CHECKPOINT_REINICIAR=1 ignora o diário existente (refaz tudo).
+#
+# Uso:
+#     ck = Checkpoint(SAIDA_DIR / PORTAL / "2025-09" / ".checkpoint.jsonl")
+#     faltam = ck.pendentes(empresa, "EMITIDAS", ("pdf", "txt", "planilha"))
+#     ...
+#     ck.marcar(empresa, "EMITIDAS", "pdf", caminho)
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+REINICIAR = os.environ.get("CHECKPOINT_REINICIAR", "0") == "1"
+
+
+class Checkpoint:
+    def __init__(self, caminho, reiniciar: bool = REINICIAR):
+        self.caminho = Path(caminho)
+        self._lock = threading.Lock()
+        self._f = None
+        self._feitos = {}             # (empresa, tipo, artefato) -> caminho do arquivo | None
+        if reiniciar:
+            self.caminho.unlink(missing_ok=True)
+        else:
+            self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.caminho, encoding="utf-8") as f:
+                for l in f:
+                    try:
+                        r = json.loads(l)
+                    except ValueError:
+                        continue      # linha truncada por uma queda
+                    self._feitos[(r["empresa"], r["tipo"], r["artefato"])] = r.get("caminho")
+        except FileNotFoundError:
+            pass
+
+    def feito(self, empresa: str, tipo: str, artefato: str) -> bool:
+        chave = (empresa, tipo, artefato)
+        with self._lock:
+            if chave not in self._feitos:
+                return False
+            caminho = self._feitos[chave]
+        # artefato apagado depois de registrado: refaz
+        return caminho is None or Path(caminho).exists()
+
+    def pendentes(self, empresa: str, tipo: str, artefatos) -> list:
+        return [a for a in artefatos if not self.feito(empresa, tipo, a)]
+
+    def completo(self, empresa: str, tipos, artefatos) -> bool:
+        return all(not self.pendentes(empresa, t, artefatos) for t in tipos)
+
+    def marcar(self, empresa: str, tipo: str, artefato: str, caminho=None):
+        r = {"empresa": empresa, "tipo": tipo, "artefato": artefato,
+             "caminho": str(caminho) if caminho else None, "em": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with self._lock:
+            if self._f is None:
+                self.caminho.parent.mkdir(parents=True, exist_ok=True)
+                self._f = open(self.caminho, "a", encoding="utf-8")
+            self._f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._feitos[(empresa, tipo, artefato)] = r["caminho"]
+
+    def fechar(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
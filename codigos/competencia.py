@@ -0,0 +1,48 @@
+# competencia.py — mês de referência (competência) das automações.
+# Padrão: o mês passado, como sempre. Para reprocessar outro mês (backfill
+# disparado pelo jobs.py ou manualmente):
+#     python nfse_bot.py --competencia 2024-03
+#     AUTOMACAO_COMPETENCIA=2024-03 python osasco_fluxo.py
+
+import os
+import re
+import sys
+from datetime import date, timedelta
+
+_RE = re.compile(r"^(\d{4})-(\d{2})$")
+
+
+def _ler(txt: str):
+    m = _RE.match((txt or "").strip())
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        raise ValueError(f"Competência inválida: {txt!r} (use AAAA-MM).")
+    return int(m.group(1)), int(m.group(2))
+
+
+def mes_passado(hoje: date | None = None):
+    ultimo = (hoje or date.today()).replace(day=1) - timedelta(days=1)
+    return ultimo.year, ultimo.month
+
+
+def competencia_alvo():
+    """(ano, mes) pedido em --competencia AAAA-MM ou AUTOMACAO_COMPETENCIA; senão o mês passado."""
+    args = sys.argv[1:]
+    for i, a in enumerate(args):
+        if a == "--competencia" and i + 1 < len(args):
+            return _ler(args[i + 1])
+        if a.startswith("--competencia="):
+            return _ler(a.split("=", 1)[1])
+    if os.environ.get("AUTOMACAO_COMPETENCIA"):
+        return _ler(os.environ["AUTOMACAO_COMPETENCIA"])
+    return mes_passado()
+
+
+def eh_mes_passado(ano: int, mes: int) -> bool:
+    return (ano, mes) == mes_passado()
+
+
+def intervalo(ano: int, mes: int):
+    """Primeiro e último dia do mês."""
+    inicio = date(ano, mes, 1)
+    proximo = date(ano + (mes == 12), mes % 12 + 1, 1)
+    return inicio, proximo - timedelta(days=1)
@@ -0,0 +1,432 @@
+# downloads.py — detecção de downloads compartilhada pelos bots.
+# O rastreador principal assina os eventos do DevTools do navegador
+# (Browser.downloadWillBegin / Browser.downloadProgress) por um websocket
+# próprio e resolve um Future por download com o caminho final exato — sem
+# listar a pasta de Downloads nem dormir entre verificações.
+# Se o websocket não estiver disponível (ex.: websocket-client ausente), cai no
+# rastreador por pasta, com a mesma API, que faz o polling de antes.
+#
+# Uso:
+#     rast = obter_rastreador(driver, pasta)
+#     marca = rast.marca()          # ANTES do clique que dispara o download
+#     ...clique...
+#     caminho = rast.aguardar(marca, (".xml",), timeout=60)   # str | None
+#     (opcional: prefixo="FSist XMLs" filtra pelo início do nome)
+#
+# Cada job baixa numa pasta de rascunho própria (<saída>/.rascunho/<job>/...),
+# então execuções em paralelo não disputam arquivos. O artefato pronto é
+# publicado com os.replace (atômico) na árvore de saída
+# <saída>/<portal>/<AAAA-MM>/<empresa>/.
+#
+# publicar_dedup guarda o conteúdo uma única vez em <saída>/.blobs/<sha256>
+# e o nome legível na árvore de saída é um hardlink para esse blob (cópia, se
+# o sistema de arquivos não suportar). O mesmo XML/PDF vindo de outra execução
+# ou de outro portal não ocupa disco de novo, e o retorno diz se é novo.
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import weakref
+from concurrent.futures import Future
+from email.message import Message
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+SAIDA_DIR = Path(os.environ.get("AUTOMACAO_SAIDA") or Path.home() / "Downloads")
+JOB_ID = os.environ.get("AUTOMACAO_JOB_ID") or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+BLOBS_DIR = Path(os.environ.get("AUTOMACAO_BLOBS") or SAIDA_DIR / ".blobs")   # mesmo volume da saída (hardlinks)
+DEDUP = os.environ.get("ARTEFATOS_DEDUP", "1") == "1"
+
+_RASTREADORES = weakref.WeakKeyDictionary()
+_LOCK_NOMES = threading.Lock()
+_GUARDADOS = {}     # origem -> (sha, novo) já no blob e ainda sem vínculo (para a nova tentativa)
+
+
+# ========= PASTAS DO JOB / PUBLICAÇÃO =========
+
+def _parte(nome) -> str:
+    nome = re.sub(r'[\\/:*?"<>|\r\n\t]+', " ", str(nome))
+    return re.sub(r"\s{2,}", " ", nome).strip(" .") or "_"
+
+
+def pasta_rascunho(*partes) -> Path:
+    """Pasta de download exclusiva deste job (e, opcionalmente, da empresa)."""
+    p = SAIDA_DIR / ".rascunho" / JOB_ID
+    for parte in partes:
+        p = p / _parte(parte)
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def pasta_saida(*partes) -> Path:
+    """Pasta final na árvore de saída, ex.: pasta_saida("Osasco", "2025-09", empresa)."""
+    p = SAIDA_DIR
+    for parte in partes:
+        p = p / _parte(parte)
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def publicar(origem, destino) -> Path:
+    """Move o artefato pronto para o destino de forma atômica (substitui se existir)."""
+    origem, destino = Path(origem), Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(origem, destino)
+    except OSError:
+        # outro volume: copia para um temporário ao lado do destino e troca
+        tmp = destino.with_name(destino.name + ".parcial")
+        shutil.copy2(origem, tmp)
+        os.replace(tmp, destino)
+        origem.unlink(missing_ok=True)
+    return destino
+
+
+def limpar_rascunho():
+    shutil.rmtree(SAIDA_DIR / ".rascunho" / JOB_ID, ignore_errors=True)
+
+
+def _nome_livre(pasta: Path, nome: str) -> Path:
+    destino = pasta / nome
+    stem, ext, i = destino.stem, destino.suffix, 1
+    while destino.exists():
+        destino = pasta / f"{stem} ({i}){ext}"
+        i += 1
+    return destino
+
+
+# ========= ARTEFATOS POR CONTEÚDO (dedup) =========
+
+def sha256_arquivo(caminho) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _blob(sha: str) -> Path:
+    return BLOBS_DIR / sha[:2] / sha
+
+
+def conteudo_conhecido(sha: str) -> bool:
+    """True se esse conteúdo já foi guardado antes (por qualquer bot/execução)."""
+    return _blob(sha).exists()
+
+
+def _mesmo_conteudo(caminho: Path, blob: Path, sha: str) -> bool:
+    try:
+        if os.path.samefile(caminho, blob):
+            return True
+        return caminho.stat().st_size == blob.stat().st_size and sha256_arquivo(caminho) == sha
+    except OSError:
+        return False
+
+
+def _vincular(blob: Path, destino: Path):
+    tmp = destino.with_name(destino.name + ".link")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(blob, tmp)
+    except OSError:          # FAT/rede sem hardlink, ou outro volume
+        shutil.copy2(blob, tmp)
+    try:
+        os.replace(tmp, destino)
+    except OSError:          # destino travado (Windows): não deixa o .link para trás
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def publicar_dedup(origem, destino, substituir: bool = True, sha: str | None = None):
+    """Publica `origem` em `destino` guardando o conteúdo uma vez só. Retorna (caminho, novo).
+
+    Se `destino` já tem o mesmo conteúdo, nada muda. Com conteúdo diferente:
+    substitui (`substituir=True`) ou usa o próximo nome livre, "nome (1).ext".
+    """
+    origem, destino = Path(origem), Path(destino)
+    if not DEDUP:
+        with _LOCK_NOMES:
+            if not substituir:
+                destino = _nome_livre(destino.parent, destino.name)
+            return publicar(origem, destino), True
+    chave = str(origem)
+    with _LOCK_NOMES:
+        guardado = _GUARDADOS.get(chave)
+    if guardado and not origem.exists() and _blob(guardado[0]).exists():
+        sha, novo = guardado    # nova tentativa: a origem já está no blob, falta só o vínculo
+    else:
+        sha = sha or sha256_arquivo(origem)
+        novo = not _blob(sha).exists()
+        with _LOCK_NOMES:
+            _GUARDADOS[chave] = (sha, novo)
+        if novo:
+            publicar(origem, _blob(sha))
+        else:
+            origem.unlink(missing_ok=True)
+    blob = _blob(sha)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    with _LOCK_NOMES:
+        if destino.exists():
+            if _mesmo_conteudo(destino, blob, sha):
+                _GUARDADOS.pop(chave, None)
+                return destino, novo
+            if not substituir:
+                destino = _nome_livre(destino.parent, destino.name)
+        _vincular(blob, destino)   # PermissionError aqui: quem chamou pode tentar de novo
+        _GUARDADOS.pop(chave, None)
+    return destino, novo
+
+
+def _combina(nome: str, exts, prefixo: str = "") -> bool:
+    if prefixo and not nome.startswith(prefixo):
+        return False
+    return not exts or nome.lower().endswith(tuple(e.lower() for e in exts))
+
+
+class _Download:
+    def __init__(self, seq: int, guid: str, nome: str, url: str):
+        self.seq = seq
+        self.guid = guid
+        self.nome = nome
+        self.url = url
+        self.pasta = None
+        self.futuro = Future()
+
+
+class RastreadorCDP:
+    """Downloads via eventos Browser.* do DevTools (websocket do navegador)."""
+
+    def __init__(self, driver, pasta):
+        import websocket  # websocket-client (dependência do selenium)
+
+        endereco = driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+        with urllib.request.urlopen(f"http://{endereco}/json/version", timeout=5) as r:
+            ws_url = json.load(r)["webSocketDebuggerUrl"]
+        self._ws = websocket.create_connection(ws_url, timeout=None, suppress_origin=True)
+        self._ids = itertools.count(1)
+        self._respostas = {}
+        self._envio = threading.Lock()
+        self._cond = threading.Condition()
+        self._downloads = []          # em ordem de início
+        self._por_guid = {}
+        self._seq = 0
+        self.pasta = Path(pasta)
+        self._leitor = threading.Thread(target=self._ler, name="cdp-downloads", daemon=True)
+        self._leitor.start()
+        self.definir_pasta(self.pasta)
+
+    # ---------- API ----------
+    def definir_pasta(self, pasta):
+        """Downloads iniciados daqui em diante vão para `pasta`."""
+        self.pasta = Path(pasta)
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        # allowAndName: o Chrome grava como <pasta>/<guid>; renomeamos ao concluir
+        self._comando("Browser.setDownloadBehavior", {
+            "behavior": "allowAndName", "downloadPath": str(self.pasta), "eventsEnabled": True,
+        })
+
+    def marca(self) -> int:
+        with self._cond:
+            return self._seq
+
+    def aguardar(self, marca: int, exts=(), timeout: float = 60, prefixo: str = ""):
+        """Caminho do primeiro download iniciado após `marca` com extensão em `exts`."""
+        end = time.time() + timeout
+        with self._cond:
+            while True:
+                d = next((d for d in self._downloads
+                          if d.seq > marca and _combina(d.nome, exts, prefixo)), None)
+                if d is not None:
+                    break
+                restante = end - time.time()
+                if restante <= 0:
+                    return None
+                self._cond.wait(restante)
+        try:
+            return d.futuro.result(timeout=max(0.0, end - time.time()))
+        except Exception:         # timeout ou falha ao renomear
+            return None
+
+    def fechar(self):
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+
+    # ---------- internos ----------
+    def _comando(self, metodo: str, params: dict, timeout: float = 10):
+        cid = next(self._ids)
+        futuro = Future()
+        self._respostas[cid] = futuro
+        with self._envio:
+            self._ws.send(json.dumps({"id": cid, "method": metodo, "params": params}))
+        return futuro.result(timeout=timeout)
+
+    def _ler(self):
+        while True:
+            try:
+                msg = json.loads(self._ws.recv())
+            except Exception:
+                break
+            if "id" in msg:
+                futuro = self._respostas.pop(msg["id"], None)
+                if futuro is not None:
+                    if "error" in msg:
+                        futuro.set_exception(RuntimeError(msg["error"].get("message")))
+                    else:
+                        futuro.set_result(msg.get("result"))
+                continue
+            params = msg.get("params", {})
+            if msg.get("method") == "Browser.downloadWillBegin":
+                with self._cond:
+                    self._seq += 1
+                    d = _Download(self._seq, params["guid"], params.get("suggestedFilename") or params["guid"],
+                                  params.get("url", ""))
+                    d.pasta = self.pasta
+                    self._downloads.append(d)
+                    self._por_guid[d.guid] = d
+                    self._cond.notify_all()
+            elif msg.get("method") == "Browser.downloadProgress":
+                estado = params.get("state")
+                if estado not in ("completed", "canceled"):
+                    continue
+                with self._cond:
+                    d = self._por_guid.pop(params.get("guid"), None)
+                if d is None or d.futuro.done():
+                    continue
+                if estado == "canceled":
+                    d.futuro.set_result(None)
+                    continue
+                try:
+                    bruto = Path(params.get("filePath") or (d.pasta / d.guid))
+                    final = _nome_livre(bruto.parent, d.nome)
+                    os.replace(bruto, final)
+                    d.futuro.set_result(str(final))
+                except Exception as e:
+                    d.futuro.set_exception(e)
+        # conexão caiu: libera quem ainda espera
+        with self._cond:
+            for d in self._por_guid.values():
+                if not d.futuro.done():
+                    d.futuro.set_result(None)
+            self._por_guid.clear()
+        for futuro in self._respostas.values():
+            if not futuro.done():
+                futuro.set_exception(ConnectionError("DevTools desconectado."))
+
+
+class RastreadorPasta:
+    """Fallback: compara listagens da pasta (o comportamento antigo dos bots)."""
+
+    def __init__(self, driver, pasta, intervalo: float = 0.35):
+        self.driver = driver
+        self.intervalo = intervalo
+        self.definir_pasta(pasta)
+
+    def definir_pasta(self, pasta):
+        self.pasta = Path(pasta)
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        try:
+            self.driver.execute_cdp_cmd("Page.setDownloadBehavior", {
+                "behavior": "allow", "downloadPath": str(self.pasta),
+            })
+        except Exception:
+            pass
+
+    def _listar(self) -> set:
+        return {f for f in os.listdir(self.pasta) if not f.endswith(".crdownload")}
+
+    def marca(self) -> set:
+        return self._listar()
+
+    def aguardar(self, marca: set, exts=(), timeout: float = 60, prefixo: str = ""):
+        end = time.time() + timeout
+        tamanhos = {}
+        while time.time() < end:
+            novos = [f for f in self._listar() - marca if _combina(f, exts, prefixo)]
+            if novos:
+                fn = max(novos, key=lambda n: os.path.getmtime(self.pasta / n))
+                fp = self.pasta / fn
+                if (self.pasta / (fn + ".crdownload")).exists():
+                    pass
+                elif tamanhos.get(fn) == fp.stat().st_size:
+                    return str(fp)
+                else:
+                    tamanhos[fn] = fp.stat().st_size
+            time.sleep(self.intervalo)
+        return None
+
+    def fechar(self):
+        pass
+
+
+class ClienteHTTP:
+    """Downloads diretos, sem clicar, reaproveitando a sessão do navegador.
+
+    Usa um urllib3.PoolManager (conexões mantidas abertas e reaproveitadas entre
+    threads) com os cookies e o User-Agent do Selenium. Grava em streaming no
+    disco, em blocos.
+    """
+
+    def __init__(self, driver, paralelo: int = 4):
+        import urllib3  # dependência do selenium
+
+        self.base = driver.current_url
+        cookies = "; ".join(f"{c['name']}={c['value']}" for c in driver.get_cookies())
+        headers = {
+            "Cookie": cookies,
+            "User-Agent": driver.execute_script("return navigator.userAgent;"),
+            "Referer": self.base,
+        }
+        self._http = urllib3.PoolManager(maxsize=paralelo, block=True, headers=headers)
+        self._nomes = threading.Lock()
+
+    def baixar(self, href: str, pasta, exts=(), timeout: float = 60) -> Path:
+        url = urljoin(self.base, href)
+        pasta = Path(pasta)
+        r = self._http.request("GET", url, preload_content=False, timeout=timeout)
+        try:
+            if r.status != 200:
+                raise RuntimeError(f"HTTP {r.status} em {url}")
+            if "text/html" in (r.headers.get("Content-Type") or "").lower():
+                raise RuntimeError(f"Resposta HTML em {url} (sessão expirada?)")
+            cab = Message()
+            cab["Content-Disposition"] = r.headers.get("Content-Disposition") or ""
+            nome = cab.get_filename() or Path(urlparse(url).path).name
+            if exts and not _combina(nome, exts):
+                nome += exts[0]
+            fd, tmp = tempfile.mkstemp(dir=pasta, suffix=".parcial")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for bloco in r.stream(64 * 1024):
+                        f.write(bloco)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)   # timeout/reset no meio: não deixa o .parcial na pasta
+                raise
+        finally:
+            r.release_conn()
+        with self._nomes:
+            return publicar(tmp, _nome_livre(pasta, nome))
+
+
+def obter_rastreador(driver, pasta=None):
+    """Rastreador do `driver` (criado na primeira chamada, depois reaproveitado)."""
+    rast = _RASTREADORES.get(driver)
+    if rast is not None:
+        return rast
+    pasta = Path(pasta or Path.home() / "Downloads")
+    try:
+        rast = RastreadorCDP(driver, pasta)
+    except Exception as e:
+        print(f"[LOG] Eventos de download via DevTools indisponíveis ({e}); usando a pasta.", flush=True)
+        rast = RastreadorPasta(driver, pasta)
+    _RASTREADORES[driver] = rast
+    return rast
@@ -0,0 +1,267 @@
+# esperas.py — esperas por condição no lugar de time.sleep fixo.
+# Cada espera termina assim que a condição vale (ou no timeout), em vez de
+# pagar sempre o pior caso. As que dependem da página rodam dentro dela numa
+# única chamada (execute_async_script): DOM parado (MutationObserver sem
+# mutações por N ms) e rede ociosa (nenhum XHR/fetch pendente, contados por um
+# monitor injetado em cada documento via CDP).
+#
+# O mesmo monitor acompanha as mutações do documento e responde, numa chamada,
+# se a página "assentou": documento completo, rede ociosa e nenhum bloqueio
+# visível (.blockUI / overlay sem diálogo por cima) — e se há diálogo aberto.
+# Um overlay atrás de um diálogo é o próprio modal, não carregamento.
+#
+# Todo tempo parado é contabilizado: no fim da execução sai o orçamento
+# "pausas fixas × esperas por condição × trabalho" (e o evento "orcamento").
+#
+# Uso:
+#     aguardar_rede_ociosa(driver)                     # postback/AJAX terminou
+#     aguardar_dom_estavel(driver, quieto=0.2)         # a página parou de mudar
+#     e = aguardar_assentada(driver)                   # -> {"assentada", "dialogo", "overlay", ...}
+#     pagina_assentada(driver)                         # pergunta única, sem esperar
+#     aguardar_estado(driver, (By.ID, "x"), "clicavel")
+#     achado = aguardar_algum(driver, [LOC_A, LOC_B])  # -> (locator, elemento) | None
+#     aguardar_troca(driver, el)                       # el saiu do DOM (navegação/recarga)
+#     pausa(0.5, "limite do portal")                   # quando não há condição a esperar
+
+import atexit
+import threading
+import time
+import weakref
+
+from selenium.common.exceptions import JavascriptException, TimeoutException, WebDriverException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from instrumentacao import BOT, evento
+
+OVERLAYS = (".blockUI", ".ui-widget-overlay", ".modal-backdrop")
+DIALOGOS = (".ui-dialog",)
+
+# contador de XHR/fetch pendentes + última mutação do DOM; instalado no início de cada documento
+JS_MONITOR = r"""
+(function(){
+  if (window.__esperaRede) return;
+  var st = window.__esperaRede = {pendentes: 0, ultimo: Date.now(), mutacao: Date.now()};
+  new MutationObserver(function(){ st.mutacao = Date.now(); })
+    .observe(document, {childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'style']});
+  function visivel(el) {
+    if (!(el.offsetWidth || el.offsetHeight || el.getClientRects().length)) return false;
+    var cs = getComputedStyle(el);
+    return cs.visibility !== 'hidden' && parseFloat(cs.opacity || '1') > 0;
+  }
+  function algum(sels) {
+    for (var i = 0; i < sels.length; i++) {
+      var els = document.querySelectorAll(sels[i]);
+      for (var k = 0; k < els.length; k++) if (visivel(els[k])) return sels[i];
+    }
+    return null;
+  }
+  window.__estadoPagina = function(overlays, dialogos) {
+    var overlay = algum(overlays || []), dialogo = !!algum(dialogos || []);
+    var carregando = overlay !== null && (!dialogo || overlay === '.blockUI');
+    var pronto = document.readyState === 'complete';
+    return {assentada: pronto && st.pendentes === 0 && !carregando, carregando: carregando,
+            overlay: overlay, dialogo: dialogo, pendentes: st.pendentes, pronto: pronto,
+            quieto_ms: Date.now() - Math.max(st.ultimo, st.mutacao)};
+  };
+  function ini(){ st.pendentes++; st.ultimo = Date.now(); }
+  function fim(){ st.pendentes = Math.max(0, st.pendentes - 1); st.ultimo = Date.now(); }
+  var envia = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function(){
+    ini(); this.addEventListener('loadend', fim);
+    return envia.apply(this, arguments);
+  };
+  if (window.fetch) {
+    var busca = window.fetch;
+    window.fetch = function(){
+      ini();
+      return busca.apply(this, arguments).then(function(r){ fim(); return r; }, function(e){ fim(); throw e; });
+    };
+  }
+})();
+"""
+
+# resolve true quando a condição se mantém por `quieto` ms; false no limite
+# ('assentada' resolve com o estado da página, contando o silêncio só a partir da chamada)
+JS_ESPERAR = r"""
+var tipo = arguments[0], quieto = arguments[1], limite = arguments[2], pronto = arguments[arguments.length - 1];
+var overlays = arguments[3], dialogos = arguments[4], estado = null;
+var inicio = Date.now(), ultimo = inicio, obs = null;
+if (tipo === 'dom') {
+  obs = new MutationObserver(function(){ ultimo = Date.now(); });
+  obs.observe(document.documentElement || document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+function parado() {
+  if (tipo === 'dom') return Date.now() - ultimo >= quieto;
+  var st = window.__esperaRede || {pendentes: 0, ultimo: 0, mutacao: 0};
+  if (tipo === 'assentada') {
+    estado = window.__estadoPagina(overlays, dialogos);
+    if (!estado.assentada) { ultimo = Date.now(); return false; }
+    return Date.now() - Math.max(ultimo, st.ultimo, st.mutacao) >= quieto;
+  }
+  if (document.readyState !== 'complete' || st.pendentes > 0) { ultimo = Date.now(); return false; }
+  return Date.now() - Math.max(ultimo, st.ultimo) >= quieto;
+}
+(function checar(){
+  if (parado()) { if (obs) obs.disconnect(); pronto(estado || true); return; }
+  if (Date.now() - inicio >= limite) { if (obs) obs.disconnect(); pronto(estado || false); return; }
+  setTimeout(checar, 25);
+})();
+"""
+
+_MONITORADOS = weakref.WeakSet()
+_SCRIPT_TIMEOUT = weakref.WeakKeyDictionary()   # driver -> script timeout já ajustado (s)
+_TOTAIS = {"pausa": 0.0, "condicao": 0.0}
+_LOCK = threading.Lock()
+_INICIO = time.monotonic()
+
+
+def _contar(tipo: str, t0: float, motivo: str, ok=None):
+    dur = time.monotonic() - t0
+    with _LOCK:
+        _TOTAIS[tipo] += dur
+    evento("espera", modo=tipo, motivo=motivo, duracao_s=round(dur, 3), **({} if ok is None else {"ok": ok}))
+
+
+def pausa(segundos: float, motivo: str = ""):
+    """Sleep fixo, contabilizado. Só para quando não existe condição a observar."""
+    t0 = time.monotonic()
+    time.sleep(segundos)
+    _contar("pausa", t0, motivo)
+
+
+def instalar_monitor(driver):
+    """Monitor de rede desde o início de todo documento novo (CDP). Idempotente por driver."""
+    if driver in _MONITORADOS:
+        return
+    _MONITORADOS.add(driver)
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": JS_MONITOR})
+    except Exception:
+        pass          # sem CDP: o monitor entra no documento na primeira espera
+
+
+def _esperar_na_pagina(driver, tipo: str, quieto: float, timeout: float, motivo: str, *extra):
+    """True/False (ou o estado da página, em 'assentada'); True também se o documento foi trocado."""
+    t0 = time.monotonic()
+    ok = r = False
+    try:
+        instalar_monitor(driver)
+        if _SCRIPT_TIMEOUT.get(driver, 30) < timeout + 5:
+            driver.set_script_timeout(timeout + 5)
+            _SCRIPT_TIMEOUT[driver] = timeout + 5
+        # o monitor vai junto: documento carregado antes do CDP também passa a ser contado
+        r = driver.execute_async_script(JS_MONITOR + JS_ESPERAR, tipo, int(quieto * 1000), int(timeout * 1000), *extra)
+        ok = r.get("assentada", False) if isinstance(r, dict) else bool(r)
+    except JavascriptException:
+        ok = r = True     # o documento foi descarregado no meio da espera: houve navegação
+    except (TimeoutException, WebDriverException):
+        ok = r = False
+    finally:
+        _contar("condicao", t0, motivo or tipo, ok)
+    return r
+
+
+def aguardar_dom_estavel(driver, quieto: float = 0.3, timeout: float = 5, motivo: str = "") -> bool:
+    """Espera o DOM ficar `quieto` segundos sem mutações."""
+    return bool(_esperar_na_pagina(driver, "dom", quieto, timeout, motivo or "dom_estavel"))
+
+
+def aguardar_rede_ociosa(driver, quieto: float = 0.3, timeout: float = 10, motivo: str = "") -> bool:
+    """Espera o documento completo e nenhum XHR/fetch pendente por `quieto` segundos."""
+    return bool(_esperar_na_pagina(driver, "rede", quieto, timeout, motivo or "rede_ociosa"))
+
+
+def estado_pagina(driver, overlays=OVERLAYS, dialogos=DIALOGOS) -> dict:
+    """Numa chamada: {"assentada", "carregando", "overlay", "dialogo", "pendentes", "pronto", "quieto_ms"}."""
+    try:
+        return driver.execute_script(JS_MONITOR + "return window.__estadoPagina(arguments[0], arguments[1]);",
+                                     list(overlays), list(dialogos))
+    except WebDriverException:
+        return {"assentada": False, "carregando": False, "overlay": None, "dialogo": False,
+                "pendentes": 0, "pronto": False, "quieto_ms": 0}
+
+
+def pagina_assentada(driver, quieto: float = 0.2, overlays=OVERLAYS, dialogos=DIALOGOS) -> bool:
+    """A página já assentou (e está parada há `quieto` s)? Pergunta única, sem esperar."""
+    e = estado_pagina(driver, overlays, dialogos)
+    return bool(e["assentada"]) and e["quieto_ms"] >= quieto * 1000
+
+
+def aguardar_assentada(driver, quieto: float = 0.2, timeout: float = 10, motivo: str = "",
+                       overlays=OVERLAYS, dialogos=DIALOGOS) -> dict:
+    """Espera, dentro da página, documento completo, rede ociosa e nenhum bloqueio visível
+    por `quieto` s contados a partir da chamada (um clique recém-feito ainda pode disparar
+    o postback). Devolve o estado da página no fim — "assentada" False no timeout."""
+    t0 = time.monotonic()
+    r = _esperar_na_pagina(driver, "assentada", quieto, timeout, motivo or "assentada", list(overlays), list(dialogos))
+    if r is True:        # navegou no meio: espera no documento novo com o que sobrou
+        restante = max(quieto, timeout - (time.monotonic() - t0))
+        r = _esperar_na_pagina(driver, "assentada", quieto, restante, motivo or "assentada", list(overlays), list(dialogos))
+    return r if isinstance(r, dict) else estado_pagina(driver, overlays, dialogos)
+
+
+def aguardar(driver, condicao, timeout: float = 10, intervalo: float = 0.1, motivo: str = ""):
+    """WebDriverWait contabilizado: o valor da condição, ou None no timeout."""
+    t0 = time.monotonic()
+    r = None
+    try:
+        r = WebDriverWait(driver, timeout, poll_frequency=intervalo).until(condicao)
+    except TimeoutException:
+        pass
+    finally:
+        _contar("condicao", t0, motivo or getattr(condicao, "__name__", "condicao"), r is not None and r is not False)
+    return r
+
+
+_ESTADOS = {
+    "presente": EC.presence_of_element_located,
+    "visivel": EC.visibility_of_element_located,
+    "clicavel": EC.element_to_be_clickable,
+    "invisivel": EC.invisibility_of_element_located,
+    "ausente": lambda loc: lambda d: not d.find_elements(*loc),
+}
+
+
+def aguardar_estado(driver, locator, estado: str = "presente", timeout: float = 10, motivo: str = ""):
+    """Elemento em `estado` (presente/visivel/clicavel/invisivel/ausente)."""
+    return aguardar(driver, _ESTADOS[estado](locator), timeout, motivo=motivo or f"{estado}:{locator[1][:40]}")
+
+
+def aguardar_algum(driver, locators, timeout: float = 10, motivo: str = ""):
+    """O primeiro dos locators que aparecer: (locator, elemento), ou None."""
+    def algum(d):
+        for loc in locators:
+            achados = d.find_elements(*loc)
+            if achados:
+                return loc, achados[0]
+        return False
+    return aguardar(driver, algum, timeout, motivo=motivo or "algum")
+
+
+def aguardar_troca(driver, elemento, timeout: float = 10, motivo: str = "") -> bool:
+    """Espera `elemento` sair do DOM (página ou trecho recarregado)."""
+    return bool(aguardar(driver, EC.staleness_of(elemento), timeout, motivo=motivo or "troca"))
+
+
+def aguardar_valor(elemento, esperado: str, timeout: float = 2, motivo: str = "") -> bool:
+    """Espera o campo refletir `esperado` (compara só os dígitos: máscaras de data/hora)."""
+    alvo = "".join(c for c in esperado if c.isdigit()) or esperado
+    def refletiu(_):
+        v = elemento.get_attribute("value") or ""
+        return ("".join(c for c in v if c.isdigit()) or v) == alvo
+    return bool(aguardar(elemento.parent, refletiu, timeout, intervalo=0.05, motivo=motivo or "valor"))
+
+
+@atexit.register
+def _orcamento():
+    with _LOCK:
+        pausas, condicoes = _TOTAIS["pausa"], _TOTAIS["condicao"]
+    if not pausas and not condicoes:
+        return
+    total = time.monotonic() - _INICIO
+    trabalho = max(0.0, total - pausas - condicoes)
+    print(f"\n⏳ Orçamento de tempo ({BOT}, {total:.1f}s): pausas fixas {pausas:.1f}s · "
+          f"esperas por condição {condicoes:.1f}s · trabalho {trabalho:.1f}s", flush=True)
+    evento("orcamento", total_s=round(total, 3), pausas_s=round(pausas, 3),
+           esperas_s=round(condicoes, 3), trabalho_s=round(trabalho, 3))
@@ -0,0 +1,130 @@
+# frames.py — localização do frame que contém um elemento (portais da PMSP).
+# Antes, cada chamada voltava ao topo e testava o XPath no documento e em cada
+# iframe, uma ida e volta ao navegador por passo (até ~40 por chamada). Agora
+# um único execute_script procura o XPath no topo e nos iframes de mesma
+# origem e diz em que frame o driver já está; só então se troca de frame, e
+# só se for preciso.
+#
+# O frame que respondeu da última vez a cada XPath é testado primeiro. Nos
+# iframes de outra origem (que o JS não enxerga) a varredura pelo Selenium
+# fica em cache por identidade do documento (um token gravado no window do
+# topo, que some a cada navegação) + XPath.
+#
+# Uso (mesma assinatura da função antiga dos bots):
+#     if switch_into_iframe_with(driver, xp):
+#         driver.find_element(By.XPATH, xp)...
+
+import weakref
+
+from selenium.webdriver.common.by import By
+
+# -1 = documento do topo; i >= 0 = window.top.frames[i] (o mesmo índice de switch_to.frame(i))
+JS_LOCALIZAR = r"""
+var xp = arguments[0], max = arguments[1], dica = arguments[2];
+var topo = window.top, doc;
+try { doc = topo.document; } catch (e) { return null; }
+if (!topo.__frameDocId) topo.__frameDocId = Date.now() + '-' + Math.random();
+var atual = -1;                          // -2: frame aninhado/desconhecido
+if (window !== topo) {
+  atual = Array.prototype.indexOf.call(topo.frames, window);
+  if (atual < 0) atual = -2;
+}
+function tem(d) {
+  try { return d.evaluate(xp, d, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null; }
+  catch (e) { return false; }
+}
+function docDe(i) { try { return topo.frames[i].document; } catch (e) { return null; } }
+var n = Math.min(topo.frames.length, max), ordem = [-1], inacessiveis = [];
+if (dica !== null && dica >= 0 && dica < n) ordem.push(dica);
+for (var i = 0; i < n; i++) if (i !== dica) ordem.push(i);
+for (var k = 0; k < ordem.length; k++) {
+  var i = ordem[k], d = i < 0 ? doc : docDe(i);
+  if (!d) { inacessiveis.push(i); continue; }
+  if (tem(d)) return {doc: topo.__frameDocId, atual: atual, alvo: i, inacessiveis: []};
+}
+return {doc: topo.__frameDocId, atual: atual, alvo: null, inacessiveis: inacessiveis};
+"""
+
+_DICAS = weakref.WeakKeyDictionary()    # driver -> {xpath: último frame onde estava}
+_CACHE = weakref.WeakKeyDictionary()    # driver -> {(documento, xpath): frame}, frames de outra origem
+_MAX_CACHE = 256
+
+
+def _ir_para(driver, atual: int, alvo: int):
+    if atual == alvo:
+        return
+    driver.switch_to.default_content()
+    if alvo >= 0:
+        driver.switch_to.frame(alvo)
+
+
+def _tem(driver, xpath: str) -> bool:
+    try:
+        return bool(driver.find_elements(By.XPATH, xpath))
+    except Exception:
+        return False
+
+
+def _varrer(driver, xpath: str, indices) -> int | None:
+    """Varredura pelo Selenium (frames de outra origem): índice do frame ou None."""
+    for i in indices:
+        try:
+            driver.switch_to.default_content()
+            driver.switch_to.frame(i)
+            if _tem(driver, xpath):
+                return i
+        except Exception:
+            pass
+    return None
+
+
+def _varredura_antiga(driver, xpath: str, max_scan: int) -> bool:
+    driver.switch_to.default_content()
+    if _tem(driver, xpath):
+        return True
+    for f in driver.find_elements(By.TAG_NAME, "iframe")[:max_scan]:
+        try:
+            driver.switch_to.default_content(); driver.switch_to.frame(f)
+            if _tem(driver, xpath):
+                return True
+        except Exception:
+            pass
+    driver.switch_to.default_content()
+    return False
+
+
+def switch_into_iframe_with(driver, xpath_target: str, max_scan=12) -> bool:
+    """Deixa o driver no frame (ou no topo) que contém `xpath_target`; False se não achar."""
+    dicas = _DICAS.setdefault(driver, {})
+    cache = _CACHE.setdefault(driver, {})
+    try:
+        r = driver.execute_script(JS_LOCALIZAR, xpath_target, max_scan, dicas.get(xpath_target))
+    except Exception:
+        r = None
+    if r is None:                      # topo de outra origem / JS indisponível: como era antes
+        return _varredura_antiga(driver, xpath_target, max_scan)
+
+    alvo, atual = r["alvo"], r["atual"]
+    chave = (r["doc"], xpath_target)   # o token do documento muda a cada navegação
+    if alvo is None and r["inacessiveis"]:
+        conhecido = cache.get(chave)
+        if conhecido is not None:
+            try:
+                _ir_para(driver, atual, conhecido)
+                if _tem(driver, xpath_target):
+                    return True
+            except Exception:
+                pass
+        alvo = _varrer(driver, xpath_target, r["inacessiveis"])
+        atual = alvo if alvo is not None else -2     # a varredura já deixou o driver no frame
+        if alvo is not None:
+            if len(cache) >= _MAX_CACHE:
+                cache.clear()
+            cache[chave] = alvo
+    if alvo is None:
+        cache.pop(chave, None)
+        driver.switch_to.default_content()
+        return False
+    dicas[xpath_target] = alvo
+    _ir_para(driver, atual, alvo)
+    return True
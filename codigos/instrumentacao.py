@@ -0,0 +1,246 @@
+# instrumentacao.py — eventos estruturados e tempo por etapa, comum a todos os bots.
+# Cada evento é uma linha JSON em <saída>/.eventos/<bot>-<job>.jsonl com o id
+# da execução (o JOB_ID do downloads, o mesmo da pasta de rascunho), a
+# empresa em processamento, a etapa e a duração. As linhas ficam num buffer
+# e vão para o disco em lote (a cada N eventos / poucos segundos / no fim),
+# sem abrir o arquivo a cada chamada. No fim da execução sai um resumo de
+# onde o tempo foi gasto (por etapa: vezes, total, média e máximo).
+#
+# Uso:
+#     with com_empresa("ACME LTDA"):
+#         with etapa("impressao_pdf", tipo="EMITIDAS"):
+#             ...
+#     @cronometrado("espera_login")
+#     def wait_login(...): ...
+#     evento("aviso", mensagem="TXT não baixado")
+#
+# Perfil de comandos do WebDriver (opcional, WEBDRIVER_PERFIL=1): cada comando
+# enviado ao chromedriver é contado com a latência, a função do bot que o
+# disparou e a etapa em curso. No fim sai o histograma por função, para achar
+# os helpers que mais fazem ida e volta ao navegador.
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from downloads import JOB_ID, SAIDA_DIR
+
+BOT = Path(sys.argv[0]).stem or "interativo"
+EVENTOS_DIR = Path(os.environ.get("AUTOMACAO_EVENTOS") or SAIDA_DIR / ".eventos")
+ATIVO = os.environ.get("AUTOMACAO_EVENTOS_ATIVO", "1") == "1"
+PERFIL_WEBDRIVER = os.environ.get("WEBDRIVER_PERFIL", "0") == "1"
+
+
+class Gravador:
+    """Arquivo de texto com escrita em lote: acumula linhas e grava a cada
+    `lote` linhas ou `intervalo` segundos (e sempre no fim do processo)."""
+
+    def __init__(self, caminho, lote: int = 200, intervalo: float = 2.0):
+        self.caminho = Path(caminho)
+        self.lote, self.intervalo = lote, intervalo
+        self._linhas = []
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self._falhou = False
+        atexit.register(self.descarregar)
+
+    def escrever(self, linha: str):
+        with self._lock:
+            self._linhas.append(linha.rstrip("\n") + "\n")
+            if len(self._linhas) < self.lote and time.monotonic() - self._ultimo < self.intervalo:
+                return
+            self._descarregar()
+
+    def descarregar(self):
+        with self._lock:
+            self._descarregar()
+
+    def _descarregar(self):
+        linhas, self._linhas = self._linhas, []
+        self._ultimo = time.monotonic()
+        if not linhas or self._falhou:
+            return
+        try:
+            self.caminho.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.caminho, "a", encoding="utf-8") as f:
+                f.writelines(linhas)
+        except Exception as e:   # log nunca derruba a automação
+            self._falhou = True
+            print(f"[EVENTOS] Não consegui gravar {self.caminho} ({e}); seguindo sem arquivo.", flush=True)
+
+
+_GRAVADOR = Gravador(EVENTOS_DIR / f"{BOT}-{JOB_ID}.jsonl") if ATIVO else None
+_LOCAL = threading.local()
+_TOTAIS = {}                 # etapa -> [vezes, segundos, máximo]
+_TOTAIS_LOCK = threading.Lock()
+_INICIO = time.monotonic()
+
+
+def empresa_atual() -> str:
+    return getattr(_LOCAL, "empresa", "")
+
+
+def etapa_atual() -> str:
+    pilha = getattr(_LOCAL, "etapas", None)
+    return pilha[-1] if pilha else ""
+
+
+@contextmanager
+def com_empresa(nome: str):
+    """Associa os eventos desta thread à empresa (aninhável)."""
+    anterior = empresa_atual()
+    _LOCAL.empresa = nome
+    try:
+        yield
+    finally:
+        _LOCAL.empresa = anterior
+
+
+def evento(tipo: str, **campos):
+    if _GRAVADOR is None:
+        return
+    reg = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "run": JOB_ID, "bot": BOT, "tipo": tipo}
+    if empresa_atual():
+        reg["empresa"] = empresa_atual()
+    reg.update(campos)
+    _GRAVADOR.escrever(json.dumps(reg, ensure_ascii=False, default=str))
+
+
+def _somar(nome: str, segundos: float):
+    with _TOTAIS_LOCK:
+        t = _TOTAIS.setdefault(nome, [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += segundos
+        t[2] = max(t[2], segundos)
+
+
+@contextmanager
+def etapa(nome: str, **campos):
+    """Mede o bloco e emite um evento "etapa" com a duração e o resultado."""
+    t0 = time.monotonic()
+    status = "ok"
+    if not hasattr(_LOCAL, "etapas"):
+        _LOCAL.etapas = []
+    _LOCAL.etapas.append(nome)
+    try:
+        yield
+    except BaseException as e:
+        status = f"erro: {e.__class__.__name__}"
+        raise
+    finally:
+        _LOCAL.etapas.pop()
+        dur = time.monotonic() - t0
+        _somar(nome, dur)
+        evento("etapa", etapa=nome, duracao_s=round(dur, 3), status=status, **campos)
+
+
+def cronometrado(nome: str):
+    """Decorador: a função inteira conta como a etapa `nome`."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def envolto(*a, **kw):
+            with etapa(nome):
+                return fn(*a, **kw)
+        return envolto
+    return deco
+
+
+def resumo() -> list:
+    """[(etapa, vezes, total_s, max_s)] do mais caro para o mais barato."""
+    with _TOTAIS_LOCK:
+        return sorted(((k, v[0], v[1], v[2]) for k, v in _TOTAIS.items()), key=lambda r: -r[2])
+
+
+# ========= PERFIL DO WEBDRIVER =========
+
+FAIXAS_MS = (5, 20, 50, 200, 1000)      # limites do histograma de latência
+_IGNORAR = (os.sep + "selenium" + os.sep, os.path.abspath(__file__), "contextlib.py")
+_PERFIL = {}            # (função, etapa) -> [comandos, segundos, máximo, Counter(comando), [faixas]]
+_PERFIL_LOCK = threading.Lock()
+
+
+def _chamador() -> str:
+    """Primeira função fora do Selenium/instrumentação na pilha: o helper do bot."""
+    f = sys._getframe(2)
+    while f is not None:
+        arq = f.f_code.co_filename
+        if not any(x in arq for x in _IGNORAR):
+            return f"{Path(arq).stem}.{f.f_code.co_name}"
+        f = f.f_back
+    return "?"
+
+
+def perfilar_driver(driver):
+    """Envolve o executor de comandos do driver para medir cada ida e volta."""
+    executor = driver.command_executor
+    if getattr(executor, "_perfilado", False):
+        return driver
+    original = executor.execute
+
+    def execute(comando, params):
+        quem, onde = _chamador(), etapa_atual()
+        t0 = time.perf_counter()
+        try:
+            return original(comando, params)
+        finally:
+            dur = time.perf_counter() - t0
+            with _PERFIL_LOCK:
+                p = _PERFIL.setdefault((quem, onde), [0, 0.0, 0.0, Counter(), [0] * (len(FAIXAS_MS) + 1)])
+                p[0] += 1
+                p[1] += dur
+                p[2] = max(p[2], dur)
+                p[3][comando] += 1
+                p[4][sum(dur * 1000 >= lim for lim in FAIXAS_MS)] += 1
+
+    executor.execute = execute
+    executor._perfilado = True
+    return driver
+
+
+def perfil_webdriver() -> list:
+    """[(função, etapa, comandos, total_s, max_s, Counter, faixas)] do mais caro para o mais barato."""
+    with _PERFIL_LOCK:
+        return sorted(((q, e, *v) for (q, e), v in _PERFIL.items()), key=lambda r: -r[3])
+
+
+def _imprimir_perfil():
+    linhas = perfil_webdriver()
+    if not linhas:
+        return
+    rotulos = [f"<{FAIXAS_MS[0]}ms"] + [f"<{b}ms" for b in FAIXAS_MS[1:]] + [f">={FAIXAS_MS[-1]}ms"]
+    total = sum(r[2] for r in linhas)
+    print(f"\n🔬 Comandos WebDriver por função ({total} no total):", flush=True)
+    print(f"   {'função':<48} {'etapa':<16} {'cmds':>6} {'total':>8}  " + " ".join(f"{r:>7}" for r in rotulos), flush=True)
+    for quem, onde, n, soma, maximo, comandos, faixas in linhas[:25]:
+        print(f"   {quem[:48]:<48} {onde[:16]:<16} {n:>6} {soma:>7.1f}s  " + " ".join(f"{x:>7}" for x in faixas)
+              + f"   {', '.join(f'{c}×{k}' for c, k in comandos.most_common(3))}", flush=True)
+    for quem, onde, n, soma, maximo, comandos, faixas in linhas:
+        evento("perfil_webdriver", funcao=quem, etapa=onde, comandos=n, total_s=round(soma, 3),
+               max_s=round(maximo, 3), por_comando=dict(comandos), faixas=dict(zip(rotulos, faixas)))
+
+
+@atexit.register
+def _imprimir_resumo():
+    _imprimir_perfil()
+    linhas = resumo()
+    if not linhas:
+        if _GRAVADOR is not None:
+            _GRAVADOR.descarregar()
+        return
+    total = time.monotonic() - _INICIO
+    print(f"\n⏱ Tempo por etapa ({BOT}, execução {JOB_ID}, {total:.1f}s no total):", flush=True)
+    for nome, vezes, soma, maximo in linhas:
+        print(f"   {nome:<22} {vezes:>5}x  {soma:>8.1f}s  ({100 * soma / total if total else 0:>4.1f}%)"
+              f"  média {soma / vezes:.2f}s  máx {maximo:.2f}s", flush=True)
+    # etapas aninhadas (ex.: espera de download dentro da exportação) contam nas duas
+    evento("resumo", duracao_total_s=round(total, 3),
+           etapas={n: {"vezes": v, "total_s": round(s, 3), "max_s": round(m, 3)} for n, v, s, m in linhas})
+    if _GRAVADOR is not None:
+        _GRAVADOR.descarregar()
@@ -0,0 +1,264 @@
+# navegador.py — criação do Chrome/WebDriver compartilhada pelos bots.
+# Quando o script roda como job com o pool ativo (chrome_pool.py), recebe em
+# CHROME_DEBUGGER_ADDRESS o endereço de um Chrome já aberto e logado e apenas
+# se conecta a ele, em vez de abrir um navegador novo.
+#
+# O chromedriver é resolvido por um índice local (versão do Chrome → binário):
+# só numa falta de cache o Selenium Manager é acionado (descoberta de versão e
+# download, que exigem rede); o caminho que ele resolver fica gravado no índice.
+#
+# Com WEBDRIVER_PERFIL=1 todo driver criado aqui tem os comandos medidos
+# (instrumentacao.perfilar_driver); o histograma sai no fim da execução.
+#
+# Modo leve (padrão; NAVEGADOR_LEVE=0 desliga): com `portal=` cada sessão recebe
+# o perfil de bloqueio do portal via CDP (Network.setBlockedURLs) — rastreadores,
+# anúncios e/ou fontes que os fluxos nunca olham —, com uma allowlist do que não
+# pode faltar (captchas do login manual). Imagens só por opção explícita
+# (NAVEGADOR_LEVE_IMAGENS=pmsp,nacional...): um captcha ou botão em imagem com
+# outro nome quebraria o login. `carregamento=` (ou NAVEGADOR_CARREGAMENTO)
+# escolhe o page_load_strategy: normal, eager ou none.
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+from instrumentacao import PERFIL_WEBDRIVER, evento, perfilar_driver
+
+DEBUGGER_ADDRESS = os.environ.get("CHROME_DEBUGGER_ADDRESS", "").strip()
+SESSAO_DO_POOL = bool(DEBUGGER_ADDRESS)
+LEVE = os.environ.get("NAVEGADOR_LEVE", "1") == "1"
+LEVE_IMAGENS = {p.strip() for p in os.environ.get("NAVEGADOR_LEVE_IMAGENS", "").split(",") if p.strip()}
+CARREGAMENTO = os.environ.get("NAVEGADOR_CARREGAMENTO", "").strip().lower()   # normal | eager | none
+
+INDICE_DRIVERS = Path(os.environ.get(
+    "CHROMEDRIVER_INDICE", Path.home() / ".automacao" / "chromedriver" / "indice.json"
+))
+
+CHROME_CANDIDATOS = [
+    os.environ.get("CHROME_BIN", ""),
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+    "/usr/bin/google-chrome",
+    "/usr/bin/google-chrome-stable",
+    "/usr/bin/chromium",
+    "/usr/bin/chromium-browser",
+    "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+]
+
+
+# ========= RESOLUÇÃO DO CHROMEDRIVER (cache local) =========
+
+def _ler_indice() -> dict:
+    try:
+        return json.loads(INDICE_DRIVERS.read_text(encoding="utf-8"))
+    except Exception:
+        return {"chrome": {}, "drivers": {}}
+
+
+def _gravar_indice(indice: dict):
+    try:
+        INDICE_DRIVERS.parent.mkdir(parents=True, exist_ok=True)
+        tmp = INDICE_DRIVERS.with_suffix(".tmp")
+        tmp.write_text(json.dumps(indice, indent=2), encoding="utf-8")
+        os.replace(tmp, INDICE_DRIVERS)
+    except Exception:
+        pass
+
+
+def _localizar_chrome():
+    for c in CHROME_CANDIDATOS:
+        if c and Path(c).exists():
+            return c
+    for nome in ("google-chrome", "chrome", "chromium"):
+        achado = shutil.which(nome)
+        if achado:
+            return achado
+    return None
+
+
+def _versao_do_registro():
+    if sys.platform != "win32":
+        return None
+    try:
+        import winreg
+        for raiz in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(raiz, r"Software\Google\Chrome\BLBeacon") as k:
+                    return winreg.QueryValueEx(k, "version")[0]
+            except OSError:
+                continue
+    except Exception:
+        pass
+    return None
+
+
+def versao_chrome(indice: dict | None = None):
+    """Versão do Chrome instalado. Fora do Windows, `chrome --version` só roda
+    de novo quando o binário muda (mtime guardado no índice)."""
+    if os.environ.get("CHROME_VERSAO"):
+        return os.environ["CHROME_VERSAO"]
+    v = _versao_do_registro()
+    if v:
+        return v
+    binario = _localizar_chrome()
+    if not binario:
+        return None
+    indice = indice if indice is not None else _ler_indice()
+    info = indice.get("chrome", {})
+    mtime = os.path.getmtime(binario)
+    if info.get("binario") == binario and info.get("mtime") == mtime and info.get("versao"):
+        return info["versao"]
+    try:
+        saida = subprocess.run([binario, "--version"], capture_output=True, text=True, timeout=10).stdout
+    except Exception:
+        return None
+    m = re.search(r"(\d+\.\d+\.\d+\.\d+)", saida or "")
+    if not m:
+        return None
+    indice["chrome"] = {"binario": binario, "mtime": mtime, "versao": m.group(1)}
+    _gravar_indice(indice)
+    return m.group(1)
+
+
+def resolver_chromedriver():
+    """Caminho do chromedriver compatível já conhecido, ou None (falta de cache)."""
+    if os.environ.get("CHROMEDRIVER"):
+        return os.environ["CHROMEDRIVER"]
+    indice = _ler_indice()
+    versao = versao_chrome(indice)
+    if not versao:
+        return None
+    caminho = indice.get("drivers", {}).get(versao.split(".")[0])
+    if caminho and Path(caminho).is_file():
+        return caminho
+    return None
+
+
+def registrar_chromedriver(caminho: str):
+    indice = _ler_indice()
+    versao = versao_chrome(indice)
+    if not versao or not caminho:
+        return
+    indice.setdefault("drivers", {})[versao.split(".")[0]] = caminho
+    _gravar_indice(indice)
+
+
+# ========= MODO LEVE (bloqueio de recursos por portal) =========
+
+_RASTREADORES = (
+    "*://*.google-analytics.com/*", "*://*.googletagmanager.com/*", "*://*.doubleclick.net/*",
+    "*://*.hotjar.com/*", "*://*.clarity.ms/*", "*://connect.facebook.net/*", "*://*.facebook.com/tr*",
+)
+_ANUNCIOS = ("*://*.googlesyndication.com/*", "*://*.adservice.google.com/*", "*://*.taboola.com/*")
+_FONTES = ("*://*/*.woff", "*://*/*.woff2", "*://*/*.ttf", "*://*/*.otf", "*://*/*.eot")
+_IMAGENS = ("*://*/*.png", "*://*/*.jpg", "*://*/*.jpeg", "*://*/*.gif", "*://*/*.webp", "*://*/*.svg", "*://*/*.ico")
+_CAPTCHAS = (
+    "*://www.google.com/recaptcha/*", "*://www.gstatic.com/recaptcha/*", "*://*.hcaptcha.com/*", "*://*/*aptcha*",
+)
+
+_CATEGORIAS = {"rastreadores": _RASTREADORES, "anuncios": _ANUNCIOS, "fontes": _FONTES, "imagens": _IMAGENS}
+
+# permitir vence bloquear; "imagens" só entra com o portal em NAVEGADOR_LEVE_IMAGENS;
+# carregamento None = o que vier de `opts`
+PERFIS_LEVES = {
+    "pmsp": {"bloquear": ("rastreadores", "fontes"), "permitir": _CAPTCHAS, "carregamento": None},
+    "nacional": {"bloquear": ("rastreadores", "fontes"), "permitir": _CAPTCHAS, "carregamento": None},
+    # conservadores: no EISS ícones de botão podem ser fonte; no FSist anúncio
+    # bloqueado pode disparar aviso de bloqueador
+    "osasco": {"bloquear": ("rastreadores", "anuncios"), "permitir": _CAPTCHAS, "carregamento": None},
+    "fsist": {"bloquear": ("rastreadores", "fontes"), "permitir": _CAPTCHAS, "carregamento": None},
+}
+
+
+def aplicar_perfil_leve(driver, portal: str) -> bool:
+    """Bloqueia na sessão os recursos do perfil do portal. False se não aplicou."""
+    perfil = PERFIS_LEVES.get(portal or "")
+    if not (LEVE and perfil):
+        return False
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+    except Exception:
+        return False
+    categorias = list(perfil["bloquear"]) + (["imagens"] if portal in LEVE_IMAGENS else [])
+    bloquear = [p for c in categorias for p in _CATEGORIAS[c]]
+    padroes = ([{"urlPattern": p, "block": False} for p in perfil["permitir"]]
+               + [{"urlPattern": p, "block": True} for p in bloquear])
+    try:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urlPatterns": padroes})
+        modo = "allowlist"
+    except Exception:
+        # Chrome antigo (só a lista `urls`, sem exceções): a allowlist não se expressa,
+        # então as imagens ficam liberadas para não barrar captcha
+        categorias = [c for c in categorias if c != "imagens"]
+        try:
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": [p for c in categorias for p in _CATEGORIAS[c]]})
+        except Exception:
+            return False
+        modo = "urls"
+    print(f"[LOG] Modo leve ({portal}): bloqueando {', '.join(categorias)} (NAVEGADOR_LEVE=0 desliga).", flush=True)
+    evento("navegador_leve", portal=portal, modo=modo, categorias=categorias)
+    return True
+
+
+# ========= CRIAÇÃO DO DRIVER =========
+
+def _novo_driver(opts: Options, service=None) -> webdriver.Chrome:
+    if service is not None:
+        return webdriver.Chrome(service=service, options=opts)
+    caminho = resolver_chromedriver()
+    if caminho:
+        return webdriver.Chrome(service=Service(caminho), options=opts)
+    # falta de cache: o Selenium Manager resolve (e baixa, se preciso) o driver
+    driver = webdriver.Chrome(options=opts)
+    try:
+        registrar_chromedriver(driver.service.path)
+    except Exception:
+        pass
+    return driver
+
+
+def criar_chrome(opts: Options, download_dir=None, service=None, anexar: bool = True,
+                 portal: str | None = None, carregamento: str | None = None) -> webdriver.Chrome:
+    """Abre o Chrome com `opts` ou conecta-se à sessão emprestada pelo pool.
+
+    No modo pool os args/prefs de `opts` não se aplicam (o Chrome já está
+    aberto); a pasta de download é ajustada via CDP. `anexar=False` força um
+    Chrome novo mesmo com pool (navegadores extras do modo paralelo).
+    `portal` liga o perfil de bloqueio (PERFIS_LEVES); `carregamento` é o
+    page_load_strategy (NAVEGADOR_CARREGAMENTO, se definido, prevalece).
+    """
+    estrategia = CARREGAMENTO or carregamento or PERFIS_LEVES.get(portal or "", {}).get("carregamento")
+    driver = _criar_chrome(opts, download_dir, service, anexar, estrategia)
+    if portal:
+        aplicar_perfil_leve(driver, portal)
+    return perfilar_driver(driver) if PERFIL_WEBDRIVER else driver
+
+
+def _criar_chrome(opts: Options, download_dir, service, anexar: bool, estrategia) -> webdriver.Chrome:
+    if not (SESSAO_DO_POOL and anexar):
+        if estrategia:
+            opts.page_load_strategy = estrategia
+        return _novo_driver(opts, service)
+
+    anexo = Options()
+    anexo.debugger_address = DEBUGGER_ADDRESS
+    if estrategia:
+        anexo.page_load_strategy = estrategia   # capacidade da sessão: vale também no Chrome do pool
+    driver = _novo_driver(anexo, service)
+    if download_dir:
+        try:
+            driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+                "behavior": "allow", "downloadPath": str(download_dir),
+            })
+        except Exception:
+            pass
+    print(f"[LOG] Conectado ao Chrome do pool em {DEBUGGER_ADDRESS}.", flush=True)
+    return driver
@@ -3,7 +3,6 @@
 # Inclui LOGIN GUIADO: abre login.aspx, mostra banner com botão
 # "Continuar execução" e só prossegue quando a tela de CONSULTAS estiver pronta.
 
-from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
@@ -13,13 +12,52 @@ from selenium.common.exceptions import (
     UnexpectedAlertPresentException
 )
 from pathlib import Path
-from datetime import datetime
-import base64, re, time, csv, sys, traceback
+import base64, os, queue, re, threading, time, sys, traceback
+
+from navegador import criar_chrome, SESSAO_DO_POOL
+from downloads import (
+    obter_rastreador, pasta_rascunho, pasta_saida, publicar_dedup, limpar_rascunho, SAIDA_DIR
+)
+from relatorios import Relatorio
+from competencia import competencia_alvo
+from checkpoint import Checkpoint
+from frames import switch_into_iframe_with
+from selects import ler_opcoes, listar_selects, selecionar_flex
+from esperas import aguardar_rede_ociosa, pausa
+from instrumentacao import com_empresa, cronometrado, etapa, evento
 
 URL_LOGIN     = "https://nfe.prefeitura.sp.gov.br/login.aspx"
 URL_CONSULTAS = "https://nfe.prefeitura.sp.gov.br/contribuinte/consultas.aspx"
-
-def log(msg): print("[LOG]", msg, flush=True)
+PORTAL        = "NFS-e PMSP"   # <saída>/NFS-e PMSP/AAAA-MM/<empresa>/
+
+# Modo paralelo: N navegadores (o principal + N-1 extras) dividem a lista de
+# empresas. Cada extra faz o seu próprio login: o contribuinte selecionado fica
+# na sessão do servidor, então navegadores com a mesma sessão (cookies copiados)
+# trocariam a empresa uns dos outros no meio dos relatórios. O intervalo mínimo
+# entre ações continua limitando a taxa no servidor.
+PARALELO          = int(os.environ.get("NFSE_PARALELO", 1))
+INTERVALO_PORTAL  = float(os.environ.get("NFSE_INTERVALO_PORTAL", 0.5))   # segundos entre ações no portal
+
+def log(msg):
+    print("[LOG]", msg, flush=True)
+    evento("log", mensagem=str(msg))
+
+class LimitadorPortal:
+    """Garante um intervalo mínimo entre ações no portal, somando todos os navegadores."""
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._proximo = 0.0
+
+    def aguardar(self):
+        with self._lock:
+            agora = time.monotonic()
+            espera = self._proximo - agora
+            self._proximo = max(agora, self._proximo) + self.intervalo
+        if espera > 0:
+            pausa(espera, "limitador_portal")
+
+limitador = LimitadorPortal(INTERVALO_PORTAL)
 
 def sanitize(name: str) -> str:
     name = re.sub(r'[\r\n\t]+', ' ', name)
@@ -27,14 +65,12 @@ def sanitize(name: str) -> str:
     name = re.sub(r'\s{2,}', ' ', name).strip()
     return (name[:140].rstrip() if len(name) > 140 else name) or "Empresa"
 
-def mes_ano_anterior():
-    hoje = datetime.now()
-    ano, mes = hoje.year, hoje.month - 1
-    if mes == 0:
-        mes, ano = 12, ano - 1
+def mes_ano_alvo():
+    # mês passado, ou o pedido em --competencia AAAA-MM (backfill)
+    ano, mes = competencia_alvo()
     return f"{mes:02d}", str(ano)
 
-def create_driver():
+def create_driver(anexar: bool = True):
     opts = Options()
     # janela visível (login manual). Se quiser, adicione "user-data-dir" para manter a sessão do Chrome.
     opts.add_argument("--start-maximized")
@@ -45,7 +81,7 @@ def create_driver():
         "profile.default_content_setting_values.automatic_downloads": 1,
     }
     opts.add_experimental_option("prefs", prefs)
-    return webdriver.Chrome(options=opts)
+    return criar_chrome(opts, anexar=anexar, portal="pmsp")
 
 # ========= LOGIN GUIADO =========
 
@@ -86,21 +122,19 @@ def _inject_login_overlay(driver):
 def _consultas_select_exists(driver) -> bool:
     xp = "//select[option[contains(.,'Selecione o contribuinte')]]"
     try:
-        if driver.find_elements(By.XPATH, xp):
-            return True
-        for f in driver.find_elements(By.TAG_NAME, "iframe"):
-            try:
-                driver.switch_to.default_content(); driver.switch_to.frame(f)
-                if driver.find_elements(By.XPATH, xp):
-                    return True
-            except Exception:
-                pass
-        driver.switch_to.default_content()
+        return switch_into_iframe_with(driver, xp, max_scan=50)
     except Exception:
         driver.switch_to.default_content()
     return False
 
+@cronometrado("espera_login")
 def wait_login_and_consultas(driver, timeout=900):
+    if SESSAO_DO_POOL:
+        # o Chrome do pool normalmente já está logado: tenta ir direto às Consultas
+        driver.get(URL_CONSULTAS)
+        if _consultas_select_exists(driver):
+            log("Sessão do pool já autenticada; tela de Consultas pronta.")
+            return
     log("Abrindo login.aspx e aguardando você finalizar o login…")
     driver.get(URL_LOGIN)
     t0 = time.time()
@@ -137,29 +171,12 @@ def wait_login_and_consultas(driver, timeout=900):
                 except Exception: pass
                 log("Ainda não localizei o select de contribuintes. Abra 'Consulta de Notas' e clique no botão novamente.")
 
-        time.sleep(0.5)
+        pausa(0.5, "login_manual")
 
     raise TimeoutException("Tempo máximo de login esgotado.")
 
 # ========= UTILITÁRIOS DE PÁGINA =========
 
-def switch_into_iframe_with(driver, xpath_target: str, max_scan=12) -> bool:
-    driver.switch_to.default_content()
-    try:
-        if driver.find_elements(By.XPATH, xpath_target):
-            return True
-    except Exception:
-        pass
-    for f in driver.find_elements(By.TAG_NAME, "iframe")[:max_scan]:
-        try:
-            driver.switch_to.default_content(); driver.switch_to.frame(f)
-            if driver.find_elements(By.XPATH, xpath_target):
-                return True
-        except Exception:
-            pass
-    driver.switch_to.default_content()
-    return False
-
 def localizar_select_contribuinte(driver):
     xp = "//select[option[contains(.,'Selecione o contribuinte')]]"
     assert switch_into_iframe_with(driver, xp), "Não achei o select de contribuintes."
@@ -170,19 +187,17 @@ def listar_contribuintes(driver):
     textos = []
     for _ in range(3):
         try:
-            S = Select(sel)
-            if len(S.options) <= 1:
-                time.sleep(0.4); continue
-            for opt in S.options[1:]:
-                t = (opt.text or "").strip()
-                if t and "Selecione o contribuinte" not in t:
-                    textos.append(t)
+            opcoes = ler_opcoes(sel)   # todos os textos numa chamada só
+            if len(opcoes) <= 1:
+                pausa(0.4, "lista_contribuintes"); continue
+            textos = [t for t, _ in opcoes[1:] if t and "Selecione o contribuinte" not in t]
             break
         except StaleElementReferenceException:
-            sel = localizar_select_contribuinte(driver); time.sleep(0.2)
+            sel = localizar_select_contribuinte(driver); pausa(0.2, "select_recarregado")
     driver.switch_to.default_content()
     return textos
 
+@cronometrado("selecao_filtros")
 def selecionar_contribuinte(driver, texto_visivel: str) -> str:
     sel = localizar_select_contribuinte(driver)
     for _ in range(3):
@@ -193,7 +208,7 @@ def selecionar_contribuinte(driver, texto_visivel: str) -> str:
             driver.switch_to.default_content()
             return sanitize(raz)
         except StaleElementReferenceException:
-            sel = localizar_select_contribuinte(driver); time.sleep(0.2)
+            sel = localizar_select_contribuinte(driver); pausa(0.2, "select_recarregado")
     driver.switch_to.default_content()
     return "Empresa"
 
@@ -217,48 +232,43 @@ def _pick_select_ano_mes(driver):
     if not switch_into_iframe_with(driver, xp_mes):
         return None, None
     sel_ano = sel_mes = None
-    for sel in driver.find_elements(By.TAG_NAME, "select"):
-        try:
-            texts = [(o.text or "").strip() for o in sel.find_elements(By.TAG_NAME, "option")]
-        except StaleElementReferenceException:
-            continue
+    for s in listar_selects(driver):   # selects e opções do frame numa chamada só
+        texts = [t for t, _ in s["opcoes"]]
         if not texts: continue
         if sum(1 for t in texts if re.fullmatch(r"\d{4}", t)) >= 4:
-            sel_ano = sel
+            sel_ano = s["el"]
         if sum(1 for t in texts if re.fullmatch(r"(0?[1-9]|1[0-2])", t)) >= 8:
-            sel_mes = sel
+            sel_mes = s["el"]
     return sel_ano, sel_mes
 
+@cronometrado("selecao_filtros")
 def set_periodo_mes_anterior(driver):
-    mm, yyyy = mes_ano_anterior()
+    mm, yyyy = mes_ano_alvo()
     sel_ano, sel_mes = _pick_select_ano_mes(driver)
     if sel_ano:
         for _ in range(3):
             try:
-                S = Select(sel_ano)
-                try: S.select_by_visible_text(yyyy)
-                except: S.select_by_value(yyyy)
+                if not selecionar_flex(sel_ano, yyyy):
+                    raise ValueError(f"Ano {yyyy} não está entre as opções do filtro.")
                 break
             except StaleElementReferenceException:
-                sel_ano, sel_mes = _pick_select_ano_mes(driver); time.sleep(0.2)
+                sel_ano, sel_mes = _pick_select_ano_mes(driver); pausa(0.2, "select_recarregado")
     alvo_mes_txt = str(int(mm))
     if sel_mes:
         for _ in range(3):
             try:
-                S = Select(sel_mes)
-                try: S.select_by_visible_text(alvo_mes_txt)
-                except:
-                    try: S.select_by_visible_text(mm)
-                    except: S.select_by_value(mm)
+                if not selecionar_flex(sel_mes, alvo_mes_txt, numero_mes=int(mm)):
+                    raise ValueError(f"Mês {mm} não está entre as opções do filtro.")
                 break
             except StaleElementReferenceException:
-                sel_ano, sel_mes = _pick_select_ano_mes(driver); time.sleep(0.2)
+                sel_ano, sel_mes = _pick_select_ano_mes(driver); pausa(0.2, "select_recarregado")
     driver.switch_to.default_content()
     log(f"Período ajustado para {mm}/{yyyy}.")
     return mm, yyyy
 
 # ========= ABRIR RELATÓRIOS (POP-UP) =========
 
+@cronometrado("navegacao")
 def _abrir_relatorio(driver, tipo: str) -> str:
     """Clica em EMITIDAS ou RECEBIDAS e retorna o handle da nova janela/aba."""
     if tipo == "EMITIDAS":
@@ -267,6 +277,7 @@ def _abrir_relatorio(driver, tipo: str) -> str:
         xp_btn = "//input[@id='ctl00_body_btRecebidas' or contains(@onclick,'receb')]"
 
     assert switch_into_iframe_with(driver, xp_btn), f"Não encontrei o botão de {tipo}."
+    limitador.aguardar()
     prev = set(driver.window_handles)
     start_url = driver.current_url
 
@@ -289,10 +300,11 @@ def _abrir_relatorio(driver, tipo: str) -> str:
                     return h
         if driver.current_url != start_url:
             return driver.current_window_handle
-        time.sleep(0.2)
+        pausa(0.2, "nova_janela")
 
     raise TimeoutException(f"Não consegui abrir a tela de {tipo}.")
 
+@cronometrado("espera_tabela")
 def _esperar_tabela(driver):
     try:
         WebDriverWait(driver, 20).until(
@@ -303,17 +315,20 @@ def _esperar_tabela(driver):
     except TimeoutException:
         log("Aviso: não identifiquei claramente a tabela; vou imprimir mesmo assim.")
 
-def imprimir_pdf(driver, nome_base: str) -> Path:
+@cronometrado("impressao_pdf")
+def imprimir_pdf(driver, nome_base: str, pasta: Path) -> Path:
     pdf = driver.execute_cdp_cmd("Page.printToPDF", {"printBackground": True})
     data = base64.b64decode(pdf["data"])
-    out = Path.home() / "Downloads" / (sanitize(nome_base) + ".pdf")
-    with open(out, "wb") as f: f.write(data)
+    tmp = pasta_rascunho() / (sanitize(nome_base) + ".pdf")
+    with open(tmp, "wb") as f: f.write(data)
+    out, _ = publicar_dedup(tmp, pasta / tmp.name)
     log(f"PDF salvo em: {out}")
     return out
 
-def exportar_txt(driver, nome_base: str):
-    downloads = Path.home() / "Downloads"
-    antes = {p for p in downloads.glob("*")}
+@cronometrado("exportacao_txt")
+def exportar_txt(driver, nome_base: str, pasta: Path):
+    rastreador = obter_rastreador(driver)
+    marca = rastreador.marca()
 
     # Seleção TXT
     xp_sel = "//select[option[normalize-space(.)='TXT'] or option[contains(.,'TXT')]]"
@@ -348,28 +363,22 @@ def exportar_txt(driver, nome_base: str):
         log("Aviso: botão 'Exportar' não encontrado.")
         return None
 
-    alvo = downloads / (sanitize(nome_base) + ".txt")
-    t0 = time.time()
-    ultimo = None
-    while time.time() - t0 < 30:
-        atuais = {p for p in downloads.glob("*.txt")}
-        novos = [p for p in atuais - {p for p in antes if p.suffix.lower()=='.txt'} if not p.name.endswith(".crdownload")]
-        if novos:
-            novo = max(novos, key=lambda p: p.stat().st_mtime)
-            ultimo = novo
-            try:
-                if alvo.exists(): alvo.unlink()
-                novo.replace(alvo)
-                log(f"TXT salvo em: {alvo}")
-                return alvo
-            except PermissionError:
-                time.sleep(0.5)
-        time.sleep(0.4)
-    if ultimo:
-        log(f"Aviso: TXT baixado como '{ultimo.name}', mas não renomeado.")
-        return ultimo
-    log("Aviso: não detectei o download do TXT.")
-    return None
+    alvo = pasta / (sanitize(nome_base) + ".txt")
+    with etapa("espera_download", formato="txt"):
+        baixado = rastreador.aguardar(marca, (".txt",), timeout=30)
+    if not baixado:
+        log("Aviso: não detectei o download do TXT.")
+        return None
+    novo = Path(baixado)
+    for _ in range(10):
+        try:
+            publicar_dedup(novo, alvo)
+            log(f"TXT salvo em: {alvo}")
+            return alvo
+        except PermissionError:
+            pausa(0.5, "arquivo_em_uso")
+    log(f"Aviso: TXT baixado como '{novo.name}', mas não renomeado.")
+    return novo
 
 def extrair_razao_ccm(driver) -> str:
     driver.switch_to.default_content()
@@ -398,61 +407,64 @@ def extrair_valor_servicos(driver) -> str:
             return re.sub(r'\s+', '', m.group(1).strip())
     return ""
 
-def salvar_excel(tipo: str, razao: str, mm: str, yyyy: str, valor: str):
-    downloads = Path.home() / "Downloads"
+# planilhas-resumo: as linhas vão para um diário e o .xlsx é gravado uma vez no fim
+COLUNAS_RELATORIO = ["Tipo", "Razão Social", "Período", "Valor dos Serviços"]
+RELATORIOS = {
+    "EMITIDAS": Relatorio(SAIDA_DIR / "relatorio_nfse Emitidas.xlsx", COLUNAS_RELATORIO),
+    "RECEBIDAS": Relatorio(SAIDA_DIR / "relatorio_nfse Recebidas.xlsx", COLUNAS_RELATORIO),
+}
 
-    # escolhe o arquivo de saída com base no tipo
-    if (tipo or "").upper() == "EMITIDAS":
-        xlsx = downloads / "relatorio_nfse Emitidas.xlsx"
-        csv_path = downloads / "relatorio_nfse Emitidas.csv"
-    else:
-        xlsx = downloads / "relatorio_nfse Recebidas.xlsx"
-        csv_path = downloads / "relatorio_nfse Recebidas.csv"
+# retomada: empresa × tipo × artefato concluídos ficam no diário da competência
+TIPOS = ("EMITIDAS", "RECEBIDAS")
+ARTEFATOS = ("pdf", "txt", "planilha")
+_MM, _YYYY = mes_ano_alvo()
+CHECKPOINT = Checkpoint(SAIDA_DIR / PORTAL / f"{_YYYY}-{_MM}" / ".checkpoint.jsonl")
 
-    row = {
+def salvar_excel(tipo: str, razao: str, mm: str, yyyy: str, valor: str):
+    # escolhe o arquivo de saída com base no tipo
+    rel = RELATORIOS["EMITIDAS" if (tipo or "").upper() == "EMITIDAS" else "RECEBIDAS"]
+    rel.adicionar({
         "Tipo": tipo,
         "Razão Social": razao,
         "Período": f"{mm}/{yyyy}",
         "Valor dos Serviços": valor or ""
-    }
-
-    try:
-        import pandas as pd
-        # tenta ler o existente; se não der, cria um novo DataFrame com o schema desejado
-        if xlsx.exists():
-            try:
-                df = pd.read_excel(xlsx)
-            except Exception:
-                df = pd.DataFrame(columns=row.keys())
-        else:
-            df = pd.DataFrame(columns=row.keys())
+    })
+    log(f"Linha registrada para a planilha: {rel.xlsx.name}")
 
-        df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
-        df.to_excel(xlsx, index=False)
-        log(f"Planilha atualizada: {xlsx}")
-    except Exception as e:
-        # fallback para CSV se pandas/openpyxl não estiverem disponíveis
-        write_header = not csv_path.exists()
-        with open(csv_path, "a", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=row.keys())
-            if write_header:
-                w.writeheader()
-            w.writerow(row)
-        log(f"Aviso: sem pandas/openpyxl ({e}). Salvei no CSV: {csv_path}")
+def materializar_planilhas():
+    for rel in RELATORIOS.values():
+        try:
+            caminho = rel.materializar()
+            if caminho: log(f"Planilha atualizada: {caminho}")
+        except Exception as e:
+            log(f"Falha ao gravar {rel.xlsx}: {e} (linhas preservadas em {rel.diario})")
 
 
 # ========= FLUXOS =========
 
-def processar_emitidas(driver, razao_filtros, mm, yyyy, main_handle):
+def gerar_artefatos(driver, empresa, tipo, faltam, base, pasta, razao, mm, yyyy, valor):
+    """Gera só os artefatos ainda pendentes no checkpoint, registrando cada um ao concluir."""
+    if "pdf" in faltam:
+        CHECKPOINT.marcar(empresa, tipo, "pdf", imprimir_pdf(driver, base, pasta))
+    if "txt" in faltam:
+        txt = exportar_txt(driver, base, pasta)
+        if txt: CHECKPOINT.marcar(empresa, tipo, "txt", txt)
+    if "planilha" in faltam:
+        salvar_excel(tipo, razao, mm, yyyy, valor)
+        CHECKPOINT.marcar(empresa, tipo, "planilha")
+
+def processar_emitidas(driver, empresa, razao_filtros, mm, yyyy, main_handle):
+    faltam = CHECKPOINT.pendentes(empresa, "EMITIDAS", ARTEFATOS)
+    if not faltam:
+        log("EMITIDAS já concluída (checkpoint)."); return
     h = _abrir_relatorio(driver, "EMITIDAS")
     driver.switch_to.window(h)
     _esperar_tabela(driver)
     razao = extrair_razao_ccm(driver) or razao_filtros
     valor = extrair_valor_servicos(driver)
     base = sanitize(f"{razao} – NFS-e EMITIDAS – {yyyy}-{mm}")
-    imprimir_pdf(driver, base)
-    exportar_txt(driver, base)
-    salvar_excel("EMITIDAS", razao, mm, yyyy, valor)
+    pasta = pasta_saida(PORTAL, f"{yyyy}-{mm}", razao)
+    gerar_artefatos(driver, empresa, "EMITIDAS", faltam, base, pasta, razao, mm, yyyy, valor)
     try:
         if driver.current_window_handle != main_handle:
             driver.close()
@@ -460,16 +472,18 @@ def processar_emitidas(driver, razao_filtros, mm, yyyy, main_handle):
         pass
     driver.switch_to.window(main_handle)
 
-def processar_recebidas(driver, razao_filtros, mm, yyyy, main_handle):
+def processar_recebidas(driver, empresa, razao_filtros, mm, yyyy, main_handle):
+    faltam = CHECKPOINT.pendentes(empresa, "RECEBIDAS", ARTEFATOS)
+    if not faltam:
+        log("RECEBIDAS já concluída (checkpoint)."); return
     h = _abrir_relatorio(driver, "RECEBIDAS")
     driver.switch_to.window(h)
     _esperar_tabela(driver)
     razao = extrair_razao_ccm(driver) or razao_filtros
     valor = extrair_valor_servicos(driver)
     base = sanitize(f"{razao} – NFS-e RECEBIDAS – {yyyy}-{mm}")
-    imprimir_pdf(driver, base)
-    exportar_txt(driver, base)
-    salvar_excel("RECEBIDAS", razao, mm, yyyy, valor)
+    pasta = pasta_saida(PORTAL, f"{yyyy}-{mm}", razao)
+    gerar_artefatos(driver, empresa, "RECEBIDAS", faltam, base, pasta, razao, mm, yyyy, valor)
     try:
         if driver.current_window_handle != main_handle:
             driver.close()
@@ -478,24 +492,81 @@ def processar_recebidas(driver, razao_filtros, mm, yyyy, main_handle):
     driver.switch_to.window(main_handle)
 
 def processar_empresa(driver, texto_opt: str, main_handle: str):
+    if CHECKPOINT.completo(texto_opt, TIPOS, ARTEFATOS):
+        log(f"'{texto_opt}' já concluída (checkpoint). Pulando."); return
+    with com_empresa(texto_opt), etapa("empresa"):
+        _processar_empresa(driver, texto_opt, main_handle)
+
+def _processar_empresa(driver, texto_opt: str, main_handle: str):
+    # downloads desta empresa numa pasta própria dentro do rascunho do job
+    obter_rastreador(driver).definir_pasta(pasta_rascunho(sanitize(texto_opt)))
+    limitador.aguardar()
     razao_filtros = selecionar_contribuinte(driver, texto_opt)
     marcar_incidencia(driver)
     mm, yyyy = set_periodo_mes_anterior(driver)
 
     try:
-        processar_emitidas(driver, razao_filtros, mm, yyyy, main_handle)
+        processar_emitidas(driver, texto_opt, razao_filtros, mm, yyyy, main_handle)
     except Exception as e:
         log(f"Atenção (EMITIDAS) '{texto_opt}': {e}")
         traceback.print_exc()
 
     try:
-        processar_recebidas(driver, razao_filtros, mm, yyyy, main_handle)
+        processar_recebidas(driver, texto_opt, razao_filtros, mm, yyyy, main_handle)
     except Exception as e:
         log(f"Atenção (RECEBIDAS) '{texto_opt}': {e}")
         traceback.print_exc()
 
-def main():
+def _abrir_navegador_extra(k: int):
+    """Chrome novo com sessão própria no portal (login guiado, como no principal)."""
+    extra = create_driver(anexar=False)
+    try:
+        log(f"Navegador extra {k}: faça o login nele também (sessão separada do principal).")
+        wait_login_and_consultas(extra)
+        obter_rastreador(extra, pasta_rascunho())
+        return extra
+    except Exception as e:
+        log(f"Aviso: navegador extra {k} sem sessão ({e}); seguindo sem ele.")
+    try: extra.quit()
+    except Exception: pass
+    return None
+
+def _worker_empresas(driver, fila, total):
+    main_handle = driver.current_window_handle
+    while True:
+        try:
+            i, texto_opt = fila.get_nowait()
+        except queue.Empty:
+            return
+        log(f"----- [{i}/{total}] {texto_opt} -----")
+        try:
+            driver.switch_to.window(main_handle)
+            processar_empresa(driver, texto_opt, main_handle)
+        except Exception as e:
+            log(f"Falha ao processar '{texto_opt}': {e}")
+            traceback.print_exc()
+
+def processar_em_paralelo(driver, empresas, n):
+    extras = [d for d in (_abrir_navegador_extra(k) for k in range(1, n)) if d]
+    log(f"Processando com {1 + len(extras)} navegador(es) em paralelo.")
+    fila = queue.Queue()
+    for item in enumerate(empresas, start=1):
+        fila.put(item)
+    threads = [
+        threading.Thread(target=_worker_empresas, args=(d, fila, len(empresas)), name=f"empresas-{k}")
+        for k, d in enumerate([driver] + extras)
+    ]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    for d in extras:
+        try: d.quit()
+        except Exception: pass
+
+def main() -> bool:
+    """True só se todas as empresas ficaram completas no checkpoint (o código de saída
+    do processo é o que o jobs.py usa para dar o mês do backfill por concluído)."""
     driver = create_driver()
+    obter_rastreador(driver, pasta_rascunho())
     try:
         wait_login_and_consultas(driver)          # <-- LOGIN GUIADO
         main_handle = driver.current_window_handle
@@ -503,22 +574,37 @@ def main():
         empresas = listar_contribuintes(driver)
         if not empresas:
             log("Não encontrei empresas na lista (só o placeholder?).")
-            return
+            return False
 
         log(f"Total de empresas na lista: {len(empresas)}")
-        for i, texto_opt in enumerate(empresas, start=1):
-            log(f"----- [{i}/{len(empresas)}] {texto_opt} -----")
-            try:
-                driver.switch_to.window(main_handle)
-                processar_empresa(driver, texto_opt, main_handle)
-            except Exception as e:
-                log(f"Falha ao processar '{texto_opt}': {e}")
-                traceback.print_exc()
-            time.sleep(0.6)
-
+        feitas = sum(1 for e in empresas if CHECKPOINT.completo(e, TIPOS, ARTEFATOS))
+        if feitas:
+            log(f"Checkpoint: {feitas} empresa(s) já concluída(s) em {CHECKPOINT.caminho} serão puladas.")
+        if PARALELO > 1:
+            processar_em_paralelo(driver, empresas, PARALELO)
+        else:
+            for i, texto_opt in enumerate(empresas, start=1):
+                log(f"----- [{i}/{len(empresas)}] {texto_opt} -----")
+                try:
+                    driver.switch_to.window(main_handle)
+                    processar_empresa(driver, texto_opt, main_handle)
+                except Exception as e:
+                    log(f"Falha ao processar '{texto_opt}': {e}")
+                    traceback.print_exc()
+                # antes: 0.6 s fixos; agora só até a tela de Consultas terminar os postbacks
+                # (o intervalo mínimo entre ações no portal continua no limitador)
+                aguardar_rede_ociosa(driver, quieto=0.2, timeout=5, motivo="entre_empresas")
+
+        faltando = [e for e in empresas if not CHECKPOINT.completo(e, TIPOS, ARTEFATOS)]
+        if faltando:
+            log(f"{len(faltando)} empresa(s) com artefatos pendentes: {', '.join(faltando[:10])}{' …' if len(faltando) > 10 else ''}")
+            return False
         log("Concluído para todas as empresas.")
+        return True
     finally:
-        pass  # deixe o navegador aberto para você revisar se quiser
+        materializar_planilhas()
+        CHECKPOINT.fechar()
+        limpar_rascunho()  # deixe o navegador aberto para você revisar se quiser
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(0 if main() else 1)
\ No newline at end of file
@@ -1,7 +1,8 @@
-import sys, time, os, re
+import sys, re
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime, timedelta
-from xml.etree import ElementTree as ET
+from urllib.parse import urlencode, urljoin
+from datetime import datetime
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -10,6 +11,14 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 
+from navegador import criar_chrome
+from downloads import obter_rastreador, pasta_rascunho, pasta_saida, publicar_dedup, limpar_rascunho, ClienteHTTP
+from acervo import ingerir_no_acervo
+from xml_fiscal import ler_nomes
+from competencia import competencia_alvo, intervalo
+from instrumentacao import cronometrado, etapa
+from esperas import aguardar_dom_estavel, aguardar_troca, pausa
+
 # ----------------------------
 # CONFIG
 # ----------------------------
@@ -29,20 +38,29 @@ USE_CHROME_PROFILE = False
 USER_DATA_DIR = r"C:\Users\SEUUSUARIO\AppData\Local\Google\Chrome\User Data"
 PROFILE_DIR = "Default"
 
-DOWNLOAD_DIR = str(Path.home() / "Downloads")
+DOWNLOAD_DIR = str(pasta_rascunho())   # downloads deste job (isolados); saída final em <saída>/PORTAL/AAAA-MM/
+PORTAL = "NFS-e Nacional"
 USE_FIRST_TWO_WORDS = True
 
 MAX_PAGES = 50     # trava de segurança para paginação
+# Filtro de datas do próprio portal (mesmos parâmetros do formulário de busca
+# das listas de notas). A lista vem da emissão mais recente para a mais antiga,
+# então a paginação para na primeira página que já passou do mês alvo.
+# A lista filtrada só é usada se carregar coerente (só notas da competência, ou
+# vazia com o aviso de "nenhum registro"); senão a lista é recarregada sem filtro.
+FILTRO_SERVIDOR = True
+RE_SEM_RESULTADO = re.compile(r"nenhum(a)?\s+(registro|nota|resultado)|n[ãa]o\s+(foram\s+)?encontrad", re.IGNORECASE)
+DOWNLOAD_VIA_HTTP = True  # baixa XML/DANFS-e direto pelos hrefs da tabela (sessão do navegador)
+HTTP_PARALELO = 4         # downloads simultâneos no modo HTTP
 SAVE_SCREENSHOTS = False  # só cria pasta de saída se der erro
 
 # ----------------------------
 # UTILS
 # ----------------------------
-def _prev_month_year(base_dt=None):
-    if base_dt is None: base_dt = datetime.now()
-    first = base_dt.replace(day=1)
-    last_prev = first - timedelta(days=1)
-    return last_prev.month, last_prev.year
+def _mes_ano_alvo():
+    # mês passado, ou o pedido em --competencia AAAA-MM (backfill)
+    ano, mes = competencia_alvo()
+    return mes, ano
 
 def _parse_br_date(txt):
     txt = (txt or "").strip()
@@ -53,34 +71,16 @@ def _sanitize_filename(name: str) -> str:
     name = re.sub(r"[^\w \-\.]+", "", name, flags=re.UNICODE)
     return re.sub(r"\s{2,}", " ", name).strip()
 
-def _list_downloaded_files(directory: str, ext_filter: str | None = None) -> set[str]:
-    files = {f for f in os.listdir(directory) if not f.endswith(".crdownload")}
-    if ext_filter: files = {f for f in files if f.lower().endswith(ext_filter.lower())}
-    return files
-
-def _wait_new_download(directory: str, before: set[str], expected_ext: str, timeout: int = 60) -> str | None:
-    end = time.time() + timeout
-    while time.time() < end:
-        current = _list_downloaded_files(directory, expected_ext)
-        new_files = list(current - before)
-        if new_files:
-            paths = [Path(directory) / nf for nf in new_files]
-            paths.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-            return str(paths[0])
-        time.sleep(0.4)
-    return None
-
-def _apply_prefix(fullpath: str, prefix: str) -> str:
+def _apply_prefix(fullpath: str, prefix: str, destino_dir: Path) -> str:
+    """Publica o arquivo baixado em `destino_dir` com o prefixo no nome.
+    Conteúdo repetido não gera cópia nem " (1)": reaproveita o blob/nome existente."""
     if not fullpath: return ""
     p = Path(fullpath)
     safe_prefix = _sanitize_filename(prefix)
-    desired = p.with_name(f"{safe_prefix} {p.name}")
-    if desired.exists():
-        base, ext, i = desired.stem, desired.suffix, 2
-        while desired.exists():
-            desired = desired.with_name(f"{base} ({i}){ext}"); i += 1
+    desired = destino_dir / f"{safe_prefix} {p.name}"
     try:
-        p.rename(desired); return str(desired)
+        caminho, novo = publicar_dedup(p, desired, substituir=False)
+        return str(caminho) if novo else f"{caminho} (já arquivado)"
     except Exception:
         return fullpath
 
@@ -92,39 +92,13 @@ def _shorten_name(name: str) -> str:
 # ----------------------------
 # XML parsing
 # ----------------------------
-def _et_all_text_by_tail_tag(root: ET.Element, tag_endings: list[str]) -> list[str]:
-    found = []
-    for elem in root.iter():
-        t = elem.tag
-        if isinstance(t, str) and any(t.endswith(tail) for tail in tag_endings):
-            if elem.text and elem.text.strip(): found.append(elem.text.strip())
-    return found
-
 def extract_names_from_xml(xml_path: str) -> dict:
-    result = {"prestador": "", "tomador": ""}
+    # leitura em streaming (xml_fiscal): para assim que prestador e tomador aparecem
     try:
-        parser = ET.XMLParser(encoding="utf-8")
-        tree = ET.parse(xml_path, parser=parser)
-        root = tree.getroot()
+        nomes = ler_nomes(xml_path)
     except Exception:
-        return result
-    names_generic = _et_all_text_by_tail_tag(root, ["RazaoSocial","xNome","NomeFantasia"])
-    if names_generic:
-        result["prestador"] = _shorten_name(names_generic[0])
-        for nm in names_generic[1:]:
-            if nm != names_generic[0]:
-                result["tomador"] = _shorten_name(nm); break
-    try:
-        for blk in root.iter():
-            tag = blk.tag if isinstance(blk.tag, str) else ""
-            if tag.endswith("PrestadorServico"):
-                txts=[c.text.strip() for c in blk.iter() if isinstance(c.tag,str) and c.text and c.text.strip() and (c.tag.endswith("RazaoSocial") or c.tag.endswith("xNome") or c.tag.endswith("NomeFantasia"))]
-                if txts: result["prestador"]=_shorten_name(txts[0])
-            if tag.endswith("TomadorServico"):
-                txts=[c.text.strip() for c in blk.iter() if isinstance(c.tag,str) and c.text and c.text.strip() and (c.tag.endswith("RazaoSocial") or c.tag.endswith("xNome"))]
-                if txts: result["tomador"]=_shorten_name(txts[0])
-    except Exception: pass
-    return result
+        return {"prestador": "", "tomador": ""}
+    return {k: _shorten_name(v) if v else "" for k, v in nomes.items()}
 
 # ----------------------------
 # Selenium helpers
@@ -151,10 +125,11 @@ def make_driver(headless: bool = False) -> webdriver.Chrome:
         "profile.password_manager_enabled": False,
     }
     chrome_opts.add_experimental_option("prefs", prefs)
-    driver = webdriver.Chrome(options=chrome_opts)
+    driver = criar_chrome(chrome_opts, download_dir=DOWNLOAD_DIR, portal="nacional")
     driver.implicitly_wait(0)
     return driver
 
+@cronometrado("espera_login")
 def wait_until_logged_in(driver):
     wait = WebDriverWait(driver, TIMEOUT_LONG)
     def ok(_d):
@@ -163,6 +138,7 @@ def wait_until_logged_in(driver):
         except Exception: return False
     wait.until(ok)
 
+@cronometrado("navegacao")
 def _click_menu_card(driver, href: str, label_for_debug: str):
     try:
         wait = WebDriverWait(driver, TIMEOUT_MED)
@@ -173,7 +149,7 @@ def _click_menu_card(driver, href: str, label_for_debug: str):
             elem.click()
         except WebDriverException:
             driver.execute_script("arguments[0].scrollIntoView({block:'center'});", elem)
-            time.sleep(0.2)
+            pausa(0.2, "rolagem")
             try: elem.click()
             except WebDriverException: driver.execute_script("arguments[0].click();", elem)
         try: WebDriverWait(driver, TIMEOUT_MED).until(EC.url_contains(href))
@@ -182,31 +158,59 @@ def _click_menu_card(driver, href: str, label_for_debug: str):
     except Exception as e:
         print(f"⚠️ Não consegui abrir {label_for_debug}: {e}")
 
-def coletar_linhas_mes_anterior(driver):
-    alvo_mes, alvo_ano = _prev_month_year()
+# Snapshot da tabela inteira numa única chamada: texto das células, hrefs de
+# download (das âncoras ou do data-content do popover) e índice da linha.
+JS_TABELA = r"""
+var tb = document.querySelector('table tbody');
+if (!tb) return null;
+var RX_XML = /\/EmissorNacional\/Notas\/Download\/NFSe\/[^"'\s<>]+/;
+var RX_PDF = /\/EmissorNacional\/Notas\/Download\/DANFSe\/[^"'\s<>]+/;
+return Array.prototype.map.call(tb.querySelectorAll('tr'), function(tr, i){
+  var celulas = Array.prototype.map.call(tr.querySelectorAll('td'), function(td){
+    return (td.innerText || td.textContent || '').trim();
+  });
+  var txt = '';
+  tr.querySelectorAll('a[href]').forEach(function(a){ txt += ' ' + a.getAttribute('href'); });
+  tr.querySelectorAll('[data-content]').forEach(function(el){ txt += ' ' + el.getAttribute('data-content'); });
+  var xml = txt.match(RX_XML), pdf = txt.match(RX_PDF);
+  return {indice: i, celulas: celulas, xml: xml ? xml[0] : null, danfse: pdf ? pdf[0] : null};
+});
+"""
+
+@cronometrado("leitura_tabela")
+def coletar_linhas_mes_anterior(driver, info: dict | None = None):
+    """Linhas da página com emissão na competência alvo. Em `info["mais_antiga"]`
+    fica a menor data de emissão da página (para saber se já passou do mês)."""
+    alvo_mes, alvo_ano = _mes_ano_alvo()
     # tenta localizar tabela; se não houver, retorna []
     try:
-        tabela = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody")))
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody")))
     except TimeoutException:
-        try: tabela = driver.find_element(By.CSS_SELECTOR, "table tbody")
-        except Exception: return []
-    linhas = tabela.find_elements(By.CSS_SELECTOR, "tr")
+        pass
+    try:
+        linhas = driver.execute_script(JS_TABELA)
+    except Exception:
+        return []
     if not linhas: return []
     resultados = []
-    for tr in linhas:
-        tds = tr.find_elements(By.CSS_SELECTOR, "td")
+    for linha in linhas:
+        tds = linha["celulas"]
         if len(tds) < 2: continue
-        emissao_txt = tds[0].text.strip()
+        emissao_txt = tds[0]
         emissao_dt = _parse_br_date(emissao_txt)
+        if info is not None and emissao_dt and (info.get("mais_antiga") is None or emissao_dt < info["mais_antiga"]):
+            info["mais_antiga"] = emissao_dt
         if not emissao_dt or (emissao_dt.month != alvo_mes or emissao_dt.year != alvo_ano):
             continue
-        empresa = tds[1].text.strip()
-        competencia = tds[2].text.strip() if len(tds) > 2 else ""
-        municipio = tds[3].text.strip() if len(tds) > 3 else ""
-        preco = tds[4].text.strip() if len(tds) > 4 else ""
-        situacao = tds[5].text.strip() if len(tds) > 5 else ""
+        empresa = tds[1]
+        competencia = tds[2] if len(tds) > 2 else ""
+        municipio = tds[3] if len(tds) > 3 else ""
+        preco = tds[4] if len(tds) > 4 else ""
+        situacao = tds[5] if len(tds) > 5 else ""
         resultados.append({
-            "tr": tr,
+            "indice": linha["indice"],
+            "xml": linha.get("xml"),
+            "danfse": linha.get("danfse"),
             "Emissão": emissao_txt,
             "Emitida para": empresa,
             "Competência": competencia,
@@ -216,13 +220,21 @@ def coletar_linhas_mes_anterior(driver):
         })
     return resultados
 
+def linha_por_indice(driver, indice: int):
+    """Handle do <tr> (só quando é preciso clicar no menu da linha)."""
+    return driver.execute_script(
+        "var tb=document.querySelector('table tbody'); return tb ? tb.querySelectorAll('tr')[arguments[0]] : null;",
+        indice,
+    )
+
 def abrir_menu_linha(driver, tr):
+    if tr is None: return False
     try: el = tr.find_element(By.CSS_SELECTOR, "a.icone-trigger")
     except Exception:
         try: el = tr.find_element(By.CSS_SELECTOR, ".glyphicon.glyphicon-option-vertical")
         except Exception: return False
     driver.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
-    time.sleep(0.1)
+    pausa(0.1, "rolagem")
     try: el.click()
     except Exception: driver.execute_script("arguments[0].click();", el)
     try:
@@ -267,36 +279,159 @@ def _find_next_button(driver):
             continue
     return None
 
+def url_lista(href: str) -> str:
+    return urljoin(HOME_URL + '/', href)
+
+def url_filtrada(href: str) -> str:
+    """Lista de notas já filtrada no servidor pelo intervalo da competência."""
+    alvo_mes, alvo_ano = _mes_ano_alvo()
+    ini, fim = intervalo(alvo_ano, alvo_mes)
+    q = urlencode({"executar": 1, "busca": "", "datainicio": ini.strftime("%d/%m/%Y"), "datafim": fim.strftime("%d/%m/%Y")})
+    return f"{url_lista(href)}?{q}"
+
+def _filtro_confirmado(driver) -> bool:
+    """A lista filtrada carregou certo: linhas só da competência, ou nenhuma
+    linha com o aviso de "nenhum registro" do portal. Página de erro, lista
+    vazia sem aviso ou notas de outros meses (filtro ignorado) -> False."""
+    alvo_mes, alvo_ano = _mes_ano_alvo()
+    try:
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody")))
+    except TimeoutException:
+        pass
+    try:
+        linhas = driver.execute_script(JS_TABELA) or []
+        datas = [d for d in (_parse_br_date(l["celulas"][0]) for l in linhas if l["celulas"]) if d]
+        if datas:
+            return all((d.year, d.month) == (alvo_ano, alvo_mes) for d in datas)
+        return bool(RE_SEM_RESULTADO.search(driver.find_element(By.TAG_NAME, "body").text))
+    except Exception:
+        return False
+
+def _passou_do_mes(info: dict) -> bool:
+    alvo_mes, alvo_ano = _mes_ano_alvo()
+    d = info.get("mais_antiga")
+    return d is not None and (d.year, d.month) < (alvo_ano, alvo_mes)
+
+@cronometrado("navegacao")
 def _go_next_page(driver):
     btn = _find_next_button(driver)
     if not btn: return False
+    linha = driver.find_elements(By.CSS_SELECTOR, "table tbody tr")[:1]
     driver.execute_script("arguments[0].scrollIntoView({block:'center'});", btn)
     try:
         btn.click()
     except Exception:
         driver.execute_script("arguments[0].click();", btn)
-    # espera tabela “mudar” minimamente
-    time.sleep(0.6)
+    # espera a tabela ser trocada (a linha antiga sai do DOM) e parar de mudar
+    if linha:
+        aguardar_troca(driver, linha[0], timeout=15, motivo="proxima_pagina")
+    aguardar_dom_estavel(driver, quieto=0.15, timeout=3, motivo="proxima_pagina")
     return True
 
 # ----------------------------
 # Processadores por página (com paginação)
 # ----------------------------
+def _prefixo_por_tipo(names: dict, pagina_tipo: str) -> str:
+    if pagina_tipo == "emitidas":
+        return names.get("prestador") or names.get("tomador") or "NFSE"
+    return names.get("tomador") or names.get("prestador") or "NFSE"
+
+def _baixar_linha_clicando(driver, downloads, item, pagina_tipo, saida):
+    """Fluxo pelo menu da linha (popover). Retorna o prefixo usado ou None."""
+    tr = linha_por_indice(driver, item["indice"])
+    if not abrir_menu_linha(driver, tr):
+        print("   ⚠️ Não consegui abrir o menu desta linha. Pulando…"); return None
+
+    # XML primeiro
+    marca = downloads.marca()
+    try:
+        clicar_download_xml(driver)
+    except Exception as e:
+        print(f"   ⚠️ Erro ao clicar 'Download XML': {e}"); return None
+    with etapa("espera_download", formato="xml"):
+        xml_path = downloads.aguardar(marca, (".xml",), timeout=60)
+    if not xml_path:
+        print("   ⚠️ XML não detectado."); return None
+    print(f"   ✅ XML baixado: {xml_path}")
+
+    prefix = _prefixo_por_tipo(extract_names_from_xml(xml_path), pagina_tipo)
+    xml_renamed = _apply_prefix(xml_path, prefix, saida); print(f"   🏷  XML renomeado: {xml_renamed}")
+
+    # PDF
+    if not abrir_menu_linha(driver, tr):
+        print("   ⚠️ Não consegui reabrir o menu para baixar o DANFS-e. Pulando PDF…")
+    else:
+        marca = downloads.marca()
+        try:
+            clicar_download_danfse(driver)
+            with etapa("espera_download", formato="pdf"):
+                pdf_path = downloads.aguardar(marca, (".pdf",), timeout=60)
+            if pdf_path:
+                pdf_renamed = _apply_prefix(pdf_path, prefix, saida); print(f"   🏷  PDF renomeado: {pdf_renamed}")
+            else:
+                print("   ⚠️ PDF não detectado.")
+        except Exception as e:
+            print(f"   ⚠️ Erro ao clicar 'Download DANFS-e': {e}")
+    return prefix
+
+def _baixar_linha_http(cliente, links, pagina_tipo, saida):
+    """Fluxo direto pelos hrefs (roda no pool de threads). Retorna o prefixo usado ou None."""
+    try:
+        with etapa("download_http", formato="xml"):
+            xml_path = str(cliente.baixar(links["xml"], DOWNLOAD_DIR, (".xml",)))
+    except Exception as e:
+        print(f"   ⚠️ Falha no download do XML ({links['xml']}): {e}"); return None
+    prefix = _prefixo_por_tipo(extract_names_from_xml(xml_path), pagina_tipo)
+    print(f"   🏷  XML: {_apply_prefix(xml_path, prefix, saida)}")
+    if links.get("danfse"):
+        try:
+            with etapa("download_http", formato="pdf"):
+                pdf_path = str(cliente.baixar(links["danfse"], DOWNLOAD_DIR, (".pdf",)))
+            print(f"   🏷  PDF: {_apply_prefix(pdf_path, prefix, saida)}")
+        except Exception as e:
+            print(f"   ⚠️ Falha no download do DANFS-e ({links['danfse']}): {e}")
+    return prefix
+
 def processar_pagina(driver, pagina_tipo: str, href: str):
     """
     pagina_tipo: "emitidas" (prestados) usa prefixo do PRESTADOR;
                  "recebidas" (tomados) usa prefixo do TOMADOR.
     """
     _click_menu_card(driver, href, f"NFS-e {pagina_tipo.capitalize()}")
+    if FILTRO_SERVIDOR:
+        try:
+            with etapa("navegacao", filtro=True):
+                driver.get(url_filtrada(href))
+            filtrado = _filtro_confirmado(driver)
+        except Exception as e:
+            print(f"⚠️ Não consegui aplicar o filtro de datas ({e}).")
+            filtrado = False
+        if filtrado:
+            print(f"🔎 Filtro de datas aplicado no portal ({pagina_tipo}).")
+        else:
+            print(f"⚠️ Lista filtrada não confirmada; recarregando sem filtro e filtrando na página ({pagina_tipo}).")
+            with etapa("navegacao", filtro=False):
+                driver.get(url_lista(href))
 
-    alvo_mes, alvo_ano = _prev_month_year()
+    alvo_mes, alvo_ano = _mes_ano_alvo()
+    downloads = obter_rastreador(driver, DOWNLOAD_DIR)
+    saida = pasta_saida(PORTAL, f"{alvo_ano:04d}-{alvo_mes:02d}", pagina_tipo.capitalize())
     planilha_rows, excel_prefix_for_batch = [], None
+    pendentes = []   # (item, prefixo ou Future do download HTTP), na ordem da tabela
+    cliente = executor = None
+    if DOWNLOAD_VIA_HTTP:
+        cliente = ClienteHTTP(driver, HTTP_PARALELO)
+        executor = ThreadPoolExecutor(max_workers=HTTP_PARALELO)
     pagina = 1
 
     while pagina <= MAX_PAGES:
-        linhas = coletar_linhas_mes_anterior(driver)
+        info = {}
+        linhas = coletar_linhas_mes_anterior(driver, info)
         if not linhas:
-            # se não tem linhas nesta página, tenta próxima; se não houver próxima, encerra
+            # sem linhas do mês: se a página já é mais antiga que o mês, acabou
+            if _passou_do_mes(info):
+                print(f"⏹ Página {pagina} já é anterior à competência; parando ({pagina_tipo})."); break
+            # senão tenta próxima; se não houver próxima, encerra
             if not _go_next_page(driver): break
             pagina += 1
             continue
@@ -304,59 +439,38 @@ def processar_pagina(driver, pagina_tipo: str, href: str):
         print(f"— Página {pagina} ({pagina_tipo}) —")
 
         for idx, item in enumerate(linhas, start=1):
-            tr = item["tr"]; emissao = item["Emissão"]; empresa_coluna = item["Emitida para"]
+            emissao = item["Emissão"]; empresa_coluna = item["Emitida para"]
             print(f"▶️ [{pagina_tipo}] Linha {idx}: {empresa_coluna} — Emissão {emissao}")
 
-            if not abrir_menu_linha(driver, tr):
-                print("   ⚠️ Não consegui abrir o menu desta linha. Pulando…"); continue
-
-            # XML primeiro
-            before_xml = _list_downloaded_files(DOWNLOAD_DIR, ".xml")
-            try:
-                clicar_download_xml(driver)
-            except Exception as e:
-                print(f"   ⚠️ Erro ao clicar 'Download XML': {e}"); continue
-            xml_path = _wait_new_download(DOWNLOAD_DIR, before_xml, ".xml", timeout=60)
-            if not xml_path:
-                print("   ⚠️ XML não detectado."); continue
-            print(f"   ✅ XML baixado: {xml_path}")
-
-            names = extract_names_from_xml(xml_path)
-            prefix = (names.get("prestador") or names.get("tomador") or "NFSE") if pagina_tipo=="emitidas" \
-                     else (names.get("tomador") or names.get("prestador") or "NFSE")
-            if not excel_prefix_for_batch and prefix: excel_prefix_for_batch = prefix
-
-            xml_renamed = _apply_prefix(xml_path, prefix); print(f"   🏷  XML renomeado: {xml_renamed}")
-
-            # PDF
-            if not abrir_menu_linha(driver, tr):
-                print("   ⚠️ Não consegui reabrir o menu para baixar o DANFS-e. Pulando PDF…")
+            if DOWNLOAD_VIA_HTTP and item["xml"]:
+                pendentes.append((item, executor.submit(_baixar_linha_http, cliente, item, pagina_tipo, saida)))
             else:
-                before_pdf = _list_downloaded_files(DOWNLOAD_DIR, ".pdf")
-                try:
-                    clicar_download_danfse(driver)
-                    pdf_path = _wait_new_download(DOWNLOAD_DIR, before_pdf, ".pdf", timeout=60)
-                    if pdf_path:
-                        pdf_renamed = _apply_prefix(pdf_path, prefix); print(f"   🏷  PDF renomeado: {pdf_renamed}")
-                    else:
-                        print("   ⚠️ PDF não detectado.")
-                except Exception as e:
-                    print(f"   ⚠️ Erro ao clicar 'Download DANFS-e': {e}")
-
-            planilha_rows.append({
-                "Emissão": item["Emissão"],
-                "Emitida para": empresa_coluna,
-                "Competência": item["Competência"],
-                "Município Emissor": item["Município Emissor"],
-                "Preço Serviço (R$)": item["Preço Serviço (R$)"],
-                "Situação": item["Situação"],
-                "Prefixo usado": prefix,
-            })
+                pendentes.append((item, _baixar_linha_clicando(driver, downloads, item, pagina_tipo, saida)))
 
+        # lista em ordem de emissão decrescente: página que já passou do mês é a última
+        if _passou_do_mes(info):
+            print(f"⏹ Página {pagina} alcançou notas anteriores à competência; parando ({pagina_tipo})."); break
         # tenta ir para próxima página
         if not _go_next_page(driver): break
         pagina += 1
 
+    if executor is not None:
+        executor.shutdown(wait=True)
+    for item, prefix in pendentes:
+        if isinstance(prefix, Future):
+            prefix = prefix.result()
+        if prefix is None: continue
+        if not excel_prefix_for_batch: excel_prefix_for_batch = prefix
+        planilha_rows.append({
+            "Emissão": item["Emissão"],
+            "Emitida para": item["Emitida para"],
+            "Competência": item["Competência"],
+            "Município Emissor": item["Município Emissor"],
+            "Preço Serviço (R$)": item["Preço Serviço (R$)"],
+            "Situação": item["Situação"],
+            "Prefixo usado": prefix,
+        })
+
     # Planilha do mês
     try:
         import pandas as pd
@@ -364,7 +478,7 @@ def processar_pagina(driver, pagina_tipo: str, href: str):
             df = pd.DataFrame(planilha_rows)
             batch_prefix = excel_prefix_for_batch or "NFSE"
             excel_name = f"{batch_prefix} NFSe_{pagina_tipo.capitalize()}_{alvo_ano:04d}-{alvo_mes:02d}.xlsx"
-            excel_path = Path(DOWNLOAD_DIR) / _sanitize_filename(excel_name)
+            excel_path = saida / _sanitize_filename(excel_name)
             df.to_excel(excel_path, index=False)
             print(f"📄 Planilha gerada [{pagina_tipo}]: {excel_path}")
         else:
@@ -372,6 +486,10 @@ def processar_pagina(driver, pagina_tipo: str, href: str):
     except Exception as e:
         print(f"⚠️ Não consegui salvar a planilha Excel ({pagina_tipo}): {e}\nTente: pip install pandas openpyxl")
 
+    # XMLs do mês no acervo local (só os arquivos novos/alterados são lidos)
+    if planilha_rows:
+        ingerir_no_acervo(saida, f"{PORTAL} {pagina_tipo}")
+
 # ----------------------------
 # MAIN
 # ----------------------------
@@ -387,8 +505,6 @@ def main():
         processar_pagina(driver, "emitidas", EMITIDAS_HREF)
         # Recebidas (tomados)
         processar_pagina(driver, "recebidas", RECEBIDAS_HREF)
-
-        time.sleep(0.6)
     except Exception as e:
         if SAVE_SCREENSHOTS:
             out_dir.mkdir(exist_ok=True)
@@ -403,7 +519,7 @@ def main():
         sys.exit(1)
     finally:
         # driver.quit()
-        pass
+        limpar_rascunho()
 
 if __name__ == "__main__":
     main()
@@ -4,7 +4,6 @@
 # Ao prosseguir, o script navega até INÍCIO, abre "Consulta de NFTS" e
 # clica em "NFTS - SERVIÇOS TOMADOS" automaticamente.
 
-from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
@@ -14,17 +13,30 @@ from selenium.common.exceptions import (
     UnexpectedAlertPresentException
 )
 from pathlib import Path
-from datetime import datetime
-import base64, re, time, csv, sys, traceback
+import base64, re, time, sys, traceback
+
+from navegador import criar_chrome, SESSAO_DO_POOL
+from downloads import (
+    obter_rastreador, pasta_rascunho, pasta_saida, publicar_dedup, limpar_rascunho, SAIDA_DIR
+)
+from relatorios import Relatorio
+from competencia import competencia_alvo
+from checkpoint import Checkpoint
+from frames import switch_into_iframe_with
+from selects import ler_opcoes, listar_selects, selecionar_flex
+from esperas import aguardar_rede_ociosa, pausa
+from instrumentacao import com_empresa, cronometrado, etapa, evento
 
 URL_LOGIN   = "https://nfe.prefeitura.sp.gov.br/login.aspx"
 URL_INICIO  = "https://nfe.prefeitura.sp.gov.br/contribuinte/inicio.aspx"
 URL_CONSULTA_NFTS = "https://nfe.prefeitura.sp.gov.br/contribuinte/consultasnfts.aspx"
+PORTAL = "NFTS PMSP"   # <saída>/NFTS PMSP/AAAA-MM/<empresa>/
 
 # ========================= UTIL =========================
 
 def log(msg):
     print("[LOG]", msg, flush=True)
+    evento("log", mensagem=str(msg))
 
 def sanitize(name: str) -> str:
     name = re.sub(r'[\r\n\t]+', ' ', name)
@@ -32,11 +44,9 @@ def sanitize(name: str) -> str:
     name = re.sub(r'\s{2,}', ' ', name).strip()
     return (name[:140].rstrip() if len(name) > 140 else name) or "Empresa"
 
-def mes_ano_anterior():
-    hoje = datetime.now()
-    ano, mes = hoje.year, hoje.month - 1
-    if mes == 0:
-        mes, ano = 12, ano - 1
+def mes_ano_alvo():
+    # mês passado, ou o pedido em --competencia AAAA-MM (backfill)
+    ano, mes = competencia_alvo()
     return f"{mes:02d}", str(ano)
 
 
@@ -50,26 +60,7 @@ def create_driver():
         "profile.default_content_setting_values.automatic_downloads": 1,
     }
     opts.add_experimental_option("prefs", prefs)
-    return webdriver.Chrome(options=opts)
-
-# ========================= IFRAME HELPERS =========================
-
-def switch_into_iframe_with(driver, xpath_target: str, max_scan=12) -> bool:
-    driver.switch_to.default_content()
-    try:
-        if driver.find_elements(By.XPATH, xpath_target):
-            return True
-    except Exception:
-        pass
-    for f in driver.find_elements(By.TAG_NAME, "iframe")[:max_scan]:
-        try:
-            driver.switch_to.default_content(); driver.switch_to.frame(f)
-            if driver.find_elements(By.XPATH, xpath_target):
-                return True
-        except Exception:
-            pass
-    driver.switch_to.default_content()
-    return False
+    return criar_chrome(opts, portal="pmsp")
 
 # ========================= LOGIN GUIADO =========================
 
@@ -136,22 +127,20 @@ def _filtros_prontos(driver) -> bool:
     # 2) Caso a URL não seja a de consulta, tentamos detectar os filtros por iframe
     xp = "//select[option[contains(.,'Selecione o contribuinte')]]"
     try:
-        if driver.find_elements(By.XPATH, xp):
-            return True
-        for f in driver.find_elements(By.TAG_NAME, "iframe"):
-            try:
-                driver.switch_to.default_content(); driver.switch_to.frame(f)
-                if driver.find_elements(By.XPATH, xp):
-                    return True
-            except Exception:
-                pass
-        driver.switch_to.default_content()
+        return switch_into_iframe_with(driver, xp, max_scan=50)
     except Exception:
         driver.switch_to.default_content()
     return False
 
 
+@cronometrado("espera_login")
 def wait_login_and_open_nfts(driver, timeout=900):
+    if SESSAO_DO_POOL:
+        # o Chrome do pool normalmente já está logado: tenta ir direto à consulta
+        driver.get(URL_CONSULTA_NFTS)
+        if _filtros_prontos(driver):
+            log("Sessão do pool já autenticada; tela de filtros da NFTS pronta.")
+            return
     log("Abrindo login.aspx e aguardando você finalizar o login…")
     driver.get(URL_LOGIN)
     t0 = time.time()
@@ -192,7 +181,7 @@ def wait_login_and_open_nfts(driver, timeout=900):
             if _filtros_prontos(driver):
                 log("Tela de filtros da NFTS pronta.")
                 return
-        time.sleep(0.4)
+        pausa(0.4, "login_manual")
 
     raise TimeoutException("Tempo máximo de login esgotado.")
 
@@ -231,9 +220,9 @@ def _abrir_menu_consulta_nfts(driver):
     # Procuramos algo como "Consulta de Notas" e depois "Consulta de NFTS".
     driver.switch_to.default_content()
     _click_by_text(driver, ["Consulta de Notas"])  # hover não é necessário se o click expandir
-    time.sleep(0.3)
+    aguardar_rede_ociosa(driver, quieto=0.2, timeout=3, motivo="menu_consulta_notas")
     _click_by_text(driver, ["Consulta de NFTS", "NFTS"])  # fallback genérico
-    time.sleep(0.5)
+    aguardar_rede_ociosa(driver, quieto=0.2, timeout=5, motivo="menu_consulta_nfts")
 
 
 def _abrir_pagina_nfts_servicos_tomados(driver):
@@ -269,20 +258,18 @@ def listar_contribuintes(driver):
     textos = []
     for _ in range(3):
         try:
-            S = Select(sel)
-            if len(S.options) <= 1:
-                time.sleep(0.4); continue
-            for opt in S.options[1:]:
-                t = (opt.text or "").strip()
-                if t and "Selecione o contribuinte" not in t:
-                    textos.append(t)
+            opcoes = ler_opcoes(sel)   # todos os textos numa chamada só
+            if len(opcoes) <= 1:
+                pausa(0.4, "lista_contribuintes"); continue
+            textos = [t for t, _ in opcoes[1:] if t and "Selecione o contribuinte" not in t]
             break
         except StaleElementReferenceException:
-            sel = localizar_select_contribuinte(driver); time.sleep(0.2)
+            sel = localizar_select_contribuinte(driver); pausa(0.2, "select_recarregado")
     driver.switch_to.default_content()
     return textos
 
 
+@cronometrado("selecao_filtros")
 def selecionar_contribuinte(driver, texto_visivel: str) -> str:
     sel = localizar_select_contribuinte(driver)
     for _ in range(3):
@@ -293,7 +280,7 @@ def selecionar_contribuinte(driver, texto_visivel: str) -> str:
             driver.switch_to.default_content()
             return sanitize(raz)
         except StaleElementReferenceException:
-            sel = localizar_select_contribuinte(driver); time.sleep(0.2)
+            sel = localizar_select_contribuinte(driver); pausa(0.2, "select_recarregado")
     driver.switch_to.default_content()
     return "Empresa"
 
@@ -319,49 +306,44 @@ def _pick_select_ano_mes(driver):
     if not switch_into_iframe_with(driver, xp_mes):
         return None, None
     sel_ano = sel_mes = None
-    for sel in driver.find_elements(By.TAG_NAME, "select"):
-        try:
-            texts = [(o.text or "").strip() for o in sel.find_elements(By.TAG_NAME, "option")]
-        except StaleElementReferenceException:
-            continue
+    for s in listar_selects(driver):   # selects e opções do frame numa chamada só
+        texts = [t for t, _ in s["opcoes"]]
         if not texts: continue
         if sum(1 for t in texts if re.fullmatch(r"\d{4}", t)) >= 4:
-            sel_ano = sel
+            sel_ano = s["el"]
         if sum(1 for t in texts if re.fullmatch(r"(0?[1-9]|1[0-2])", t)) >= 8:
-            sel_mes = sel
+            sel_mes = s["el"]
     return sel_ano, sel_mes
 
 
+@cronometrado("selecao_filtros")
 def set_periodo_mes_anterior(driver):
-    mm, yyyy = mes_ano_anterior()
+    mm, yyyy = mes_ano_alvo()
     sel_ano, sel_mes = _pick_select_ano_mes(driver)
     if sel_ano:
         for _ in range(3):
             try:
-                S = Select(sel_ano)
-                try: S.select_by_visible_text(yyyy)
-                except: S.select_by_value(yyyy)
+                if not selecionar_flex(sel_ano, yyyy):
+                    raise ValueError(f"Ano {yyyy} não está entre as opções do filtro.")
                 break
             except StaleElementReferenceException:
-                sel_ano, sel_mes = _pick_select_ano_mes(driver); time.sleep(0.2)
+                sel_ano, sel_mes = _pick_select_ano_mes(driver); pausa(0.2, "select_recarregado")
     alvo_mes_txt = str(int(mm))
     if sel_mes:
         for _ in range(3):
             try:
-                S = Select(sel_mes)
-                try: S.select_by_visible_text(alvo_mes_txt)
-                except:
-                    try: S.select_by_visible_text(mm)
-                    except: S.select_by_value(mm)
+                if not selecionar_flex(sel_mes, alvo_mes_txt, numero_mes=int(mm)):
+                    raise ValueError(f"Mês {mm} não está entre as opções do filtro.")
                 break
             except StaleElementReferenceException:
-                sel_ano, sel_mes = _pick_select_ano_mes(driver); time.sleep(0.2)
+                sel_ano, sel_mes = _pick_select_ano_mes(driver); pausa(0.2, "select_recarregado")
     driver.switch_to.default_content()
     log(f"Período ajustado para {mm}/{yyyy}.")
     return mm, yyyy
 
 # ========================= AÇÕES NA PÁGINA DE RESULTADO =========================
 
+@cronometrado("espera_tabela")
 def _esperar_tabela(driver):
     try:
         WebDriverWait(driver, 20).until(
@@ -371,18 +353,21 @@ def _esperar_tabela(driver):
         log("Aviso: não identifiquei claramente a tabela; vou imprimir mesmo assim.")
 
 
-def imprimir_pdf(driver, nome_base: str) -> Path:
+@cronometrado("impressao_pdf")
+def imprimir_pdf(driver, nome_base: str, pasta: Path) -> Path:
     pdf = driver.execute_cdp_cmd("Page.printToPDF", {"printBackground": True})
     data = base64.b64decode(pdf["data"])
-    out = Path.home() / "Downloads" / (sanitize(nome_base) + ".pdf")
-    with open(out, "wb") as f: f.write(data)
+    tmp = pasta_rascunho() / (sanitize(nome_base) + ".pdf")
+    with open(tmp, "wb") as f: f.write(data)
+    out, _ = publicar_dedup(tmp, pasta / tmp.name)
     log(f"PDF salvo em: {out}")
     return out
 
 
-def exportar_txt(driver, nome_base: str):
-    downloads = Path.home() / "Downloads"
-    antes = {p for p in downloads.glob("*")}
+@cronometrado("exportacao_txt")
+def exportar_txt(driver, nome_base: str, pasta: Path):
+    rastreador = obter_rastreador(driver)
+    marca = rastreador.marca()
 
     # Seleção TXT
     xp_sel = "//select[option[normalize-space(.)='TXT'] or option[contains(.,'TXT')]]"
@@ -417,28 +402,22 @@ def exportar_txt(driver, nome_base: str):
         log("Aviso: botão 'Exportar' não encontrado.")
         return None
 
-    alvo = downloads / (sanitize(nome_base) + ".txt")
-    t0 = time.time()
-    ultimo = None
-    while time.time() - t0 < 30:
-        atuais = {p for p in downloads.glob("*.txt")}
-        novos = [p for p in atuais - {p for p in antes if p.suffix.lower()=='.txt'} if not p.name.endswith(".crdownload")]
-        if novos:
-            novo = max(novos, key=lambda p: p.stat().st_mtime)
-            ultimo = novo
-            try:
-                if alvo.exists(): alvo.unlink()
-                novo.replace(alvo)
-                log(f"TXT salvo em: {alvo}")
-                return alvo
-            except PermissionError:
-                time.sleep(0.5)
-        time.sleep(0.4)
-    if ultimo:
-        log(f"Aviso: TXT baixado como '{ultimo.name}', mas não renomeado.")
-        return ultimo
-    log("Aviso: não detectei o download do TXT.")
-    return None
+    alvo = pasta / (sanitize(nome_base) + ".txt")
+    with etapa("espera_download", formato="txt"):
+        baixado = rastreador.aguardar(marca, (".txt",), timeout=30)
+    if not baixado:
+        log("Aviso: não detectei o download do TXT.")
+        return None
+    novo = Path(baixado)
+    for _ in range(10):
+        try:
+            publicar_dedup(novo, alvo)
+            log(f"TXT salvo em: {alvo}")
+            return alvo
+        except PermissionError:
+            pausa(0.5, "arquivo_em_uso")
+    log(f"Aviso: TXT baixado como '{novo.name}', mas não renomeado.")
+    return novo
 
 
 def extrair_razao_ccm(driver) -> str:
@@ -470,30 +449,28 @@ def extrair_valor_servicos(driver) -> str:
     return ""
 
 
+# retomada: empresa × NFTS × artefato concluídos ficam no diário da competência
+ARTEFATOS = ("pdf", "txt", "planilha")
+_MM, _YYYY = mes_ano_alvo()
+CHECKPOINT = Checkpoint(SAIDA_DIR / PORTAL / f"{_YYYY}-{_MM}" / ".checkpoint.jsonl")
+
+# planilha-resumo: as linhas vão para um diário e o .xlsx é gravado uma vez no fim
+RELATORIO = Relatorio(SAIDA_DIR / "relatorio_nftse.xlsx", ["Tipo", "Razão Social", "Período", "Valor dos Serviços"])
+
 def salvar_excel(razao: str, mm: str, yyyy: str, valor: str):
-    downloads = Path.home() / "Downloads"
-    xlsx = downloads / "relatorio_nftse.xlsx"
-    row = {"Tipo": "NFTS - SERVIÇOS TOMADOS", "Razão Social": razao, "Período": f"{mm}/{yyyy}", "Valor dos Serviços": valor or ""}
+    RELATORIO.adicionar({"Tipo": "NFTS - SERVIÇOS TOMADOS", "Razão Social": razao, "Período": f"{mm}/{yyyy}", "Valor dos Serviços": valor or ""})
+    log(f"Linha registrada para a planilha: {RELATORIO.xlsx.name}")
+
+def materializar_planilha():
     try:
-        import pandas as pd
-        if xlsx.exists():
-            df = pd.read_excel(xlsx)
-            df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
-        else:
-            df = pd.DataFrame([row])
-        df.to_excel(xlsx, index=False)
-        log(f"Planilha atualizada: {xlsx}")
+        caminho = RELATORIO.materializar()
+        if caminho: log(f"Planilha atualizada: {caminho}")
     except Exception as e:
-        csv_path = downloads / "relatorio_nftse.csv"
-        write_header = not csv_path.exists()
-        with open(csv_path, "a", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=row.keys())
-            if write_header: w.writeheader()
-            w.writerow(row)
-        log(f"Aviso: sem pandas/openpyxl ({e}). Salvei no CSV: {csv_path}")
+        log(f"Falha ao gravar {RELATORIO.xlsx}: {e} (linhas preservadas em {RELATORIO.diario})")
 
 # ========================= FLUXO NFTS =========================
 
+@cronometrado("navegacao")
 def _abrir_relatorio_nfts(driver) -> str:
     """Clica em "NFTS - SERVIÇOS TOMADOS" e retorna o handle da nova janela/aba se abrir."""
     xp_btn = (
@@ -524,21 +501,31 @@ def _abrir_relatorio_nfts(driver) -> str:
                     return h
         if driver.current_url != start_url:
             return driver.current_window_handle
-        time.sleep(0.2)
+        pausa(0.2, "nova_janela")
 
     raise TimeoutException("Não consegui abrir a tela da NFTS.")
 
 
-def processar_nfts(driver, razao_filtros, mm, yyyy, main_handle):
+def processar_nfts(driver, empresa, razao_filtros, mm, yyyy, main_handle):
+    faltam = CHECKPOINT.pendentes(empresa, "NFTS", ARTEFATOS)
+    if not faltam:
+        log("NFTS já concluída (checkpoint)."); return
     h = _abrir_relatorio_nfts(driver)
     driver.switch_to.window(h)
     _esperar_tabela(driver)
     razao = extrair_razao_ccm(driver) or razao_filtros
     valor = extrair_valor_servicos(driver)
     base = sanitize(f"{razao} – NFTS – SERVIÇOS TOMADOS – {yyyy}-{mm}")
-    imprimir_pdf(driver, base)
-    exportar_txt(driver, base)
-    salvar_excel(razao, mm, yyyy, valor)
+    pasta = pasta_saida(PORTAL, f"{yyyy}-{mm}", razao)
+    # só os artefatos ainda pendentes; cada um é registrado no checkpoint ao concluir
+    if "pdf" in faltam:
+        CHECKPOINT.marcar(empresa, "NFTS", "pdf", imprimir_pdf(driver, base, pasta))
+    if "txt" in faltam:
+        txt = exportar_txt(driver, base, pasta)
+        if txt: CHECKPOINT.marcar(empresa, "NFTS", "txt", txt)
+    if "planilha" in faltam:
+        salvar_excel(razao, mm, yyyy, valor)
+        CHECKPOINT.marcar(empresa, "NFTS", "planilha")
     try:
         if driver.current_window_handle != main_handle:
             driver.close()
@@ -548,12 +535,21 @@ def processar_nfts(driver, razao_filtros, mm, yyyy, main_handle):
 
 
 def processar_empresa(driver, texto_opt: str, main_handle: str):
+    if CHECKPOINT.completo(texto_opt, ("NFTS",), ARTEFATOS):
+        log(f"'{texto_opt}' já concluída (checkpoint). Pulando."); return
+    with com_empresa(texto_opt), etapa("empresa"):
+        _processar_empresa(driver, texto_opt, main_handle)
+
+
+def _processar_empresa(driver, texto_opt: str, main_handle: str):
+    # downloads desta empresa numa pasta própria dentro do rascunho do job
+    obter_rastreador(driver).definir_pasta(pasta_rascunho(sanitize(texto_opt)))
     razao_filtros = selecionar_contribuinte(driver, texto_opt)
     marcar_incidencia(driver)
     mm, yyyy = set_periodo_mes_anterior(driver)
 
     try:
-        processar_nfts(driver, razao_filtros, mm, yyyy, main_handle)
+        processar_nfts(driver, texto_opt, razao_filtros, mm, yyyy, main_handle)
     except Exception as e:
         log(f"Atenção (NFTS) '{texto_opt}': {e}")
         traceback.print_exc()
@@ -561,8 +557,11 @@ def processar_empresa(driver, texto_opt: str, main_handle: str):
 
 # ========================= MAIN =========================
 
-def main():
+def main() -> bool:
+    """True só se todas as empresas ficaram completas no checkpoint (o código de saída
+    do processo é o que o jobs.py usa para dar o mês do backfill por concluído)."""
     driver = create_driver()
+    obter_rastreador(driver, pasta_rascunho())
     try:
         wait_login_and_open_nfts(driver)  # LOGIN + abrir Consulta de NFTS → NFTS - SERVIÇOS TOMADOS
         main_handle = driver.current_window_handle
@@ -570,9 +569,12 @@ def main():
         empresas = listar_contribuintes(driver)
         if not empresas:
             log("Não encontrei empresas na lista (só o placeholder?).")
-            return
+            return False
 
         log(f"Total de empresas na lista: {len(empresas)}")
+        feitas = sum(1 for e in empresas if CHECKPOINT.completo(e, ("NFTS",), ARTEFATOS))
+        if feitas:
+            log(f"Checkpoint: {feitas} empresa(s) já concluída(s) em {CHECKPOINT.caminho} serão puladas.")
         for i, texto_opt in enumerate(empresas, start=1):
             log(f"----- [{i}/{len(empresas)}] {texto_opt} -----")
             try:
@@ -581,12 +583,20 @@ def main():
             except Exception as e:
                 log(f"Falha ao processar '{texto_opt}': {e}")
                 traceback.print_exc()
-            time.sleep(0.6)
+            # antes: 0.6 s fixos; agora só até a tela de consulta terminar os postbacks
+            aguardar_rede_ociosa(driver, quieto=0.2, timeout=5, motivo="entre_empresas")
 
+        faltando = [e for e in empresas if not CHECKPOINT.completo(e, ("NFTS",), ARTEFATOS)]
+        if faltando:
+            log(f"{len(faltando)} empresa(s) com artefatos pendentes: {', '.join(faltando[:10])}{' …' if len(faltando) > 10 else ''}")
+            return False
         log("Concluído para todas as empresas.")
+        return True
     finally:
-        pass  # mantém o navegador aberto para revisão
+        materializar_planilha()
+        CHECKPOINT.fechar()
+        limpar_rascunho()  # mantém o navegador aberto para revisão
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
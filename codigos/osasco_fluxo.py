@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
-import os, re, time, unicodedata, traceback
-from datetime import date, timedelta
-from dateutil.relativedelta import relativedelta
+import os, re, sys, time, unicodedata, traceback
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 
+from navegador import criar_chrome
+from downloads import obter_rastreador, pasta_rascunho, pasta_saida, publicar_dedup, limpar_rascunho
+from acervo import ingerir_no_acervo
+from competencia import competencia_alvo, intervalo
+from instrumentacao import Gravador, com_empresa, cronometrado, etapa, evento
+from selects import ler_select, selecionar_flex, selecionar_indice
+from esperas import aguardar, aguardar_assentada, aguardar_valor, estado_pagina, instalar_monitor, pausa, OVERLAYS
+
 # ======================= CONFIG GERAL =======================
-DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
+DOWNLOAD_DIR = str(pasta_rascunho())   # downloads deste job (isolados)
+PORTAL = "Osasco"                      # saída final em <saída>/Osasco/AAAA-MM/<empresa>/
 BASE = "https://nfe.osasco.sp.gov.br"
 URL_LOGIN = f"{BASE}/EissnfeWebApp/Portal/Default.aspx?ReturnUrl=%2fEissnfeWebApp%2fSistema%2fGeral%2fLogin.aspx"
 LOG_PATH = r"C:\NFSeOsasco\osasco_log.txt"
@@ -22,24 +27,23 @@ LOG_PATH = r"C:\NFSeOsasco\osasco_log.txt"
 PT_MESES = {1:"janeiro",2:"fevereiro",3:"março",4:"abril",5:"maio",6:"junho",7:"julho",8:"agosto",9:"setembro",10:"outubro",11:"novembro",12:"dezembro"}
 
 # ======================= LOG / UTILS =======================
+_LOG = Gravador(LOG_PATH, lote=20)   # em lote: não reabre o arquivo a cada mensagem
+
 def _log_file(msg: str):
-    try:
-        os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-        with open(LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(msg.rstrip()+"\n")
-    except Exception:
-        pass
+    _LOG.escrever(msg.rstrip())
+
+_FALHAS = []   # contextos que falharam: qualquer um faz o processo sair com código 1
 
 def _report_error(e: Exception, context: str = ""):
+    _FALHAS.append(context or e.__class__.__name__)
     msg = f"❌ Erro {('em '+context) if context else ''}: {e.__class__.__name__} - {str(e) or '(sem mensagem)'}"
     print(msg, flush=True)
     _log_file("\n"+msg+"\n"+traceback.format_exc())
+    evento("erro", contexto=context, erro=e.__class__.__name__, mensagem=str(e))
 
-def calc_intervalo_mes_anterior():
-    hoje = date.today()
-    inicio = (hoje.replace(day=1) - relativedelta(months=1))
-    fim    = (hoje.replace(day=1) - timedelta(days=1))
-    return inicio, fim
+def calc_intervalo_competencia():
+    # mês passado, ou o pedido em --competencia AAAA-MM (backfill)
+    return intervalo(*competencia_alvo())
 
 def _norm(txt):
     if txt is None: return ""
@@ -63,14 +67,16 @@ def setup_driver(download_dir):
     opts.add_argument("--start-maximized")
     opts.add_argument("--safebrowsing-disable-download-protection")
     opts.add_argument("--disable-features=DownloadBubble")
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=opts)
+    driver = criar_chrome(opts, download_dir=download_dir, portal="osasco")
     try:
         driver.execute_cdp_cmd("Page.enable", {})
         driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_dir})
     except Exception:
         pass
+    instalar_monitor(driver)   # XHR/overlays/diálogos acompanhados desde o primeiro documento
     return driver
 
+@cronometrado("espera_login")
 def aguardar_login_manual(driver):
     driver.get(URL_LOGIN)
     print("\n🔐 Faça LOGIN; quando cair na Home eu continuo. (ENTER também funciona)")
@@ -86,44 +92,52 @@ def aguardar_login_manual(driver):
             if msvcrt.kbhit() and msvcrt.getwch()=="\r":
                 print("➡️  Prosseguindo por ENTER."); return
         if time.time()-start>600:
+            _FALHAS.append("login")   # segue (pode ter logado sem a Home esperada), mas a execução não conta como concluída
             print("⚠️ Tempo esgotado (10 min). Prosseguindo."); return
-        time.sleep(1)
+        pausa(1, "login_manual")
 
 # ======================= HELPERS UI =======================
+# botão de fechar do primeiro diálogo jQuery UI visível (Fechar/OK, senão o X do título)
+JS_BOTAO_DIALOGO = r"""
+var dlgs = document.querySelectorAll('div.ui-dialog.ui-widget');
+for (var i = 0; i < dlgs.length; i++) {
+  var d = dlgs[i];
+  if (!(d.offsetWidth || d.offsetHeight) || getComputedStyle(d).visibility === 'hidden') continue;
+  var bts = d.querySelectorAll('button, input[type=button]');
+  for (var k = 0; k < bts.length; k++) {
+    var t = bts[k].tagName === 'INPUT' ? bts[k].value : bts[k].textContent;
+    if (/Fechar|OK|Ok/.test(t || '')) return bts[k];
+  }
+  var x = d.querySelector('a.ui-dialog-titlebar-close');
+  if (x) return x;
+}
+return null;
+"""
+
 def _has_visible_overlay(driver):
-    for css in (".ui-widget-overlay", ".modal-backdrop", ".blockUI"):
-        try:
-            el = driver.find_element(By.CSS_SELECTOR, css)
-            if el.is_displayed(): return True
-        except Exception:
-            pass
-    return False
+    return bool(estado_pagina(driver)["overlay"])
 
 def _esperar_overlay_sumir(driver, timeout=10):
-    end = time.time()+timeout
-    while time.time()<end:
-        if not _has_visible_overlay(driver): return True
-        time.sleep(0.2)
-    try:
-        driver.execute_script("document.querySelectorAll('.ui-widget-overlay,.modal-backdrop,.blockUI').forEach(e=>e.remove());")
-    except Exception: pass
+    # o monitor da página avisa quando bloqueio/XHR terminam (overlay atrás de diálogo é o modal: fica p/ _fechar_todos_os_modais)
+    e = aguardar_assentada(driver, quieto=0.1, timeout=timeout, motivo="overlay")
+    if e["carregando"]:
+        try:
+            driver.execute_script("document.querySelectorAll(arguments[0]).forEach(e=>e.remove());", ",".join(OVERLAYS))
+        except Exception: pass
     return True
 
 def _fechar_todos_os_modais(driver, max_loops=4):
     fechados = 0
     for _ in range(max_loops):
         try:
-            modal = WebDriverWait(driver, 1.5).until(
-                EC.visibility_of_element_located((By.XPATH, "//div[contains(@class,'ui-dialog') and contains(@class,'ui-widget') and not(contains(@style,'display: none'))]"))
-            )
-            try:
-                btn = modal.find_element(By.XPATH, ".//button[contains(.,'Fechar') or contains(.,'OK') or contains(.,'Ok')] | .//input[@type='button' and (contains(@value,'Fechar') or contains(@value,'OK') or contains(@value,'Ok'))]")
-            except Exception:
-                btn = modal.find_element(By.XPATH, ".//a[contains(@class,'ui-dialog-titlebar-close')]")
+            # o alerta, quando vem, abre ao fim do postback: espera a página assentar e pergunta uma vez
+            if not aguardar_assentada(driver, quieto=0.15, timeout=6, motivo="modais")["dialogo"]:
+                break
+            btn = driver.execute_script(JS_BOTAO_DIALOGO)
+            if btn is None:
+                break
             driver.execute_script("arguments[0].click();", btn)
-            _esperar_overlay_sumir(driver, 6)
             fechados += 1
-            time.sleep(0.2)
         except Exception:
             break
     if fechados: print(f"ℹ️ Fechei {fechados} janela(s) de alerta.")
@@ -157,35 +171,21 @@ def _obter_nome_empresa(driver, default="empresa"):
     return default
 
 # ======================= DOWNLOADS =======================
-def _wait_new_download(download_dir, before_set, expect_exts=(".pdf",".xml",".zip"), timeout=150):
-    end = time.time()+timeout
-    last_size = {}
-    while time.time()<end:
-        atual = {f for f in os.listdir(download_dir) if not f.endswith(".crdownload")}
-        novos = [f for f in atual - before_set if f.lower().endswith(expect_exts)]
-        if novos:
-            fn = max(novos, key=lambda n: os.path.getmtime(os.path.join(download_dir, n)))
-            fp = os.path.join(download_dir, fn)
-            size = os.path.getsize(fp)
-            if fn in last_size and last_size[fn]==size:
-                return fn
-            last_size[fn] = size
-        time.sleep(0.35)
-    return None
-
 def _rename_with_retry(orig_full, dest_full, attempts=16, wait=0.5):
     for _ in range(attempts):
         try:
-            os.replace(orig_full, dest_full)
+            publicar_dedup(orig_full, dest_full)   # conteúdo guardado uma vez (hardlink no nome final)
             return True
         except Exception:
-            time.sleep(wait)
+            pausa(wait, "arquivo_em_uso")
     return False
 
 # ======================= EXPORTAÇÃO (PDF/XML) =======================
 def _preencher_input(elem, texto):
     elem.click(); elem.send_keys(Keys.CONTROL, "a"); elem.send_keys(Keys.DELETE)
-    time.sleep(0.05); elem.send_keys(texto); time.sleep(0.05); elem.send_keys(Keys.TAB); time.sleep(0.05)
+    elem.send_keys(texto)
+    aguardar_valor(elem, texto, timeout=2)   # a máscara do campo já aplicou o texto
+    elem.send_keys(Keys.TAB)
 
 def _formatar_para_input(elem, data_obj):
     return data_obj.strftime("%d/%m/%Y")
@@ -222,10 +222,11 @@ def _mark_radio_exact(driver, label_text):
     try:
         driver.execute_script("arguments[0].checked=true; arguments[0].dispatchEvent(new Event('change',{bubbles:true}))", r)
     except Exception: pass
-    time.sleep(0.15)
+    aguardar_assentada(driver, quieto=0.1, timeout=3, motivo="radio")   # o change pode disparar postback
     print(f"   🔘 Marcado: {label_text}")
 
-def _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, considerar, nome_empresa):
+@cronometrado("exportacao")
+def _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, considerar, nome_empresa, destino_dir):
     _abrir_tela_exportacao(driver)
     try: _mark_radio_exact(driver, "Data de Emissão")
     except Exception: pass
@@ -235,42 +236,44 @@ def _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, considerar, nome_empresa):
     _preencher_datas_e_horas(driver, dt_ini, dt_fim)
 
     sufixo = "notas emitidas" if considerar=="emitidas" else "notas recebidas"
+    downloads = obter_rastreador(driver, DOWNLOAD_DIR)
 
     # PDF
     try: _mark_radio_exact(driver, "PDF")
     except Exception: pass
-    before = set(os.listdir(DOWNLOAD_DIR))
+    marca = downloads.marca()
     _force_click(driver, WebDriverWait(driver,30).until(EC.element_to_be_clickable((By.XPATH,"//input[@type='submit' and (contains(@value,'Gerar Arquivo') or contains(@value,'Gerar'))]"))))
     if _fechar_todos_os_modais(driver):
         print(f"📄 {considerar.upper()} (PDF): sem notas no período.")
     else:
-        arq = _wait_new_download(DOWNLOAD_DIR, before, (".pdf",".zip"), timeout=150)
+        with etapa("espera_download", formato="pdf"):
+            arq = downloads.aguardar(marca, (".pdf",".zip"), timeout=150)
         if arq:
-            src = os.path.join(DOWNLOAD_DIR, arq)
-            dest = os.path.join(DOWNLOAD_DIR, f"{nome_empresa}_{sufixo}{os.path.splitext(arq)[1].lower()}")
-            if _rename_with_retry(src, dest):
+            dest = os.path.join(destino_dir, f"{nome_empresa}_{sufixo}{os.path.splitext(arq)[1].lower()}")
+            if _rename_with_retry(arq, dest):
                 print(f"📥 PDF salvo: {os.path.basename(dest)}")
             else:
-                print(f"📥 PDF gerado: {arq} (não consegui renomear)")
+                print(f"📥 PDF gerado: {os.path.basename(arq)} (não consegui renomear)")
         else:
             print("⚠️ Solicitei PDF, mas não detectei download.")
 
     # XML
     try: _mark_radio_exact(driver, "XML")
     except Exception: pass
-    before = set(os.listdir(DOWNLOAD_DIR))
+    marca = downloads.marca()
     _force_click(driver, WebDriverWait(driver,30).until(EC.element_to_be_clickable((By.XPATH,"//input[@type='submit' and (contains(@value,'Gerar Arquivo') or contains(@value,'Gerar'))]"))))
     if _fechar_todos_os_modais(driver):
         print(f"🗂 {considerar.upper()} (XML): sem notas no período.")
     else:
-        arq = _wait_new_download(DOWNLOAD_DIR, before, (".xml",".zip"), timeout=180)
+        with etapa("espera_download", formato="xml"):
+            arq = downloads.aguardar(marca, (".xml",".zip"), timeout=180)
         if arq:
-            src = os.path.join(DOWNLOAD_DIR, arq)
-            dest = os.path.join(DOWNLOAD_DIR, f"{nome_empresa}_{sufixo}{os.path.splitext(arq)[1].lower()}")
-            if _rename_with_retry(src, dest):
+            dest = os.path.join(destino_dir, f"{nome_empresa}_{sufixo}{os.path.splitext(arq)[1].lower()}")
+            if _rename_with_retry(arq, dest):
                 print(f"📥 XML salvo: {os.path.basename(dest)}")
+                ingerir_no_acervo(dest, "Osasco")
             else:
-                print(f"📥 XML gerado: {arq} (não consegui renomear)")
+                print(f"📥 XML gerado: {os.path.basename(arq)} (não consegui renomear)")
         else:
             print("⚠️ Solicitei XML, mas o navegador pode ter bloqueado.")
 
@@ -291,34 +294,26 @@ def _abrir_livro_fiscal(driver):
         _force_click(driver, item)
     _esperar_overlay_sumir(driver, 3); _fechar_todos_os_modais(driver)
 
-def _select_option_by_text_flexible(sel: Select, alvo_texto: str, numero_mes: int | None = None):
-    alvo_norm = _norm(alvo_texto).lower()
-    for t in {alvo_texto, alvo_texto.title(), alvo_texto.upper(), alvo_texto.lower()}:
-        try: sel.select_by_visible_text(t); return True
-        except Exception: pass
-    for t in {alvo_texto, alvo_texto.title(), alvo_texto.upper(), alvo_texto.lower()}:
-        try: sel.select_by_value(t); return True
-        except Exception: pass
-    for i, opt in enumerate(sel.options):
-        if _norm(opt.text).lower().find(alvo_norm) >= 0:
-            sel.select_by_index(i); return True
-    if numero_mes:
-        for t in {str(numero_mes), f"{numero_mes:02d}"}:
-            try: sel.select_by_value(t); return True
-            except Exception: pass
-    return False
+def _select_option_by_text_flexible(sel: Select, alvo_texto: str, numero_mes: int | None = None, opcoes=None):
+    # texto exato → valor → texto contendo (sem acento) → número do mês; opções lidas numa chamada só
+    return selecionar_flex(sel, alvo_texto, numero_mes=numero_mes, opcoes=opcoes)
 
 def _selecionar_exercicio_mes(driver, ano, mes_num):
     sel_ano = Select(WebDriverWait(driver,30).until(EC.presence_of_element_located((By.XPATH,"//select[contains(@id,'Exercicio') or contains(@name,'Exercicio') or contains(@id,'ddlExercicio')]"))))
-    _select_option_by_text_flexible(sel_ano, str(ano))
+    if not _select_option_by_text_flexible(sel_ano, str(ano)):
+        raise ValueError(f"Exercício {ano} não está entre as opções do Livro Fiscal.")
     sel_mes = Select(WebDriverWait(driver,30).until(EC.presence_of_element_located((By.XPATH,"//select[contains(@id,'Mes') or contains(@name,'Mes') or contains(@id,'ddlMes')]"))))
     alvo = PT_MESES.get(mes_num, "").title()
+    opcoes = None
     try:
-        idx = max(0, sel_mes.all_selected_options[0].index - 1)
-        sel_mes.select_by_index(idx); time.sleep(0.1)
+        atual = ler_select(sel_mes)
+        opcoes = atual["opcoes"]
+        selecionar_indice(sel_mes, max(0, atual["selecionado"] - 1))
+        aguardar_assentada(driver, quieto=0.1, timeout=3, motivo="select_mes")
     except Exception:
         pass
-    _select_option_by_text_flexible(sel_mes, alvo, numero_mes=mes_num)
+    if not _select_option_by_text_flexible(sel_mes, alvo, numero_mes=mes_num, opcoes=opcoes):
+        raise ValueError(f"Mês {alvo or mes_num} não está entre as opções do Livro Fiscal.")
 
 def _mark_radio_exact(driver, label_text):
     xp = f"//input[@type='radio' and (following-sibling::*[contains(.,'{label_text}')])]"
@@ -329,10 +324,11 @@ def _mark_radio_exact(driver, label_text):
     try:
         driver.execute_script("arguments[0].checked=true; arguments[0].dispatchEvent(new Event('change',{bubbles:true}))", r)
     except Exception: pass
-    time.sleep(0.15)
+    aguardar_assentada(driver, quieto=0.1, timeout=3, motivo="radio")   # o change pode disparar postback
     print(f"   🔘 Marcado: {label_text}")
 
-def _gerar_livro(driver, ano, mes_num, tipo_label, nome_final):
+@cronometrado("livro_fiscal")
+def _gerar_livro(driver, ano, mes_num, tipo_label, nome_final, destino_dir):
     _abrir_livro_fiscal(driver)
     _selecionar_exercicio_mes(driver, ano, mes_num)
 
@@ -342,39 +338,37 @@ def _gerar_livro(driver, ano, mes_num, tipo_label, nome_final):
 
     main = driver.current_window_handle
     existentes = set(driver.window_handles)
-    before = set(os.listdir(DOWNLOAD_DIR))
+    downloads = obter_rastreador(driver, DOWNLOAD_DIR)
+    marca = downloads.marca()
 
     btn = WebDriverWait(driver,30).until(EC.element_to_be_clickable((By.XPATH,"//input[@type='submit' and (contains(@value,'Gerar') or contains(@id,'Gerar'))] | //button[contains(.,'Gerar')]")))
     _force_click(driver, btn)
-    time.sleep(0.7)
 
+    # antes: 0.7 s fixos + até 5 s pela janela nova; agora só a espera pela janela
     new = None
-    try:
-        WebDriverWait(driver,5).until(lambda d: len(d.window_handles) > len(existentes))
-        atuais = set(driver.window_handles); dif = list(atuais-existentes)
+    if aguardar(driver, lambda d: len(d.window_handles) > len(existentes), timeout=5, motivo="janela_livro"):
+        dif = list(set(driver.window_handles) - existentes)
         if dif: new = dif[0]
-    except Exception:
-        pass
 
     arq = None
     if new:
         driver.switch_to.window(new)
-        before2 = set(os.listdir(DOWNLOAD_DIR))
-        arq = _wait_new_download(DOWNLOAD_DIR, before2, (".pdf",), timeout=120)
+        with etapa("espera_download", formato="pdf"):
+            arq = downloads.aguardar(marca, (".pdf",), timeout=120)
         try: driver.close()
         except: pass
         try: driver.switch_to.window(main)
         except: driver.switch_to.window(driver.window_handles[0])
     else:
-        arq = _wait_new_download(DOWNLOAD_DIR, before, (".pdf",), timeout=40)
+        with etapa("espera_download", formato="pdf"):
+            arq = downloads.aguardar(marca, (".pdf",), timeout=40)
 
     if arq:
-        src = os.path.join(DOWNLOAD_DIR, arq)
-        dest = os.path.join(DOWNLOAD_DIR, nome_final)
-        if _rename_with_retry(src, dest):
+        dest = os.path.join(destino_dir, nome_final)
+        if _rename_with_retry(arq, dest):
             print(f"📄 Livro salvo: {os.path.basename(dest)}")
         else:
-            print(f"⚠️ Livro baixado como {arq}, não consegui renomear para {nome_final}")
+            print(f"⚠️ Livro baixado como {os.path.basename(arq)}, não consegui renomear para {nome_final}")
     else:
         print("⚠️ Não consegui gerar/baixar este Livro.")
 
@@ -471,21 +465,7 @@ def g__achar_select_mes(driver):
         return WebDriverWait(driver, 6).until(EC.presence_of_element_located((By.XPATH, "(//select)[1]")))
 
 def g__select_text_flex(sel: Select, alvo_txt: str, numero_mes: int | None = None):
-    alvo_n = _norm(alvo_txt).lower()
-    for t in (alvo_txt, alvo_txt.title(), alvo_txt.upper(), alvo_txt.lower()):
-        try: sel.select_by_visible_text(t); return True
-        except Exception: pass
-    for t in (alvo_txt, alvo_txt.title(), alvo_txt.upper(), alvo_txt.lower()):
-        try: sel.select_by_value(t); return True
-        except Exception: pass
-    for i,opt in enumerate(sel.options):
-        if _norm(opt.text).lower().find(alvo_n) >= 0:
-            sel.select_by_index(i); return True
-    if numero_mes:
-        for v in (str(numero_mes), f"{numero_mes:02d}"):
-            try: sel.select_by_value(v); return True
-            except Exception: pass
-    return False
+    return selecionar_flex(sel, alvo_txt, numero_mes=numero_mes)
 
 def _confirm_guia_context(driver):
     # tenta achar um título/indicador de que estamos na tela correta
@@ -500,7 +480,8 @@ def _confirm_guia_context(driver):
         pass
     return False
 
-def g_gerar_guia(driver, ano, mes_num, mes_nome, nome_empresa):
+@cronometrado("guia_iss")
+def g_gerar_guia(driver, ano, mes_num, mes_nome, nome_empresa, destino_dir):
     _abrir_guia_emitidos(driver)
     _esperar_overlay_sumir(driver, 6); _fechar_todos_os_modais(driver)
 
@@ -561,6 +542,8 @@ def g_gerar_guia(driver, ano, mes_num, mes_nome, nome_empresa):
         pass
 
     existentes = set(driver.window_handles)
+    downloads = obter_rastreador(driver, DOWNLOAD_DIR)
+    marca = downloads.marca()
     try:
         _force_click(driver, btns[0])
     except Exception:
@@ -584,23 +567,15 @@ def g_gerar_guia(driver, ano, mes_num, mes_nome, nome_empresa):
         driver.switch_to.window(nova)
 
     # aguarda download
-    before = {f for f in os.listdir(DOWNLOAD_DIR) if not f.endswith(".crdownload")}
-    end = time.time()+120
-    final = None
-    while time.time() < end:
-        atuais = {f for f in os.listdir(DOWNLOAD_DIR) if not f.endswith(".crdownload")}
-        novos = [f for f in (atuais-before) if f.lower().endswith(".pdf")]
-        if novos:
-            final = max(novos, key=lambda n: os.path.getmtime(os.path.join(DOWNLOAD_DIR, n))); break
-        time.sleep(0.4)
+    with etapa("espera_download", formato="pdf"):
+        final = downloads.aguardar(marca, (".pdf",), timeout=120)
 
     if final:
-        src = os.path.join(DOWNLOAD_DIR, final)
-        dest = os.path.join(DOWNLOAD_DIR, f"{nome_empresa}_Guia ISS Prestados.pdf")
-        if _rename_with_retry(src, dest):
+        dest = os.path.join(destino_dir, f"{nome_empresa}_Guia ISS Prestados.pdf")
+        if _rename_with_retry(final, dest):
             print(f"🧾 Guia ISS salva: {os.path.basename(dest)}", flush=True)
         else:
-            print(f"🧾 Guia ISS baixada como {final} (não consegui renomear).", flush=True)
+            print(f"🧾 Guia ISS baixada como {os.path.basename(final)} (não consegui renomear).", flush=True)
     else:
         print("⚠️ Não detectei o download do PDF da Guia ISS.", flush=True)
 
@@ -611,45 +586,54 @@ def g_gerar_guia(driver, ano, mes_num, mes_nome, nome_empresa):
         except: driver.switch_to.window(driver.window_handles[0])
 
 # ======================= MAIN =======================
-def main():
-    dt_ini, dt_fim = calc_intervalo_mes_anterior()
-    print(f"🗓️ Período (mês anterior): {dt_ini.strftime('%d/%m/%Y')} a {dt_fim.strftime('%d/%m/%Y')}")
+def main() -> bool:
+    """True se nenhuma etapa falhou (o código de saída vira o status do job/mês do backfill)."""
+    dt_ini, dt_fim = calc_intervalo_competencia()
+    print(f"🗓️ Período (competência): {dt_ini.strftime('%d/%m/%Y')} a {dt_fim.strftime('%d/%m/%Y')}")
     driver = setup_driver(DOWNLOAD_DIR)
+    obter_rastreador(driver, DOWNLOAD_DIR)
     try:
         aguardar_login_manual(driver)
         _esperar_overlay_sumir(driver, 8); _fechar_todos_os_modais(driver)
 
         nome_empresa = _obter_nome_empresa(driver, "empresa")
         print(f"🏷️ Contribuinte detectado: {nome_empresa}")
+        saida = str(pasta_saida(PORTAL, dt_ini.strftime("%Y-%m"), nome_empresa))
 
-        # 1) Exportações
-        try:
-            _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, "emitidas",  nome_empresa)
-            _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, "recebidas", nome_empresa)
-        except Exception as e:
-            _report_error(e, "Exportação de Notas")
+        with com_empresa(nome_empresa):
+            # 1) Exportações
+            try:
+                _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, "emitidas",  nome_empresa, saida)
+                _abrir_exportar_e_gerar(driver, dt_ini, dt_fim, "recebidas", nome_empresa, saida)
+            except Exception as e:
+                _report_error(e, "Exportação de Notas")
 
-        # 2) Livros (mês/ano do período)
-        ano, mes = dt_ini.year, dt_ini.month
-        try:
-            _gerar_livro(driver, ano, mes, "Notas Fiscais Emitidas",  f"{nome_empresa}_Livro Notas Emitidas.pdf")
-            _gerar_livro(driver, ano, mes, "Notas Fiscais Recebidas", f"{nome_empresa}_Livro Notas Recebidas.pdf")
-        except Exception as e:
-            _report_error(e, "Livro Fiscal")
+            # 2) Livros (mês/ano do período)
+            ano, mes = dt_ini.year, dt_ini.month
+            try:
+                _gerar_livro(driver, ano, mes, "Notas Fiscais Emitidas",  f"{nome_empresa}_Livro Notas Emitidas.pdf", saida)
+                _gerar_livro(driver, ano, mes, "Notas Fiscais Recebidas", f"{nome_empresa}_Livro Notas Recebidas.pdf", saida)
+            except Exception as e:
+                _report_error(e, "Livro Fiscal")
 
-        # 3) Guia ISS — usa o MESMO mês/ano do período (mês anterior)
-        try:
-            mes_nome = PT_MESES.get(mes, "janeiro").title()
-            g_gerar_guia(driver, ano, mes, mes_nome, nome_empresa)
-        except Exception as e:
-            _report_error(e, "Guia ISS (Emitidos)")
+            # 3) Guia ISS — usa o MESMO mês/ano do período (mês anterior)
+            try:
+                mes_nome = PT_MESES.get(mes, "janeiro").title()
+                g_gerar_guia(driver, ano, mes, mes_nome, nome_empresa, saida)
+            except Exception as e:
+                _report_error(e, "Guia ISS (Emitidos)")
 
-        print("\n✅ Fluxo concluído. Verifique a pasta Downloads.")
+        if _FALHAS:
+            print(f"\n⚠️ Fluxo terminou com falhas ({', '.join(_FALHAS)}). Verifique a pasta {saida}.")
+        else:
+            print(f"\n✅ Fluxo concluído. Verifique a pasta {saida}.")
     except Exception as e:
         _report_error(e, "Fluxo principal")
     finally:
         try: driver.quit()
         except: pass
+        limpar_rascunho()
+    return not _FALHAS
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,163 @@
+# pacotes.py — extração dos ZIPs de notas (ex.: "FSist XMLs N...zip").
+# Os membros são validados (caminho absoluto, "..", unidade do Windows e
+# links simbólicos são recusados) e gravados direto na pasta final por um pool
+# de threads, cada uma com o seu handle do ZIP. Cada arquivo é escrito num
+# ".parcial" e publicado por conteúdo (downloads.publicar_dedup): a mesma nota
+# vinda num ZIP de outro mês/portal vira só um hardlink, sem pasta temporária.
+# Os XMLs são lidos (xml_fiscal) enquanto saem do ZIP e entram no acervo
+# num lote só, no fim.
+#
+# Uso:
+#     r = extrair_zip(zip_path, FINAL_DIR, origem="FSist")
+#     r -> {"arquivos": 12000, "xmls": 6000, "recusados": 0, "notas_novas": 6000, "mantidos": 0}
+#     extrair_zip(..., mesclar=True) mantém o que já existe na pasta (sincronização incremental)
+
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from acervo import Acervo
+from downloads import publicar_dedup
+from xml_fiscal import CAMPOS, ler_bytes
+
+WORKERS = int(os.environ.get("ZIP_WORKERS", min(8, (os.cpu_count() or 2) * 2)))
+
+
+def _destino_seguro(destino: Path, nome: str, remover: int):
+    """Caminho de gravação do membro, ou None se o nome for perigoso."""
+    partes = PurePosixPath(nome.replace("\\", "/")).parts
+    if not partes or partes[0] == "/" or ":" in partes[0] or ".." in partes:
+        return None
+    partes = partes[remover:]
+    if not partes:
+        return None
+    alvo = destino.joinpath(*partes)
+    try:
+        alvo.resolve().relative_to(destino.resolve())
+    except ValueError:
+        return None
+    return alvo
+
+
+def _eh_link(info: zipfile.ZipInfo) -> bool:
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+def _pasta_unica(membros) -> int:
+    """1 se todos os membros estão sob a mesma pasta de topo (ela é descartada), senão 0."""
+    topos = {m.filename.replace("\\", "/").split("/", 1)[0] for m in membros}
+    if len(topos) == 1 and all("/" in m.filename.replace("\\", "/").strip("/") for m in membros if not m.is_dir()):
+        return 1
+    return 0
+
+
+def extrair_zip(zip_path, destino, origem: str = "", workers: int = WORKERS, mesclar: bool = False) -> dict:
+    """Extrai em `destino`. Com `mesclar`, membros já presentes (mesmo tamanho) são mantidos."""
+    zip_path, destino = Path(zip_path), Path(destino)
+    destino.mkdir(parents=True, exist_ok=True)
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def _zf():
+        if not hasattr(local, "zf"):
+            local.zf = zipfile.ZipFile(zip_path)
+            with handles_lock:
+                handles.append(local.zf)
+        return local.zf
+
+    def _extrair(info, alvo: Path):
+        if mesclar and alvo.is_file() and alvo.stat().st_size == info.file_size:
+            return False
+        alvo.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=alvo.parent, prefix=alvo.name + ".", suffix=".parcial")
+        os.close(fd)
+        tmp = Path(tmp)
+        try:
+            return _gravar(info, alvo, tmp)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _gravar(info, alvo: Path, tmp: Path):
+        lido = None
+        if alvo.suffix.lower() == ".xml":
+            dados = _zf().read(info)            # valida o CRC
+            sha = hashlib.sha256(dados).hexdigest()
+            tmp.write_bytes(dados)
+            try:
+                docs = [{c: getattr(n, c) for c in CAMPOS} for n in ler_bytes(dados, sha)]
+            except Exception as e:
+                print(f"[ZIP] XML ilegível {info.filename}: {e}", flush=True)
+                docs = []
+            lido = (sha, docs)
+        else:
+            h = hashlib.sha256()
+            with _zf().open(info) as src, open(tmp, "wb") as dst:
+                for bloco in iter(lambda: src.read(256 * 1024), b""):
+                    h.update(bloco)
+                    dst.write(bloco)
+            sha = h.hexdigest()
+        publicar_dedup(tmp, alvo, sha=sha)
+        if lido is None:
+            return None
+        return (str(alvo), alvo.stat(), *lido)
+
+    def _extrair_grupo(grupo):
+        # membros que só diferem na caixa caem no mesmo arquivo no Windows/macOS:
+        # vão em sequência, na mesma thread (o último vence, como no unzip)
+        saida = []
+        for info, alvo in grupo:
+            try:
+                saida.append((info, _extrair(info, alvo), None))
+            except Exception as e:
+                saida.append((info, None, e))
+        return saida
+
+    with zipfile.ZipFile(zip_path) as zf:
+        membros = [m for m in zf.infolist() if not m.is_dir()]
+    seguros = [m for m in membros if not _eh_link(m) and _destino_seguro(destino, m.filename, 0)]
+    recusados = len(membros) - len(seguros)
+    for m in membros:
+        if m not in seguros:
+            print(f"[ZIP] Membro recusado: {m.filename!r}", flush=True)
+    remover = _pasta_unica(seguros) if seguros else 0
+    grupos = {}
+    for m in seguros:
+        alvo = _destino_seguro(destino, m.filename, remover)
+        grupos.setdefault(str(alvo).lower(), []).append((m, alvo))
+
+    lidos, mantidos = [], 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="zip") as ex:
+            futuros = [ex.submit(_extrair_grupo, g) for g in grupos.values()]
+            for f in futuros:
+                for info, r, erro in f.result():
+                    if erro is not None:        # CRC inválido, disco cheio...
+                        print(f"[ZIP] Falha ao extrair {info.filename!r}: {erro}", flush=True)
+                        recusados += 1
+                    elif r is False:
+                        mantidos += 1
+                    elif r is not None:
+                        lidos.append(r)
+    finally:
+        for h in handles:
+            h.close()
+
+    novas = 0
+    if lidos:
+        try:
+            acervo = Acervo()
+            try:
+                novas = acervo.registrar(lidos, origem)
+            finally:
+                acervo.fechar()
+        except Exception as e:
+            print(f"[ACERVO] Falha ao indexar {zip_path.name}: {e}", flush=True)
+    return {"arquivos": len(seguros) - mantidos, "xmls": len(lidos), "recusados": recusados,
+            "notas_novas": novas, "mantidos": mantidos}
@@ -0,0 +1,197 @@
+# relatorios.py — planilhas-resumo dos bots (relatorio_nfse *.xlsx, relatorio_nftse.xlsx).
+# Em vez de reler e regravar o .xlsx a cada empresa, cada linha vai para um
+# diário append-only (<planilha>.diario.jsonl, com fsync) e a planilha é
+# escrita uma única vez no fim da execução (openpyxl em modo write_only),
+# preservando as linhas que já existiam nela.
+# Cada execução (JOB_ID) tem o seu diário, travado enquanto ela roda; a
+# materialização acontece sob uma trava exclusiva da planilha e junta o próprio
+# diário com os de execuções que já terminaram (trava livre) — os de jobs ainda
+# rodando ficam para eles. Assim jobs simultâneos na mesma planilha não leem nem
+# apagam as linhas uns dos outros, e os os.replace do .xlsx não se atropelam.
+# Se a execução cair no meio, o diário fica no disco e as linhas dele entram
+# na planilha na próxima materialização. O mesmo vale quando a gravação falha
+# (planilha aberta no Excel, planilha existente ilegível): o erro sobe e o
+# diário fica; só a falta do openpyxl desvia as linhas para o CSV.
+#
+# Uso:
+#     rel = Relatorio(SAIDA_DIR / "relatorio_nftse.xlsx", COLUNAS)
+#     rel.adicionar({...})      # a cada empresa (thread-safe)
+#     rel.materializar()        # no finally do main
+
+import csv
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from downloads import JOB_ID
+
+ESPERA_PLANILHA = 300   # s esperando outro job terminar de gravar a mesma planilha
+
+
+def _travar(caminho: Path, esperar: float = 0):
+    """Abre `caminho` com trava exclusiva entre processos; None se seguir ocupada após `esperar` s."""
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    f = open(caminho, "a+b")
+    fim = time.monotonic() + esperar
+    while True:
+        try:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            if time.monotonic() >= fim:
+                f.close()
+                return None
+            time.sleep(0.2)
+
+
+def _soltar(f, apagar: bool = False):
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+    f.close()
+    if apagar:
+        Path(f.name).unlink(missing_ok=True)
+
+
+def _ler_diario(caminho: Path) -> list:
+    linhas = []
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            for l in f:
+                if not l.strip():
+                    continue
+                try:
+                    linhas.append(json.loads(l))
+                except ValueError:
+                    break   # última linha truncada por uma queda: aproveita as inteiras
+    except FileNotFoundError:
+        pass
+    return linhas
+
+
+class Relatorio:
+    def __init__(self, xlsx, colunas):
+        self.xlsx = Path(xlsx)
+        self.colunas = list(colunas)
+        self.diario = self.xlsx.with_name(f"{self.xlsx.name}.diario.{JOB_ID}.jsonl")
+        self.csv_path = self.xlsx.with_suffix(".csv")
+        self._trava_planilha = self.xlsx.with_name(self.xlsx.name + ".lock")
+        self._lock = threading.Lock()
+        self._f = None
+        self._trava = None      # trava do próprio diário: "este job ainda está rodando"
+
+    def adicionar(self, row: dict):
+        linha = json.dumps({c: row.get(c, "") for c in self.colunas}, ensure_ascii=False)
+        with self._lock:
+            if self._f is None:
+                self.xlsx.parent.mkdir(parents=True, exist_ok=True)
+                self._trava = _travar(self.diario.with_name(self.diario.name + ".lock"))
+                self._f = open(self.diario, "a", encoding="utf-8")
+            self._f.write(linha + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def pendentes(self) -> list:
+        """Linhas do diário deste job ainda não gravadas na planilha."""
+        return _ler_diario(self.diario)
+
+    def materializar(self):
+        """Grava a planilha uma vez (existente + diários livres) e descarta esses diários. Retorna o caminho."""
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            planilha = _travar(self._trava_planilha, ESPERA_PLANILHA)
+            if planilha is None:
+                raise TimeoutError(f"{self.xlsx.name} ocupada por outro job há {ESPERA_PLANILHA}s")
+            travas = []
+            try:
+                diarios = []
+                for d in sorted(self.xlsx.parent.glob(self.xlsx.name + ".diario*.jsonl")):
+                    if d == self.diario:
+                        diarios.append(d)
+                        continue
+                    t = _travar(d.with_name(d.name + ".lock"))
+                    if t is not None:       # dono terminou (ou caiu): as linhas entram agora
+                        travas.append(t)
+                        diarios.append(d)
+                novas = [l for d in diarios for l in _ler_diario(d)]
+                if not novas:
+                    return None
+                try:
+                    destino = self._gravar_xlsx(novas)
+                except ImportError as e:
+                    # fallback para CSV se openpyxl não estiver disponível
+                    destino = self._gravar_csv(novas)
+                    print(f"[LOG] Aviso: sem openpyxl ({e}). Salvei no CSV: {destino}", flush=True)
+                # outros erros sobem com os diários intactos: a próxima execução materializa de novo
+                for d in diarios:
+                    d.unlink(missing_ok=True)
+                if self._trava is not None:
+                    _soltar(self._trava, apagar=True)
+                    self._trava = None
+                return destino
+            finally:
+                for t in travas:
+                    _soltar(t, apagar=not Path(t.name[:-len(".lock")]).exists())
+                _soltar(planilha)
+
+    # ---------- internos ----------
+    def _linhas_existentes(self):
+        from openpyxl import load_workbook
+        if not self.xlsx.exists():
+            return
+        try:
+            wb = load_workbook(self.xlsx, read_only=True)
+        except Exception as e:
+            # regravar sem as linhas antigas apagaria a planilha: melhor não gravar
+            raise RuntimeError(f"não consegui ler a planilha existente {self.xlsx.name} ({e})") from e
+        try:
+            linhas = wb.active.iter_rows(values_only=True)
+            cab = next(linhas, None)
+            if not cab:
+                return
+            for vals in linhas:
+                d = dict(zip(cab, vals))
+                yield [d.get(c) if d.get(c) is not None else "" for c in self.colunas]
+        finally:
+            wb.close()
+
+    def _gravar_xlsx(self, novas: list) -> Path:
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(self.colunas)
+        for vals in self._linhas_existentes():
+            ws.append(vals)
+        for row in novas:
+            ws.append([row.get(c, "") for c in self.colunas])
+        tmp = self.xlsx.with_name(self.xlsx.name + ".parcial")
+        try:
+            wb.save(tmp)
+            os.replace(tmp, self.xlsx)   # PermissionError se estiver aberta no Excel
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return self.xlsx
+
+    def _gravar_csv(self, novas: list) -> Path:
+        write_header = not self.csv_path.exists()
+        with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=self.colunas, extrasaction="ignore")
+            if write_header:
+                w.writeheader()
+            w.writerows(novas)
+        return self.csv_path
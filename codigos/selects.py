@@ -0,0 +1,126 @@
+# selects.py — leitura e escolha de <select> numa chamada só.
+# Ler `.text` de cada <option> pelo Selenium custa uma ida e volta por opção
+# (uma lista de 300 contribuintes = 300+ chamadas), e cada tentativa falha de
+# select_by_visible_text/select_by_value custa outras tantas. Aqui um único
+# execute_script devolve todos os selects do documento (ou do frame) atual —
+# id, name, visibilidade, opção marcada, textos/valores e o próprio elemento —
+# e a escolha é feita em Python e aplicada por JS (selectedIndex + change).
+#
+# Uso:
+#     for s in listar_selects(driver):          # contexto atual (topo ou frame)
+#         s["el"], s["id"], s["opcoes"] -> [(texto, valor), ...]
+#     selecionar_flex(el, "Setembro", numero_mes=9)
+#     selects_da_pagina(driver)                 # topo + iframes de mesma origem, com "frame"
+
+import unicodedata
+
+from selenium.webdriver.support.ui import Select
+
+# "frame": -1 = topo, i = window.top.frames[i], -2 = frame aninhado/desconhecido
+JS_SELECTS = r"""
+var alvo = arguments[0], todos = arguments[1], max = arguments[2];
+function aqui(w) {
+  try { if (w === w.top) return -1; var i = Array.prototype.indexOf.call(w.top.frames, w); return i < 0 ? -2 : i; }
+  catch (e) { return -2; }
+}
+function ler(s, i, frame, comEl) {
+  var r = {indice: i, frame: frame, id: s.id || '', name: s.name || '', selecionado: s.selectedIndex,
+           visivel: !!(s.offsetWidth || s.offsetHeight || s.getClientRects().length),
+           opcoes: Array.prototype.map.call(s.options, function(o){
+             return [(o.text || '').replace(/\s+/g, ' ').trim(), o.value];
+           })};
+  if (comEl) r.el = s;
+  return r;
+}
+if (alvo) return [ler(alvo, 0, aqui(window), true)];
+var meu = aqui(window), saida = [];
+Array.prototype.forEach.call(document.querySelectorAll('select'), function(s, i){ saida.push(ler(s, i, meu, true)); });
+if (!todos) return saida;
+var topo;
+try { topo = window.top; topo.document; } catch (e) { return saida; }
+var docs = [[-1, topo]];
+for (var f = 0; f < Math.min(topo.frames.length, max); f++) docs.push([f, topo.frames[f]]);
+docs.forEach(function(par){
+  if (par[0] === meu) return;
+  try {
+    Array.prototype.forEach.call(par[1].document.querySelectorAll('select'), function(s, i){ saida.push(ler(s, i, par[0], false)); });
+  } catch (e) {}
+});
+return saida;
+"""
+
+JS_ESCOLHER = r"""
+var s = arguments[0], i = arguments[1];
+if (s.selectedIndex === i) return false;
+s.selectedIndex = i;
+s.dispatchEvent(new Event('input', {bubbles: true}));
+s.dispatchEvent(new Event('change', {bubbles: true}));
+return true;
+"""
+
+
+def _el(sel):
+    return sel._el if isinstance(sel, Select) else sel
+
+
+def _norm(txt: str) -> str:
+    t = unicodedata.normalize("NFKD", txt or "")
+    return "".join(ch for ch in t if not unicodedata.combining(ch)).strip().lower()
+
+
+def listar_selects(driver, el=None) -> list:
+    """Selects do documento atual (ou só `el`), cada um com o WebElement em "el"."""
+    return driver.execute_script(JS_SELECTS, el, False, 0) or []
+
+
+def selects_da_pagina(driver, max_scan: int = 12) -> list:
+    """Selects do topo e dos iframes de mesma origem; "el" só vem nos do contexto atual."""
+    return driver.execute_script(JS_SELECTS, None, True, max_scan) or []
+
+
+def ler_select(sel) -> dict:
+    """Um select (WebElement ou Select): id, name, "selecionado", "opcoes"... numa chamada."""
+    el = _el(sel)
+    r = listar_selects(el.parent, el)
+    return r[0] if r else {"opcoes": [], "selecionado": -1}
+
+
+def ler_opcoes(sel) -> list:
+    """[(texto, valor), ...] de um select numa chamada."""
+    return [tuple(o) for o in ler_select(sel)["opcoes"]]
+
+
+def indice_da_opcao(opcoes, alvo: str, numero_mes: int | None = None):
+    """Mesma ordem de tentativas de antes: texto exato (variações de caixa), valor,
+    texto contendo o alvo (sem acento) e, para meses, o valor numérico."""
+    textos = [t for t, _ in opcoes]
+    valores = [v for _, v in opcoes]
+    variantes = (alvo, alvo.title(), alvo.upper(), alvo.lower())
+    for lista in (textos, valores):
+        for t in variantes:
+            if t in lista:
+                return lista.index(t)
+    alvo_n = _norm(alvo)
+    for i, t in enumerate(textos):
+        if alvo_n in _norm(t):
+            return i
+    if numero_mes:
+        for v in (str(numero_mes), f"{numero_mes:02d}"):
+            if v in valores:
+                return valores.index(v)
+    return None
+
+
+def selecionar_indice(sel, indice: int) -> bool:
+    """Marca a opção `indice` e dispara input/change (False se já estava marcada)."""
+    el = _el(sel)
+    return bool(el.parent.execute_script(JS_ESCOLHER, el, indice))
+
+
+def selecionar_flex(sel, alvo: str, numero_mes: int | None = None, opcoes=None) -> bool:
+    opcoes = ler_opcoes(sel) if opcoes is None else opcoes
+    i = indice_da_opcao(opcoes, alvo, numero_mes)
+    if i is None:
+        return False
+    selecionar_indice(sel, i)
+    return True
@@ -0,0 +1,263 @@
+# xml_fiscal.py — leitura dos XMLs fiscais baixados pelos bots.
+# Reconhece os três layouts que chegam até nós:
+#   - NF-e (FSist):              <infNFe Id="NFe<chave>"> emit/dest/ICMSTot
+#   - NFS-e Nacional:            <infNFSe Id="NFS<chave>"> emit/toma/valores
+#   - NFS-e ABRASF (Osasco):     <InfNfse> PrestadorServico/TomadorServico/Valores
+# Um arquivo pode ter várias notas (ex.: lote exportado pela prefeitura); cada
+# uma vira uma NotaFiscal, o "prestador" é o emitente da nota.
+#
+# A leitura é em streaming (iterparse): cada elemento é descartado assim que
+# o texto é aproveitado, as tags são comparadas pelo nome local (sem o
+# namespace) e, quando só interessam alguns campos (ex.: nomes), a leitura
+# para assim que eles aparecem. O resultado completo de cada arquivo fica num
+# cache (sha256 do conteúdo; caminho+tamanho+mtime evitam até reler o arquivo).
+
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from xml.etree import ElementTree as ET
+
+CACHE_DB = Path(os.environ.get("XML_CACHE_DB") or Path.home() / ".automacao" / "xml_cache.sqlite")
+VERSAO = 1          # mude ao alterar as regras abaixo: invalida o cache
+
+RAIZES = {"infNFe": "NFe", "infNFSe": "NFSe", "InfNfse": "NFSe-ABRASF"}
+NOMES = {"RazaoSocial", "xNome", "NomeFantasia"}
+
+# campo -> alternativas (blocos ancestrais exigidos | None, tags), em ordem de preferência
+REGRAS = {
+    "NFe": {
+        "numero": [({"ide"}, {"nNF"})],
+        "emissao": [({"ide"}, {"dhEmi", "dEmi"})],
+        "cnpj_prestador": [({"emit"}, {"CNPJ", "CPF"})],
+        "nome_prestador": [({"emit"}, {"xNome"})],
+        "cnpj_tomador": [({"dest"}, {"CNPJ", "CPF"})],
+        "nome_tomador": [({"dest"}, {"xNome"})],
+        "valor": [({"ICMSTot"}, {"vNF"})],
+        "iss": [({"ISSQNtot"}, {"vISS"})],
+    },
+    "NFSe": {
+        "numero": [(None, {"nNFSe"})],
+        "emissao": [({"infDPS"}, {"dhEmi"}), (None, {"dhProc"})],
+        "competencia": [({"infDPS"}, {"dCompet"})],
+        "cnpj_prestador": [({"emit"}, {"CNPJ", "CPF"}), ({"prest"}, {"CNPJ", "CPF"})],
+        "nome_prestador": [({"emit"}, {"xNome"})],
+        "cnpj_tomador": [({"toma"}, {"CNPJ", "CPF"})],
+        "nome_tomador": [({"toma"}, {"xNome"})],
+        "valor": [({"vServPrest"}, {"vServ"}), (None, {"vLiq"})],
+        "iss": [(None, {"vISSQN"})],
+    },
+    "NFSe-ABRASF": {
+        "numero": [(None, {"Numero"})],
+        "verificacao": [(None, {"CodigoVerificacao"})],
+        "emissao": [(None, {"DataEmissao"})],
+        "competencia": [(None, {"Competencia"})],
+        "cnpj_prestador": [({"PrestadorServico", "Prestador"}, {"Cnpj", "Cpf"})],
+        "nome_prestador": [({"PrestadorServico", "Prestador"}, {"RazaoSocial"})],
+        "cnpj_tomador": [({"TomadorServico", "Tomador"}, {"Cnpj", "Cpf"})],
+        "nome_tomador": [({"TomadorServico", "Tomador"}, {"RazaoSocial"})],
+        "valor": [(None, {"ValorServicos"})],
+        "iss": [(None, {"ValorIss"})],
+    },
+}
+
+
+@dataclass
+class NotaFiscal:
+    chave: str = ""
+    modelo: str = ""
+    numero: str = ""
+    emissao: str = ""               # AAAA-MM-DD
+    competencia: str = ""           # AAAA-MM
+    cnpj_prestador: str = ""
+    nome_prestador: str = ""
+    cnpj_tomador: str = ""
+    nome_tomador: str = ""
+    valor: float | None = None
+    iss: float | None = None
+    nomes: tuple = ()               # primeiros nomes distintos na ordem do arquivo (fallback)
+
+
+CAMPOS = tuple(f.name for f in fields(NotaFiscal) if f.name != "nomes")
+
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _valor(txt: str):
+    try:
+        return float(txt.replace(",", ".")) if txt else None
+    except ValueError:
+        return None
+
+
+def _so_digitos(txt: str) -> str:
+    return "".join(c for c in txt if c.isdigit())
+
+
+def _montar(modelo: str, id_attr: str, achados: dict, nomes: list) -> NotaFiscal:
+    v = {k: t for k, (_, t) in achados.items()}
+    emissao = v.get("emissao", "")[:10]
+    if modelo == "NFSe-ABRASF":
+        # sem chave de acesso no ABRASF: prestador + número + código de verificação
+        chave = f"{v.get('cnpj_prestador', '')}-{v['numero']}-{v.get('verificacao', '')}" if v.get("numero") else ""
+    else:
+        chave = _so_digitos(id_attr)
+    return NotaFiscal(
+        chave=chave, modelo=modelo, numero=v.get("numero", ""), emissao=emissao,
+        competencia=(v.get("competencia") or emissao)[:7],
+        cnpj_prestador=v.get("cnpj_prestador", ""), nome_prestador=v.get("nome_prestador", ""),
+        cnpj_tomador=v.get("cnpj_tomador", ""), nome_tomador=v.get("nome_tomador", ""),
+        valor=_valor(v.get("valor", "")), iss=_valor(v.get("iss", "")), nomes=tuple(nomes),
+    )
+
+
+def _ler(fonte, ate=None) -> list:
+    """Notas de `fonte` (caminho ou arquivo binário). Com `ate`, para na primeira nota
+    assim que esses campos aparecem."""
+    notas = []
+    pilha = []                      # nomes locais abertos desde a raiz do documento
+    modelo = regras = None
+    id_attr, achados, nomes = "", {}, []
+    for evento, elem in ET.iterparse(fonte, events=("start", "end")):
+        nome = _local(elem.tag)
+        if evento == "start":
+            if modelo is None and nome in RAIZES:
+                modelo, regras = RAIZES[nome], REGRAS[RAIZES[nome]]
+                id_attr, achados, nomes, pilha = elem.get("Id", ""), {}, [], []
+            elif modelo is not None:
+                pilha.append(nome)
+            continue
+
+        if modelo is None:
+            elem.clear()
+            continue
+        if pilha and pilha[-1] == nome:
+            pilha.pop()
+            texto = (elem.text or "").strip()
+            if texto:
+                ancestrais = set(pilha)
+                for campo, alternativas in regras.items():
+                    for prio, (blocos, tags) in enumerate(alternativas):
+                        if nome in tags and (blocos is None or blocos & ancestrais):
+                            if campo not in achados or prio < achados[campo][0]:
+                                achados[campo] = (prio, texto)
+                            break
+                if nome in NOMES and texto not in nomes and len(nomes) < 2:
+                    nomes.append(texto)
+            elem.clear()
+            if ate and all(c in achados for c in ate):
+                return [_montar(modelo, id_attr, achados, nomes)]
+        elif nome in RAIZES and RAIZES[nome] == modelo:
+            notas.append(_montar(modelo, id_attr, achados, nomes))
+            modelo = regras = None
+            elem.clear()
+    return notas
+
+
+# ========= CACHE =========
+
+class _Cache:
+    def __init__(self, caminho: Path):
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(caminho, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")   # é só cache: sem fsync a cada leitura
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS leituras (sha256 TEXT PRIMARY KEY, versao INTEGER, notas TEXT);
+            CREATE TABLE IF NOT EXISTS arquivos (caminho TEXT PRIMARY KEY, tamanho INTEGER, mtime REAL, sha256 TEXT);
+        """)
+        self._lock = threading.Lock()
+
+    def sha_do_arquivo(self, caminho: str, st):
+        with self._lock:
+            r = self._db.execute("SELECT tamanho, mtime, sha256 FROM arquivos WHERE caminho = ?", (caminho,)).fetchone()
+        return r[2] if r and r[0] == st.st_size and r[1] == st.st_mtime else None
+
+    def obter(self, sha: str):
+        with self._lock:
+            r = self._db.execute("SELECT notas FROM leituras WHERE sha256 = ? AND versao = ?", (sha, VERSAO)).fetchone()
+        if r is None:
+            return None
+        return [NotaFiscal(**{**d, "nomes": tuple(d.get("nomes", ()))}) for d in json.loads(r[0])]
+
+    def gravar(self, sha: str, notas: list, caminho: str | None = None, st=None):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO leituras VALUES (?, ?, ?)",
+                             (sha, VERSAO, json.dumps([asdict(n) for n in notas], ensure_ascii=False)))
+            if caminho:
+                self._db.execute("INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?)",
+                                 (caminho, st.st_size, st.st_mtime, sha))
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def _cache():
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            try:
+                _CACHE = _Cache(CACHE_DB)
+            except Exception as e:
+                print(f"[XML] Cache indisponível ({e}); lendo sem cache.", flush=True)
+                _CACHE = False
+        return _CACHE or None
+
+
+# ========= API =========
+
+def ler_bytes(dados: bytes, sha: str | None = None, caminho: str | None = None, st=None) -> list:
+    """Notas contidas no XML (bytes), pelo cache quando o conteúdo já foi lido.
+    Sem chave própria, a nota recebe sha256 do arquivo + posição."""
+    sha = sha or hashlib.sha256(dados).hexdigest()
+    cache = _cache()
+    notas = cache.obter(sha) if cache else None
+    if notas is None:
+        notas = _ler(io.BytesIO(dados))
+        for i, n in enumerate(notas):
+            n.chave = n.chave or f"sha256:{sha}#{i}"
+        if cache:
+            cache.gravar(sha, notas, caminho, st)
+    elif cache and caminho:
+        cache.gravar(sha, notas, caminho, st)
+    return notas
+
+
+def ler_arquivo(caminho) -> list:
+    """Notas do arquivo; se caminho/tamanho/mtime não mudaram, nem abre o arquivo."""
+    caminho = str(caminho)
+    st = os.stat(caminho)
+    cache = _cache()
+    sha = cache.sha_do_arquivo(caminho, st) if cache else None
+    notas = cache.obter(sha) if sha else None
+    if notas is not None:
+        return notas
+    return ler_bytes(Path(caminho).read_bytes(), caminho=caminho, st=st)
+
+
+def ler_documentos(dados: bytes, sha: str | None = None) -> list:
+    """Compatível com o acervo: as notas como dicts (campos de CAMPOS)."""
+    return [{c: getattr(n, c) for c in CAMPOS} for n in ler_bytes(dados, sha)]
+
+
+def ler_nomes(caminho) -> dict:
+    """{"prestador", "tomador"} da primeira nota, parando a leitura assim que os dois aparecem."""
+    caminho = str(caminho)
+    cache = _cache()
+    sha = cache.sha_do_arquivo(caminho, os.stat(caminho)) if cache else None
+    notas = cache.obter(sha) if sha else None
+    if notas is None:
+        notas = _ler(caminho, ate=("nome_prestador", "nome_tomador"))
+    if not notas:
+        return {"prestador": "", "tomador": ""}
+    n = notas[0]
+    prestador = n.nome_prestador or (n.nomes[0] if n.nomes else "")
+    tomador = n.nome_tomador or next((x for x in n.nomes if x != prestador), "")
+    return {"prestador": prestador, "tomador": tomador}
@@ -0,0 +1,346 @@
+# jobs.py — fila de execução dos scripts de automação.
+# Cada rota do app.py enfileira um job; um pool de workers drena a fila
+# respeitando o limite de execuções simultâneas por script (cada script
+# abre o seu próprio Chrome, então o padrão é 1 por script).
+#
+# Backfill: um intervalo de competências (AAAA-MM a AAAA-MM) vira um job por
+# mês ("script --competencia AAAA-MM"), liberados aos poucos (até o limite do
+# script) conforme os anteriores terminam. Com o pool ativo, cada mês pega a
+# sessão de Chrome já logada que o mês anterior devolveu. Meses concluídos
+# ficam num diário; pedir o mesmo intervalo de novo só roda o que faltou.
+
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+# ========= CONFIG (sobrescreva via variáveis de ambiente) =========
+WORKERS = int(os.environ.get("JOBS_WORKERS", 2))            # scripts rodando ao mesmo tempo (total)
+MAX_FILA = int(os.environ.get("JOBS_MAX_FILA", 20))         # jobs pendentes aceitos
+LIMITE_POR_SCRIPT = int(os.environ.get("JOBS_LIMITE_POR_SCRIPT", 1))
+# ex.: JOBS_LIMITES="nfse_bot.py=2,osasco_fluxo.py=1"
+LIMITES = {
+    k.strip(): int(v)
+    for k, v in (p.split("=", 1) for p in os.environ.get("JOBS_LIMITES", "").split(",") if "=" in p)
+}
+HISTORICO = 200  # jobs finalizados mantidos em memória
+LINHAS_POR_JOB = int(os.environ.get("JOBS_LINHAS_LOG", 2000))  # ring buffer da saída de cada job
+ECO_SAIDA = os.environ.get("JOBS_ECO", "0") == "1"  # repete a saída dos jobs no console do servidor (depuração)
+
+# portal de cada script → perfil de Chrome emprestado do pool (chrome_pool.py)
+PERFIS_CHROME = {
+    "automacao_fsist_recebidas.py": "fsist",
+    "nfse_bot.py": "pmsp",
+    "nftse_nfts_bot.py": "pmsp",
+    "nfsenacional_emitidasrecebidas.py": "nfse_nacional",
+    "osasco_fluxo.py": "osasco",
+}
+
+# scripts que aceitam --competencia de qualquer mês (o FSist só tem o atalho "Mês passado")
+SEM_BACKFILL = {"automacao_fsist_recebidas.py"}
+BACKFILL_SCRIPTS = set(PERFIS_CHROME) - SEM_BACKFILL
+
+BACKFILL_DIARIO = Path(os.environ.get("JOBS_BACKFILL_DIARIO", Path.home() / ".automacao" / "backfill.jsonl"))
+
+RE_PROGRESSO = re.compile(r"\[(\d+)/(\d+)\]")  # ex.: "----- [12/150] EMPRESA -----" do nfse_bot
+
+
+class FilaCheia(Exception):
+    pass
+
+
+def meses_entre(inicio: str, fim: str) -> list:
+    """["AAAA-MM", ...] de `inicio` a `fim`, inclusive."""
+    def _ler(txt):
+        m = re.fullmatch(r"(\d{4})-(\d{2})", (txt or "").strip())
+        if not m or not 1 <= int(m.group(2)) <= 12:
+            raise ValueError(f"Competência inválida: {txt!r} (use AAAA-MM).")
+        return int(m.group(1)), int(m.group(2))
+    a, m = _ler(inicio)
+    fim_a, fim_m = _ler(fim)
+    if (a, m) > (fim_a, fim_m):
+        raise ValueError(f"Intervalo invertido: {inicio} > {fim}.")
+    lista = []
+    while (a, m) <= (fim_a, fim_m):
+        lista.append(f"{a:04d}-{m:02d}")
+        a, m = (a + 1, 1) if m == 12 else (a, m + 1)
+    return lista
+
+
+class Job:
+    def __init__(self, script: str, args=()):
+        self.id = uuid.uuid4().hex[:12]
+        self.script = script
+        self.args = tuple(args)
+        self.status = "pendente"      # pendente → executando → concluido | erro
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.finalizado_em = None
+        self.returncode = None
+        self.processo = None
+        self.progresso = None         # (atual, total) quando o script loga "[i/N]"
+        self._linhas = deque(maxlen=LINHAS_POR_JOB)   # (seq, texto)
+        self._seq = 0
+        self._cond_log = threading.Condition()
+
+    @property
+    def finalizado(self) -> bool:
+        return self.status in ("concluido", "erro")
+
+    def adicionar_linha(self, texto: str):
+        m = RE_PROGRESSO.search(texto)
+        with self._cond_log:
+            self._seq += 1
+            self._linhas.append((self._seq, texto))
+            if m:
+                self.progresso = (int(m.group(1)), int(m.group(2)))
+            self._cond_log.notify_all()
+
+    def linhas_desde(self, seq: int = 0) -> list:
+        with self._cond_log:
+            return [item for item in self._linhas if item[0] > seq]
+
+    def aguardar_linhas(self, seq: int, timeout: float = 15):
+        """Bloqueia até haver linhas após `seq` (ou o job terminar). Retorna (linhas, finalizado)."""
+        with self._cond_log:
+            self._cond_log.wait_for(lambda: self._seq > seq or self.finalizado, timeout)
+            return [item for item in self._linhas if item[0] > seq], self.finalizado
+
+    def notificar(self):
+        with self._cond_log:
+            self._cond_log.notify_all()
+
+    @property
+    def chave(self):
+        return (self.script, self.args)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "script": self.script,
+            "args": list(self.args),
+            "status": self.status,
+            "criado_em": self.criado_em,
+            "iniciado_em": self.iniciado_em,
+            "finalizado_em": self.finalizado_em,
+            "returncode": self.returncode,
+            "progresso": list(self.progresso) if self.progresso else None,
+            "linhas": self._seq,
+        }
+
+
+class Backfill:
+    def __init__(self, script: str, meses: list, paralelo: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.script = script
+        self.meses = list(meses)
+        self.paralelo = max(1, paralelo)
+        self.criado_em = time.time()
+        self.estado = {m: "pendente" for m in self.meses}   # pendente → fila → concluido | erro | ja_concluido
+        self.jobs = {}                                      # competência -> job id
+
+    def em_andamento(self) -> int:
+        return sum(1 for s in self.estado.values() if s == "fila")
+
+    def proximo(self):
+        return next((m for m in self.meses if self.estado[m] == "pendente"), None)
+
+    def to_dict(self) -> dict:
+        contagem = {}
+        for s in self.estado.values():
+            contagem[s] = contagem.get(s, 0) + 1
+        return {
+            "id": self.id,
+            "script": self.script,
+            "inicio": self.meses[0],
+            "fim": self.meses[-1],
+            "paralelo": self.paralelo,
+            "criado_em": self.criado_em,
+            "resumo": contagem,
+            "meses": [{"competencia": m, "status": self.estado[m], "job_id": self.jobs.get(m)} for m in self.meses],
+        }
+
+
+class GerenciadorJobs:
+    def __init__(self, caminho_codigos: str, workers: int = WORKERS, max_fila: int = MAX_FILA,
+                 limites: dict | None = None, pool=None):
+        self.caminho_codigos = caminho_codigos
+        self.pool = pool              # PoolChrome opcional: Chromes já abertos e logados
+        self.workers = max(1, workers)
+        self.max_fila = max_fila
+        self.limites = dict(LIMITES if limites is None else limites)
+        self._cond = threading.Condition()
+        self._pendentes = deque()
+        self._rodando = {}            # script -> quantidade em execução
+        self._jobs = {}               # id -> Job
+        self._finalizados = deque()
+        self._threads = []
+        self._backfills = {}          # id -> Backfill
+        self._job_backfill = {}       # job id -> [(Backfill, competência)]
+        self._meses_concluidos = self._ler_diario()   # {(script, competência)}
+
+    # ---------- API ----------
+    def iniciar(self):
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def enfileirar(self, script: str, args=(), forcar: bool = False):
+        """Retorna (job, novo). Um job idêntico ainda pendente é reaproveitado.
+        `forcar` ignora o tamanho máximo da fila (o backfill já dosa o que enfileira)."""
+        self.iniciar()
+        chave = (script, tuple(args))
+        with self._cond:
+            for job in self._pendentes:
+                if job.chave == chave:
+                    return job, False
+            if len(self._pendentes) >= self.max_fila and not forcar:
+                raise FilaCheia(f"Fila cheia ({self.max_fila} jobs pendentes).")
+            job = Job(script, args)
+            self._pendentes.append(job)
+            self._jobs[job.id] = job
+            self._cond.notify_all()
+            return job, True
+
+    def obter(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def listar(self) -> list:
+        with self._cond:
+            return [j.to_dict() for j in self._jobs.values()]
+
+    def limite(self, script: str) -> int:
+        return self.limites.get(script, LIMITE_POR_SCRIPT)
+
+    # ---------- backfill ----------
+    def backfill(self, script: str, inicio: str, fim: str, paralelo: int | None = None) -> Backfill:
+        """Agenda um job por competência de `inicio` a `fim` (AAAA-MM), pulando as já concluídas."""
+        if script not in BACKFILL_SCRIPTS:
+            raise ValueError(f"{script} não faz backfill (só processa o mês passado).")
+        bf = Backfill(script, meses_entre(inicio, fim), paralelo or self.limite(script))
+        with self._cond:
+            for m in bf.meses:
+                if (script, m) in self._meses_concluidos:
+                    bf.estado[m] = "ja_concluido"
+            self._backfills[bf.id] = bf
+            self._avancar(bf)
+        return bf
+
+    def obter_backfill(self, bf_id: str):
+        with self._cond:
+            return self._backfills.get(bf_id)
+
+    def listar_backfills(self) -> list:
+        with self._cond:
+            return [bf.to_dict() for bf in self._backfills.values()]
+
+    def _avancar(self, bf: Backfill):
+        with self._cond:
+            while bf.em_andamento() < bf.paralelo:
+                m = bf.proximo()
+                if m is None:
+                    return
+                job, _ = self.enfileirar(bf.script, ("--competencia", m), forcar=True)
+                bf.estado[m] = "fila"
+                bf.jobs[m] = job.id
+                self._job_backfill.setdefault(job.id, []).append((bf, m))
+
+    def _ao_finalizar(self, job: Job):
+        with self._cond:
+            for bf, m in self._job_backfill.pop(job.id, []):
+                bf.estado[m] = job.status
+                if job.status == "concluido":
+                    self._registrar_mes(bf.script, m)
+                self._avancar(bf)
+
+    def _ler_diario(self) -> set:
+        feitos = set()
+        try:
+            with open(BACKFILL_DIARIO, encoding="utf-8") as f:
+                for linha in f:
+                    try:
+                        r = json.loads(linha)
+                        feitos.add((r["script"], r["competencia"]))
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return feitos
+
+    def _registrar_mes(self, script: str, competencia: str):
+        self._meses_concluidos.add((script, competencia))
+        try:
+            BACKFILL_DIARIO.parent.mkdir(parents=True, exist_ok=True)
+            with open(BACKFILL_DIARIO, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"script": script, "competencia": competencia, "em": time.time()}) + "\n")
+        except OSError as e:
+            print(f"[JOBS] Não consegui gravar o diário do backfill: {e}", flush=True)
+
+    # ---------- workers ----------
+    def _proximo(self) -> Job:
+        with self._cond:
+            while True:
+                for job in self._pendentes:
+                    if self._rodando.get(job.script, 0) < self.limite(job.script):
+                        self._pendentes.remove(job)
+                        self._rodando[job.script] = self._rodando.get(job.script, 0) + 1
+                        job.status = "executando"
+                        job.iniciado_em = time.time()
+                        return job
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            job = self._proximo()
+            try:
+                self._executar(job)
+            except Exception as e:
+                print(f"[JOBS] Falha ao executar {job.script} ({job.id}): {e}", flush=True)
+                job.status = "erro"
+            finally:
+                job.notificar()
+                with self._cond:
+                    job.finalizado_em = time.time()
+                    self._rodando[job.script] -= 1
+                    self._finalizados.append(job.id)
+                    while len(self._finalizados) > HISTORICO:
+                        self._jobs.pop(self._finalizados.popleft(), None)
+                    self._cond.notify_all()
+                self._ao_finalizar(job)
+
+    def _executar(self, job: Job):
+        cmd = [sys.executable, os.path.join(self.caminho_codigos, job.script), *job.args]
+        env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8", AUTOMACAO_JOB_ID=job.id)
+        perfil = PERFIS_CHROME.get(job.script)
+        sessao = None
+        if self.pool is not None and perfil:
+            sessao = self.pool.emprestar(perfil)
+            env["CHROME_DEBUGGER_ADDRESS"] = sessao.endereco
+            job.adicionar_linha(f"[JOBS] Usando Chrome do pool: {sessao.nome} ({sessao.endereco})")
+        try:
+            job.processo = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env,
+                text=True, encoding="utf-8", errors="replace", bufsize=1,
+            )
+            # lê linha a linha (nunca o buffer inteiro); o ring buffer limita a memória
+            for linha in job.processo.stdout:
+                linha = linha.rstrip("\r\n")
+                if ECO_SAIDA:
+                    print(f"[{job.script} {job.id}] {linha}", flush=True)
+                job.adicionar_linha(linha)
+            job.returncode = job.processo.wait()
+        finally:
+            if sessao is not None:
+                self.pool.devolver(sessao)
+        job.status = "concluido" if job.returncode == 0 else "erro"